@@ -0,0 +1,71 @@
+"""
+JWT authentication that keeps the authenticated user in the cache.
+
+JWTAuthentication reads the user from the database on every request to
+check that it still exists and is active. CachedJWTAuthentication keeps the
+user it read in the Django cache for AUTH_USER_CACHE_TIMEOUT seconds, so a
+client's requests in that window authenticate without a query. The same
+checks run on the cached copy: inactive users are refused, and with
+SIMPLE_JWT's CHECK_REVOKE_TOKEN so are tokens issued before a password
+change.
+
+Saving or deleting a user drops it from the cache. With the default
+per-process local-memory cache that only reaches the process that saved it;
+the others, and updates made with QuerySet.update(), catch up when the
+entry expires, so keep the timeout short or configure a shared cache.
+AUTH_USER_CACHE_TIMEOUT = 0 turns the cache off.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+DEFAULT_TIMEOUT = 60
+
+
+def cache_key(user_id):
+    return f'accounts:auth-user:{user_id}'
+
+
+def cache_timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def forget_user(user_id):
+    cache.delete(cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the token's user through the cache.
+    """
+
+    def get_user(self, validated_token):
+        timeout = cache_timeout()
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if not timeout or user_id is None:
+            return super().get_user(validated_token)
+        user = cache.get(cache_key(user_id))
+        if user is None:
+            # Raises for unknown and inactive users, which are not cached.
+            user = super().get_user(validated_token)
+            cache.set(cache_key(user_id), user, timeout)
+            return user
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def _forget_changed_user(sender, instance, **kwargs):
+    forget_user(getattr(instance, api_settings.USER_ID_FIELD))
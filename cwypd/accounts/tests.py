@@ -1,3 +1,62 @@
-from django.test import TestCase
-
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication
+from .tokens import create_jwt_pair_for_user
+
+User = get_user_model()
+
+
+class CachedJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='jane@example.com', password='pass12345', username='jane')
+        token = create_jwt_pair_for_user(self.user)['access']
+        self.request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def authenticate(self):
+        user, _ = CachedJWTAuthentication().authenticate(self.request)
+        return user
+
+    def test_user_is_read_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(), self.user)
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual(user, self.user)
+        # Each request gets its own copy.
+        user.username = 'changed'
+        self.assertEqual(self.authenticate().username, 'jane')
+
+    def test_saved_user_is_read_again(self):
+        self.authenticate()
+        self.user.department = 'HR'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate().department, 'HR')
+
+    def test_deactivated_or_deleted_user_is_refused(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_updates_bypassing_save_wait_for_the_timeout(self):
+        self.authenticate()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.authenticate()
+        with override_settings(AUTH_USER_CACHE_TIMEOUT=0), self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=0)
+    def test_timeout_zero_disables_the_cache(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.authenticate()
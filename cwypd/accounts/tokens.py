@@ -1,11 +1,11 @@
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import RefreshToken
-
-User = get_user_model()
-
-
-def create_jwt_pair_for_user(user: User):
-    refresh = RefreshToken.for_user(user)
-    tokens = {"access": str(refresh.access_token), "refresh": str(refresh)}
-
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import RefreshToken
+
+User = get_user_model()
+
+
+def create_jwt_pair_for_user(user: User):
+    refresh = RefreshToken.for_user(user)
+    tokens = {"access": str(refresh.access_token), "refresh": str(refresh)}
+
     return tokens
\ No newline at end of file
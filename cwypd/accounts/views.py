@@ -1,56 +1,56 @@
-from django.contrib.auth import authenticate
-from django.shortcuts import render
-from rest_framework import generics, status
-from rest_framework.request import Request
-from rest_framework.response import Response
-from rest_framework.views import APIView
-
-from .serializers import SignUpSerializer
-from .tokens import create_jwt_pair_for_user
-
-# Create your views here.
-
-
-class SignUpView(generics.GenericAPIView):
-    serializer_class = SignUpSerializer
-    permission_classes = []
-
-    def post(self, request: Request):
-        data = request.data
-
-        serializer = self.serializer_class(data=data)
-
-        if serializer.is_valid():
-            serializer.save()
-
-            response = {"message": "User Created Successfully", "data": serializer.data}
-
-            return Response(data=response, status=status.HTTP_201_CREATED)
-
-        return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
-class LoginView(APIView):
-    permission_classes = []
-
-    def post(self, request: Request):
-        email = request.data.get("email")
-        password = request.data.get("password")
-        username = request.data.get("username")
-
-        user = authenticate(email=email, password=password)
-
-        if user is not None:
-
-            tokens = create_jwt_pair_for_user(user)
-
-            response = {"message": "Login Successfull", "tokens": tokens,"email":email,"name":username}
-            return Response(data=response, status=status.HTTP_200_OK)
-
-        else:
-            return Response(data={"message": "Invalid email or password"})
-
-    def get(self, request: Request):
-        content = {"user": str(request.user), "auth": str(request.auth)}
-
+from django.contrib.auth import authenticate
+from django.shortcuts import render
+from rest_framework import generics, status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .serializers import SignUpSerializer
+from .tokens import create_jwt_pair_for_user
+
+# Create your views here.
+
+
+class SignUpView(generics.GenericAPIView):
+    serializer_class = SignUpSerializer
+    permission_classes = []
+
+    def post(self, request: Request):
+        data = request.data
+
+        serializer = self.serializer_class(data=data)
+
+        if serializer.is_valid():
+            serializer.save()
+
+            response = {"message": "User Created Successfully", "data": serializer.data}
+
+            return Response(data=response, status=status.HTTP_201_CREATED)
+
+        return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LoginView(APIView):
+    permission_classes = []
+
+    def post(self, request: Request):
+        email = request.data.get("email")
+        password = request.data.get("password")
+        username = request.data.get("username")
+
+        user = authenticate(email=email, password=password)
+
+        if user is not None:
+
+            tokens = create_jwt_pair_for_user(user)
+
+            response = {"message": "Login Successfull", "tokens": tokens,"email":email,"name":username}
+            return Response(data=response, status=status.HTTP_200_OK)
+
+        else:
+            return Response(data={"message": "Invalid email or password"})
+
+    def get(self, request: Request):
+        content = {"user": str(request.user), "auth": str(request.auth)}
+
         return Response(data=content, status=status.HTTP_200_OK)
\ No newline at end of file
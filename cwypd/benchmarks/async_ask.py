@@ -0,0 +1,86 @@
+"""
+Throughput of the WSGI-style ask path against the native async one.
+
+Both paths use a fake LLM with a fixed latency. The sync view is driven from
+a thread pool the size of a threaded WSGI worker. The async view is driven
+from a single event loop, the way the ASGI application serves it.
+
+    python -m benchmarks.async_ask --requests 200 --threads 8 --latency 0.2 [--write-behind]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import FAKE_BACKENDS, create_user, report, setup_django, summarize
+
+
+def run_sync(requests, threads, auth_header):
+    from django.test import Client
+
+    def one(_):
+        start = time.perf_counter()
+        response = Client().post(
+            '/ask/', {'query': 'How much holiday do I get?'},
+            content_type='application/json', HTTP_AUTHORIZATION=auth_header,
+        )
+        assert response.status_code == 200, response.content
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run_async(requests, auth_header):
+    from django.test import AsyncClient
+
+    client = AsyncClient()
+
+    async def one():
+        start = time.perf_counter()
+        response = await client.post(
+            '/ask/async/', {'query': 'How much holiday do I get?'},
+            content_type='application/json', headers={'Authorization': auth_header},
+        )
+        assert response.status_code == 200, response.content
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8, help='threads of the simulated WSGI worker')
+    parser.add_argument('--latency', type=float, default=0.2, help='fake LLM latency in seconds')
+    parser.add_argument('--write-behind', action='store_true', help='buffer the question and answer rows')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    setup_django(chatbot={
+        **FAKE_BACKENDS,
+        'FAKE_LLM_LATENCY': args.latency,
+        # One user sends every request, and hundreds at once.
+        'ASK_USER_RATE': None,
+        'ASK_MAX_CONCURRENT': None,
+        'AUDIT_WRITE_BEHIND': args.write_behind,
+        'AUDIT_SPOOL_DIR': tempfile.mkdtemp(prefix='cwypd-spool-'),
+    })
+    from chatbot.models import Conversation
+
+    user, auth_header = create_user()
+    Conversation.objects.create(user=user)
+
+    report({
+        f'wsgi ({args.threads} threads)': run_sync(args.requests, args.threads, auth_header),
+        'asgi (async view)': asyncio.run(run_async(args.requests, auth_header)),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Cost of authenticating a JWT request, with and without the user cache.
+
+Runs each mode twice: authenticate() alone on a prepared request, which is
+the per-request overhead, and GET /messages/search/ through the whole stack,
+a cheap authenticated endpoint. `uncached` is JWTAuthentication's behaviour,
+one user SELECT per request (AUTH_USER_CACHE_TIMEOUT = 0); `cached` keeps
+the user in the local-memory cache. Reports latency and queries per request.
+Use --profile postgres to pay a network round trip per query, with the
+POSTGRES_* variables pointing at a throwaway database.
+
+    python -m benchmarks.auth --requests 5000 --profile sqlite
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from .utils import create_user, report, setup_django, summarize
+
+
+def measure(requests, call):
+    from django.db import connection
+
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    call()  # warm up, and fill the cache
+    latencies = []
+    with connection.execute_wrapper(count):
+        start = time.perf_counter()
+        for _ in range(requests):
+            began = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - began)
+        elapsed = time.perf_counter() - start
+    row = summarize(latencies, elapsed)
+    row['queries_per_request'] = round(queries / requests, 2)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000, help='requests per mode')
+    parser.add_argument('--profile', default='sqlite', help='database profile (see cwypd/databases.py)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    from cwypd.databases import database_settings
+
+    directory = None if args.profile == 'postgres' else Path(tempfile.mkdtemp(prefix='cwypd-bench-'))
+    setup_django(database=database_settings(args.profile, directory))
+    from django.core.cache import cache
+    from django.test import Client, RequestFactory, override_settings
+
+    from accounts.authentication import CachedJWTAuthentication
+
+    user, auth_header = create_user()
+    request = RequestFactory().get('/', HTTP_AUTHORIZATION=auth_header)
+    client = Client()
+
+    def authenticate():
+        assert CachedJWTAuthentication().authenticate(request)[0].pk == user.pk
+
+    def search():
+        response = client.get('/messages/search/', {'q': 'holiday'}, HTTP_AUTHORIZATION=auth_header)
+        assert response.status_code == 200, response.content
+
+    results = {}
+    for mode, timeout in (('uncached', 0), ('cached', 60)):
+        cache.clear()
+        with override_settings(AUTH_USER_CACHE_TIMEOUT=timeout):
+            results[f'{mode} authenticate'] = measure(args.requests, authenticate)
+            results[f'{mode} request'] = measure(args.requests, search)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Write throughput of MessageCreateView under each database profile.
+
+Every profile runs in its own process on a fresh database. Threads post
+messages to a handful of conversations, as a threaded WSGI worker would, and
+every request writes the question and the reply in one transaction. The
+postgres profile writes to the database named by the POSTGRES_* variables, so
+point them at a throwaway database.
+
+    python -m benchmarks.db_profiles --requests 400 --threads 8 --profile sqlite --profile sqlite-wal
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .utils import create_user, report, setup_django, summarize
+
+
+def run_profile(profile, requests, threads, conversations):
+    from cwypd.databases import database_settings
+
+    if profile == 'postgres':
+        database = database_settings(profile, None)
+    else:
+        database = database_settings(profile, Path(tempfile.mkdtemp(prefix='cwypd-bench-')))
+    setup_django(database=database)
+
+    from django.db import connection
+    from django.test import Client
+    from chatbot.models import Conversation, Message
+
+    user, auth_header = create_user()
+    Message.objects.all().delete()
+    ids = [Conversation.objects.create(user=user).id for _ in range(conversations)]
+    connection.close()
+
+    def one(i):
+        start = time.perf_counter()
+        response = Client().post(
+            f'/conversation/{ids[i % len(ids)]}/create-message/', {'content': f'Message {i}'},
+            content_type='application/json', HTTP_AUTHORIZATION=auth_header,
+        )
+        assert response.status_code == 200, response.content
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    row = summarize(latencies, time.perf_counter() - start)
+    row['rows_per_s'] = round(2 * row['throughput_rps'], 1)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profile', action='append', help='profile to run (repeatable; default: both SQLite ones)')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--conversations', type=int, default=8)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        row = run_profile(args.profile[0], args.requests, args.threads, args.conversations)
+        print(json.dumps(row))
+        return
+
+    results = {}
+    for profile in args.profile or ['sqlite', 'sqlite-wal']:
+        # One process per profile: Django's connection settings are fixed at setup.
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.db_profiles', '--child', '--profile', profile,
+             '--requests', str(args.requests), '--threads', str(args.threads),
+             '--conversations', str(args.conversations)],
+            check=True, stdout=subprocess.PIPE, text=True, env={**os.environ, 'CWYPD_DB_PROFILE': profile},
+        ).stdout
+        results[profile] = json.loads(output.strip().splitlines()[-1])
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Deleting large conversations: the ORM cascade against soft delete and purge.
+
+Seeds conversations with MESSAGES messages each (half of them replies), as
+many questions and answers, then deletes them both ways while a thread keeps
+posting messages to another conversation, as other users would. Reports how
+long the delete request takes, how long the rows take to go, and the latency
+of the concurrent writes, which wait whenever the delete holds the write lock.
+
+    python -m benchmarks.delete --conversations 3 --messages 20000 --batch-size 1000
+"""
+import argparse
+import threading
+import time
+
+from .utils import create_user, report, setup_django, summarize
+
+
+def seed(user, messages):
+    from chatbot.models import ChatbotResponse, Conversation, Message, UserQuestion
+
+    conversation = Conversation.objects.create(user=user)
+    for offset in range(0, messages // 2, 5000):
+        count = min(5000, messages // 2 - offset)
+        questions = Message.objects.bulk_create(
+            Message(conversation=conversation, content=f'Question {offset + n}') for n in range(count)
+        )
+        Message.objects.bulk_create(
+            Message(conversation=conversation, content='Answer', is_from_user=False, in_reply_to=question)
+            for question in questions
+        )
+        UserQuestion.objects.bulk_create(
+            UserQuestion(conversation=conversation, user=user, question_text='Question') for _ in range(count)
+        )
+        ChatbotResponse.objects.bulk_create(
+            ChatbotResponse(conversation=conversation, response_text='Answer') for _ in range(count)
+        )
+    return conversation
+
+
+class BackgroundWriter(threading.Thread):
+    """
+    Post messages to one conversation until stopped, timing each request.
+    """
+
+    def __init__(self, conversation, auth_header):
+        super().__init__(daemon=True)
+        self.url = f'/conversation/{conversation.id}/create-message/'
+        self.auth_header = auth_header
+        self.latencies = []
+        self.stop = threading.Event()
+
+    def run(self):
+        from django.db import connection
+        from django.test import Client
+
+        client = Client()
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            response = client.post(
+                self.url, {'content': 'Still here'},
+                content_type='application/json', HTTP_AUTHORIZATION=self.auth_header,
+            )
+            assert response.status_code == 200, response.content
+            self.latencies.append(time.perf_counter() - start)
+            time.sleep(0.005)
+        connection.close()
+
+
+def measure(user, auth_header, args, delete, purge=False):
+    from chatbot.models import Conversation
+
+    conversations = [seed(user, args.messages) for _ in range(args.conversations)]
+    writer = BackgroundWriter(Conversation.objects.create(user=user), auth_header)
+    writer.start()
+    time.sleep(0.2)
+    request_latencies, start = [], time.perf_counter()
+    for conversation in conversations:
+        began = time.perf_counter()
+        delete(conversation)
+        request_latencies.append(time.perf_counter() - began)
+    requests_done = time.perf_counter() - start
+    purge_elapsed = None
+    if purge:
+        from chatbot.jobs import run_pending
+
+        began = time.perf_counter()
+        run_pending()
+        purge_elapsed = time.perf_counter() - began
+    gone = time.perf_counter() - start
+    writer.stop.set()
+    writer.join()
+
+    row = summarize(request_latencies, requests_done)
+    row['rows_gone_s'] = round(gone, 3)
+    if purge_elapsed is not None:
+        row['purge_s'] = round(purge_elapsed, 3)
+    writes = summarize(writer.latencies, gone)
+    row['writer_p99_ms'] = writes['p99_ms']
+    row['writer_max_ms'] = round(max(writer.latencies) * 1000, 2) if writer.latencies else None
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=3, help='conversations deleted per mode')
+    parser.add_argument('--messages', type=int, default=20000, help='messages per conversation')
+    parser.add_argument('--batch-size', type=int, default=1000, help='PURGE_BATCH_SIZE')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    setup_django(chatbot={'PURGE_BATCH_SIZE': args.batch_size})
+    from django.test import Client
+
+    user, auth_header = create_user()
+    client = Client()
+
+    def orm_delete(conversation):
+        conversation.delete()
+
+    def soft_delete(conversation):
+        response = client.delete(f'/conversations/{conversation.id}/delete/', HTTP_AUTHORIZATION=auth_header)
+        assert response.status_code == 200, response.content
+
+    results = {
+        'orm cascade': measure(user, auth_header, args, orm_delete),
+        'soft delete': measure(user, auth_header, args, soft_delete, purge=True),
+    }
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
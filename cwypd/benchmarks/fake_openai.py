@@ -0,0 +1,150 @@
+"""
+Local OpenAI-compatible server answering with fakes, for load tests.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings with
+configurable latency, so the real OpenAI backends, HTTP client included,
+run against it. Point the chatbot at it with OPENAI_API_BASE:
+
+    python -m benchmarks.fake_openai --port 8765 --latency 0.3 --sigma 0.5 --token-delay 0.01
+    OPENAI_API_KEY=fake OPENAI_API_BASE=http://127.0.0.1:8765/v1 CHATBOT_VECTORSTORE=chatbot.fakes.fake_vectorstore \
+        python manage.py runserver
+"""
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from chatbot.fakes import FakeEmbeddings, sample_latency
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path.endswith('/chat/completions'):
+            self.chat_completion(body)
+        elif self.path.endswith('/embeddings'):
+            self.embeddings(body)
+        else:
+            self.send_json({'error': {'message': f'Unknown path {self.path}'}}, status=404)
+
+    def chat_completion(self, body):
+        options = self.server.options
+        text = options['responses'][next(self.server.counter) % len(options['responses'])]
+        tokens = re.findall(r'\s*\S+', text) or [text]
+        completion_id, created, model = f'chatcmpl-{uuid.uuid4().hex}', int(time.time()), body.get('model', 'fake')
+        time.sleep(sample_latency(options['latency'], options['sigma']))
+        if not body.get('stream'):
+            time.sleep(options['token_delay'] * len(tokens))
+            self.send_json({
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+                'usage': self.usage(body, tokens),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        deltas = [{'role': 'assistant', 'content': ''}] + [{'content': token} for token in tokens] + [{}]
+        for i, delta in enumerate(deltas):
+            if 0 < i < len(deltas) - 1:
+                time.sleep(options['token_delay'])
+            chunk = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if delta else 'stop'}],
+            }
+            self.write_chunk(f'data: {json.dumps(chunk)}\n\n')
+        self.write_chunk('data: [DONE]\n\n')
+        self.write_chunk('')
+
+    def embeddings(self, body):
+        options = self.server.options
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        time.sleep(sample_latency(options['embedding_latency'], options['sigma']))
+        # Token id lists arrive when the client tokenized; they embed deterministically all the same.
+        vectors = self.server.embedder.embed_documents(
+            [text if isinstance(text, str) else json.dumps(text) for text in inputs]
+        )
+        self.send_json({
+            'object': 'list',
+            'model': body.get('model', 'fake'),
+            'data': [{'object': 'embedding', 'index': i, 'embedding': vector} for i, vector in enumerate(vectors)],
+            'usage': {'prompt_tokens': len(inputs), 'total_tokens': len(inputs)},
+        })
+
+    def usage(self, body, tokens):
+        prompt = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4
+        return {'prompt_tokens': prompt, 'completion_tokens': len(tokens), 'total_tokens': prompt + len(tokens)}
+
+    def send_json(self, data, status=200):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def make_server(host='127.0.0.1', port=0, latency=0.2, sigma=0.0, token_delay=0.0, embedding_latency=0.02,
+                dimensions=64, responses=('This is a fake answer.',)):
+    """
+    Build the server; port 0 picks a free port (see server.server_address).
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.options = {
+        'latency': latency, 'sigma': sigma, 'token_delay': token_delay,
+        'embedding_latency': embedding_latency, 'responses': list(responses),
+    }
+    server.embedder = FakeEmbeddings(size=dimensions)
+    server.counter = itertools.count()
+    return server
+
+
+def serve_in_thread(**options):
+    """
+    Start a server on a free port in a daemon thread and return its /v1 base URL.
+    """
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, name='fake-openai', daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f'http://{host}:{port}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help='median time to first token in seconds')
+    parser.add_argument('--sigma', type=float, default=0.0, help='log-normal spread of the latencies')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='seconds between streamed tokens')
+    parser.add_argument('--embedding-latency', type=float, default=0.02)
+    parser.add_argument('--dimensions', type=int, default=64)
+    parser.add_argument('--response', action='append', help='canned answer (repeatable)')
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port, args.latency, args.sigma, args.token_delay, args.embedding_latency,
+        args.dimensions, args.response or ('This is a fake answer.',),
+    )
+    print(f'Serving fake OpenAI API on http://{args.host}:{server.server_address[1]}/v1')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+End-to-end load test of the API against fake LLM and embedding backends.
+
+Virtual users run a scripted session concurrently:
+- sign up and log in
+- create a conversation
+- send messages
+- ask questions
+- list their conversations and messages
+
+Each request is timed and its database queries counted, per endpoint. By
+default the LLM and embeddings are the in-process fakes from chatbot.fakes.
+With --llm server they are the real OpenAI backends talking to
+benchmarks/fake_openai.py over HTTP. The vector store is always the
+in-process fake.
+
+Results go to a JSON file; pass an earlier one as --baseline to compare.
+
+    python -m benchmarks.load --users 40 --concurrency 8 --latency 0.2 --sigma 0.5 --output run.json
+    python -m benchmarks.load --users 40 --concurrency 8 --baseline run.json
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import FAKE_BACKENDS, report, setup_django, summarize
+
+QUESTIONS = [
+    'How much holiday do I get?',
+    'When are expenses paid?',
+    'Can I carry holiday over to next year?',
+    'Who approves my expenses?',
+]
+
+
+class Recorder:
+    """
+    Latency, status and query count of every request, by endpoint.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, send, expected=200):
+        from django.db import connection
+
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = send()
+        elapsed = time.perf_counter() - start
+        # LoginView answers a wrong password with 200 and no tokens.
+        ok = response.status_code == expected and (endpoint != 'login' or 'tokens' in response.json())
+        with self._lock:
+            self.samples[endpoint].append((elapsed, ok, queries))
+        return response
+
+    def results(self, elapsed):
+        rows = {}
+        for endpoint, samples in self.samples.items():
+            row = summarize([latency for latency, _, _ in samples], elapsed)
+            queries = [count for _, _, count in samples]
+            row['errors'] = sum(1 for _, ok, _ in samples if not ok)
+            row['queries_mean'] = round(sum(queries) / len(queries), 1)
+            row['queries_max'] = max(queries)
+            rows[endpoint] = row
+        rows['total'] = summarize([s[0] for samples in self.samples.values() for s in samples], elapsed)
+        rows['total']['errors'] = sum(row['errors'] for row in rows.values() if 'errors' in row)
+        return rows
+
+
+def session(recorder, n, messages, asks):
+    from django.test import Client
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    client = Client()
+    email, password = f'load{n}@example.com', 'load-pass-123'
+    recorder.request('signup', lambda: client.post(
+        '/signup/',
+        {'email': email, 'username': f'load{n}', 'password': password, 'department': 'Load', 'employee_id': n},
+        content_type='application/json',
+    ), expected=201)
+    login = recorder.request('login', lambda: client.post(
+        '/login/', {'email': email, 'password': password}, content_type='application/json',
+    )).json()
+    if 'tokens' not in login:
+        return  # counted as an error; the rest of the session needs a token
+    access = login['tokens']['access']
+    auth = {'HTTP_AUTHORIZATION': 'Bearer ' + access}
+    # ConversationSerializer wants the user's id, which the client only has in the token.
+    user_id = AccessToken(access)['user_id']
+
+    def post(path, data):
+        return client.post(path, data, content_type='application/json', **auth)
+
+    created = recorder.request(
+        'create_conversation', lambda: post('/conversations/', {'title': f'Load {n}', 'user': user_id}), expected=201,
+    )
+    if created.status_code != 201:
+        return
+    conversation = created.json()['id']
+    for i in range(messages):
+        recorder.request('send_message', lambda: post(
+            f'/conversation/{conversation}/create-message/', {'content': f'Message {i} from user {n}'},
+        ))
+    for i in range(asks):
+        recorder.request('ask', lambda: post(
+            '/ask/', {'query': QUESTIONS[(n + i) % len(QUESTIONS)], 'conversation_id': conversation},
+        ))
+    recorder.request('list_conversations', lambda: client.get('/conversations/', **auth))
+    recorder.request('list_messages', lambda: client.get(f'/conversation/{conversation}/list-messages/', **auth))
+
+
+def compare(results, baseline):
+    """
+    Print the change of throughput and p95 against a baseline run.
+    """
+    print('\nagainst baseline:')
+    for endpoint, row in results.items():
+        before = baseline['results'].get(endpoint)
+        if not before or not before.get('p95_ms'):
+            continue
+        p95 = (row['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+        rps = (row['throughput_rps'] - before['throughput_rps']) / before['throughput_rps'] * 100
+        print(f'{endpoint:<24} p95 {p95:+.1f}%  throughput {rps:+.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8, help='sessions run at once')
+    parser.add_argument('--messages', type=int, default=3, help='messages sent per session')
+    parser.add_argument('--asks', type=int, default=3, help='questions asked per session')
+    parser.add_argument('--llm', choices=['fake', 'server'], default='fake')
+    parser.add_argument('--latency', type=float, default=0.2, help='median LLM latency in seconds')
+    parser.add_argument('--sigma', type=float, default=0.5, help='log-normal spread of the latencies')
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    parser.add_argument('--embedding-latency', type=float, default=0.02)
+    parser.add_argument('--fast-passwords', action='store_true', help='MD5 password hashing, as in tests')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    args = parser.parse_args()
+
+    chatbot = {
+        **FAKE_BACKENDS,
+        'FAKE_LLM_LATENCY': args.latency,
+        'FAKE_LLM_LATENCY_SIGMA': args.sigma,
+        'FAKE_LLM_TOKEN_DELAY': args.token_delay,
+        'FAKE_EMBEDDING_LATENCY': args.embedding_latency,
+        'FAKE_EMBEDDING_LATENCY_SIGMA': args.sigma,
+    }
+    if args.llm == 'server':
+        from .fake_openai import serve_in_thread
+
+        _, base_url = serve_in_thread(
+            latency=args.latency, sigma=args.sigma, token_delay=args.token_delay,
+            embedding_latency=args.embedding_latency,
+        )
+        chatbot.update({
+            'EMBEDDINGS_BACKEND': 'chatbot.backends.openai_embeddings',
+            'LLM_BACKEND': 'chatbot.backends.openai_chat_model',
+            'OPENAI_API_BASE': base_url,
+            'OPENAI_API_KEY': 'fake',
+        })
+    setup_django(chatbot=chatbot)
+    if args.fast_passwords:
+        from django.conf import settings
+        settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for future in [pool.submit(session, recorder, n, args.messages, args.asks) for n in range(args.users)]:
+            future.result()
+    results = recorder.results(time.perf_counter() - start)
+
+    report(results)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            compare(results, json.load(fh))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'config': vars(args), 'results': results}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
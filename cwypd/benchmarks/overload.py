@@ -0,0 +1,94 @@
+"""
+Latency of the ask path under overload, with and without admission control.
+
+Questions arrive at a fixed rate (an open loop, so a slow server does not slow
+the arrivals) at a fake LLM that serves `--capacity` calls at once. Without
+admission control every question queues for the LLM and latency grows for
+as long as the overload lasts. With it, questions beyond the concurrency cap
+and the bounded queue are answered 429 at once, and the ones admitted keep
+a stable p99.
+
+    python -m benchmarks.overload --rate 80 --duration 5 --capacity 4 --latency 0.1
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import FAKE_BACKENDS, create_user, report, setup_django, summarize
+
+
+def run(rate, duration, auth_header):
+    from django.test import Client
+
+    def one(i):
+        start = time.perf_counter()
+        # Distinct questions, so neither the answer cache nor coalescing hides the load.
+        response = Client().post(
+            '/ask/', {'query': f'Question number {i}?'},
+            content_type='application/json', HTTP_AUTHORIZATION=auth_header,
+        )
+        assert response.status_code in (200, 429), response.content
+        return response.status_code, time.perf_counter() - start
+
+    total = int(rate * duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(256) as pool:
+        futures = []
+        for i in range(total):
+            time.sleep(max(0, start + i / rate - time.perf_counter()))
+            futures.append(pool.submit(one, i))
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    rows = {}
+    for code, label in ((200, 'answered'), (429, 'shed')):
+        latencies = [latency for status, latency in results if status == code]
+        rows[label] = summarize(latencies, elapsed)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rate', type=float, default=80, help='questions per second')
+    parser.add_argument('--duration', type=float, default=5, help='seconds of load')
+    parser.add_argument('--capacity', type=int, default=4, help='concurrent calls the fake LLM serves')
+    parser.add_argument('--latency', type=float, default=0.1, help='fake LLM latency in seconds')
+    parser.add_argument('--queue', type=int, default=None, help='ASK_MAX_QUEUE (default: 2 x capacity)')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    setup_django(chatbot={
+        **FAKE_BACKENDS,
+        'FAKE_LLM_LATENCY': args.latency,
+        'FAKE_LLM_CAPACITY': args.capacity,
+        'ANSWER_CACHE_ENABLED': False,
+        'ASK_USER_RATE': None,
+        'ASK_GLOBAL_RATE': None,
+    })
+    from django.conf import settings
+    from django.test import override_settings
+
+    # Every shed question would log a 'Too Many Requests' warning.
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+
+    _, auth_header = create_user()
+    scenarios = {
+        'unbounded': {'ASK_MAX_CONCURRENT': None},
+        'admission': {
+            'ASK_MAX_CONCURRENT': args.capacity,
+            'ASK_MAX_QUEUE': args.queue if args.queue is not None else args.capacity * 2,
+            'ASK_QUEUE_TIMEOUT': 1,
+        },
+    }
+    results = {}
+    for name, overrides in scenarios.items():
+        # override_settings resets the pipeline and the admission controller.
+        with override_settings(CHATBOT={**settings.CHATBOT, **overrides}):
+            for label, row in run(args.rate, args.duration, auth_header).items():
+                results[f'{name} {label}'] = row
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Latency of offset against keyset (cursor) pagination at increasing depth.
+
+Seeds one conversation with many messages and one user with many
+conversations, then requests pages at evenly spaced depths through both list
+endpoints. Offset pages are requested with ?offset=; keyset pages with the
+cursor the previous page would have linked to.
+
+    python -m benchmarks.pagination --messages 50000 --conversations 20000 --pages 200
+"""
+import argparse
+import time
+from base64 import b64encode
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from .utils import create_user, report, setup_django, summarize
+
+
+def seed(model, count, **fields):
+    from django.utils import timezone
+
+    # Distinct timestamps, as real traffic would produce; bulk_create would
+    # otherwise stamp every row with the same auto_now_add value.
+    created_at = model._meta.get_field('created_at')
+    created_at.auto_now_add = False
+    start = timezone.now() - timedelta(seconds=count)
+    try:
+        for offset in range(0, count, 5000):
+            model.objects.bulk_create(
+                model(created_at=start + timedelta(seconds=n), **fields)
+                for n in range(offset, min(offset + 5000, count))
+            )
+    finally:
+        created_at.auto_now_add = True
+
+
+def cursor(position):
+    # Same encoding as rest_framework.pagination.CursorPagination.encode_cursor.
+    return b64encode(urlencode({'p': position}).encode('ascii')).decode('ascii')
+
+
+def run(client, auth_header, urls):
+    latencies = []
+    start = time.perf_counter()
+    for url in urls:
+        began = time.perf_counter()
+        response = client.get(url, HTTP_AUTHORIZATION=auth_header)
+        assert response.status_code == 200, response.content
+        latencies.append(time.perf_counter() - began)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--conversations', type=int, default=20000)
+    parser.add_argument('--pages', type=int, default=200, help='pages requested per mode')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from chatbot.models import Conversation, Message
+
+    user, auth_header = create_user()
+    conversation = Conversation.objects.create(user=user)
+    seed(Message, args.messages, conversation=conversation, content='How much holiday do I get?')
+    seed(Conversation, args.conversations - 1, user=user)
+
+    results = {}
+    client = Client()
+    # The first request pays for URL resolution and the JWT setup.
+    client.get('/conversations/?limit=1', HTTP_AUTHORIZATION=auth_header)
+    for name, base, queryset, page_size in [
+        ('messages', f'/conversation/{conversation.id}/list-messages/?',
+         Message.objects.filter(conversation=conversation).order_by('-created_at'), 10),
+        ('conversations', '/conversations/?ordering=created&',
+         Conversation.objects.filter(user=user).order_by('created_at'), 20),
+    ]:
+        total = queryset.count()
+        depths = [int(total * n / args.pages) for n in range(args.pages)]
+        # Each keyset page starts after the last row of the page before it.
+        positions = {
+            depth: str(queryset.values_list('created_at', flat=True)[depth - 1]) for depth in depths if depth
+        }
+        offset_urls = [f'{base}limit={page_size}&offset={depth}' for depth in depths]
+        keyset_urls = [
+            f'{base}pagination=cursor&page_size={page_size}'
+            + (f'&cursor={cursor(positions[depth])}' if depth else '')
+            for depth in depths
+        ]
+        results[f'{name} offset'] = run(client, auth_header, offset_urls)
+        results[f'{name} keyset'] = run(client, auth_header, keyset_urls)
+
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
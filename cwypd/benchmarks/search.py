@@ -0,0 +1,132 @@
+"""
+Message search: the full-text index against an icontains scan.
+
+Seeds MESSAGES messages of synthetic text, words drawn from a Zipf
+distribution over a VOCABULARY-word vocabulary, spread over USERS users;
+the benchmark user owns USER_MESSAGES of them. Then searches the benchmark
+user's messages for rare words, common words, two-word queries and
+prefixes, through /messages/search/ and, for comparison, with the icontains
+query the endpoint would otherwise need. Reports the latency of each, the
+time seeding took (every insert goes through the index triggers) and the
+time `manage.py rebuild_search_index` takes.
+
+    python -m benchmarks.search --messages 2000000 --users 1000 --user-messages 20000 --queries 50
+"""
+import argparse
+import io
+import itertools
+import random
+import time
+
+from .utils import create_user, report, setup_django, summarize
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'te', 'vi', 'zo', 'pa', 'do', 'gu', 'be', 'fi', 'ho', 'ju']
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def zipf_cum_weights(size, exponent=1.1):
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, size + 1)))
+
+
+def seed(users, counts, words, cum_weights, rng):
+    from chatbot.models import Conversation, Message
+
+    for user, count in zip(users, counts):
+        conversations = Conversation.objects.bulk_create(
+            Conversation(user=user) for _ in range(max(1, count // 200))
+        )
+        for offset in range(0, count, 10000):
+            batch = min(10000, count - offset)
+            Message.objects.bulk_create(
+                Message(
+                    conversation=rng.choice(conversations),
+                    content=' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(6, 30))),
+                    is_from_user=bool(n % 2),
+                )
+                for n in range(batch)
+            )
+
+
+def icontains(user, query, limit):
+    from chatbot.models import Message
+
+    messages = Message.objects.filter(conversation__user=user, conversation__deleted_at__isnull=True)
+    for word in query.split():
+        messages = messages.filter(content__icontains=word)
+    return list(messages.order_by('-pk').values_list('pk', 'content')[:limit])
+
+
+def measure(queries, run):
+    latencies, start = [], time.perf_counter()
+    for query in queries:
+        began = time.perf_counter()
+        run(query)
+        latencies.append(time.perf_counter() - began)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000000, help='messages in total')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--user-messages', type=int, default=20000, help="the benchmark user's messages")
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=50, help='queries per kind')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.test import Client
+
+    rng = random.Random(args.seed)
+    words = vocabulary(args.vocabulary, rng)
+    cum_weights = zipf_cum_weights(len(words))
+    user, auth_header = create_user()
+    others = get_user_model().objects.bulk_create(
+        get_user_model()(username=f'user{n}', email=f'user{n}@example.com') for n in range(args.users - 1)
+    )
+    rest = max(0, args.messages - args.user_messages)
+    counts = [args.user_messages] + [rest // len(others) if others else 0] * len(others)
+    began = time.perf_counter()
+    seed([user, *others], counts, words, cum_weights, rng)
+    seeded = time.perf_counter() - began
+
+    queries = {
+        'rare word': [rng.choice(words[5000:20000]) for _ in range(args.queries)],
+        'common word': [rng.choice(words[:10]) for _ in range(args.queries)],
+        'two words': [f'{rng.choice(words[:200])} {rng.choice(words[:2000])}' for _ in range(args.queries)],
+        'prefix': [rng.choice(words[:2000])[:3] for _ in range(args.queries)],
+    }
+    client = Client()
+
+    def endpoint(query):
+        response = client.get(
+            '/messages/search/', {'q': query, 'page_size': args.page_size}, HTTP_AUTHORIZATION=auth_header
+        )
+        assert response.status_code == 200, response.content
+
+    endpoint(words[0])  # warm up: imports, URL resolution, page cache
+    results = {}
+    for kind, batch in queries.items():
+        results[f'{kind} index'] = measure(batch, endpoint)
+        results[f'{kind} icontains'] = measure(batch, lambda query: icontains(user, query, args.page_size))
+    began = time.perf_counter()
+    call_command('rebuild_search_index', stdout=io.StringIO())
+    results['seed and rebuild'] = {
+        'messages': sum(counts), 'seed_s': round(seeded, 1), 'rebuild_s': round(time.perf_counter() - began, 1),
+    }
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
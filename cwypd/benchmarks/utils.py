@@ -0,0 +1,87 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Each script runs from the project directory, e.g. `python -m benchmarks.async_ask`,
+against a throwaway SQLite database so the development db.sqlite3 is never touched.
+"""
+import json
+import os
+import statistics
+import tempfile
+
+import django
+
+
+def setup_django(chatbot=None, database=None):
+    """
+    Configure Django on a fresh database and migrate it.
+    `chatbot` entries override settings.CHATBOT, e.g. to select the fakes.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cwypd.settings')
+    from django.conf import settings
+
+    default = settings.DATABASES['default']
+    default.update(database or {
+        'NAME': os.path.join(tempfile.mkdtemp(prefix='cwypd-bench-'), 'bench.sqlite3'),
+        'OPTIONS': {**default.get('OPTIONS', {}), 'timeout': 30},
+    })
+    if chatbot:
+        settings.CHATBOT = {**settings.CHATBOT, **chatbot}
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+
+
+FAKE_BACKENDS = {
+    'EMBEDDINGS_BACKEND': 'chatbot.fakes.fake_embeddings',
+    'VECTORSTORE_BACKEND': 'chatbot.fakes.fake_vectorstore',
+    'LLM_BACKEND': 'chatbot.fakes.fake_chat_model',
+    'EMBEDDING_CACHE_PATH': None,
+}
+
+
+def create_user(email='bench@example.com'):
+    """
+    Create a user and return it with a ready-to-use Authorization header value.
+    """
+    from django.contrib.auth import get_user_model
+    from accounts.tokens import create_jwt_pair_for_user
+
+    user = get_user_model().objects.create_user(email=email, password='bench-pass-123', username='bench')
+    return user, 'Bearer ' + create_jwt_pair_for_user(user)['access']
+
+
+def summarize(latencies, elapsed):
+    """
+    Throughput and latency percentiles (ms) for one benchmark run.
+    """
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2)
+
+    return {
+        'requests': len(ordered),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 2) if ordered else None,
+        'p50_ms': pct(50) if ordered else None,
+        'p95_ms': pct(95) if ordered else None,
+        'p99_ms': pct(99) if ordered else None,
+    }
+
+
+def report(results, output=None):
+    """
+    Print results as aligned rows and optionally write them to a JSON file.
+    """
+    for name, row in results.items():
+        cells = '  '.join(f'{key}={value}' for key, value in row.items())
+        print(f'{name:<24} {cells}')
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(results, fh, indent=2)
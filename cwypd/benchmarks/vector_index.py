@@ -0,0 +1,64 @@
+"""
+Recall and latency of the local vector index: brute force against IVF.
+
+Vectors are drawn around random cluster centres, like embeddings of a
+document corpus. Brute-force results are the ground truth for recall@k.
+
+    python -m benchmarks.vector_index --vectors 200000 --dim 384 --nlist 512
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from chatbot.vectorstores import LocalVectorStore
+
+from .utils import report, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vectors', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=None, help='IVF lists (default sqrt(vectors))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(max(1, args.vectors // 200), args.dim))
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(embedding=None, path=path)
+        for start in range(0, args.vectors, 50000):
+            n = min(50000, args.vectors - start)
+            vectors = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.normal(size=(n, args.dim))
+            store.add_embeddings([f'doc {start + i}' for i in range(n)], vectors)
+        queries = centers[rng.integers(0, len(centers), args.queries)] + 0.3 * rng.normal(size=(args.queries, args.dim))
+
+        def run(nprobe=None):
+            latencies, results = [], []
+            start = time.perf_counter()
+            for query in queries:
+                t = time.perf_counter()
+                results.append(set(store.search(query, args.k, nprobe)[0].tolist()))
+                latencies.append(time.perf_counter() - t)
+            return results, summarize(latencies, time.perf_counter() - start)
+
+        truth, brute = run()
+        rows = {'brute force': {**brute, 'recall': 1.0}}
+
+        start = time.perf_counter()
+        store.build_ivf(args.nlist)
+        print(f'built IVF with {len(store._centroids)} lists in {time.perf_counter() - start:.1f}s')
+        for nprobe in args.nprobe:
+            found, stats = run(nprobe)
+            recall = np.mean([len(t & f) / args.k for t, f in zip(truth, found)])
+            rows[f'ivf nprobe={nprobe}'] = {**stats, 'recall': round(float(recall), 4)}
+        report(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Denormalized conversation activity for the conversation list.
+
+Each Conversation keeps its message count, when its last message was
+written, the start of that message and when it was last active, so the
+sidebar renders from the list endpoint alone, sorted by recent activity
+through an index, instead of fetching every conversation's messages.
+
+They are kept up to date with one UPDATE per write: post_save adds each new
+Message, save_exchange folds both its messages and the title into a single
+statement through batch_activity(), and deleting a message re-reads only the
+conversation's latest one. As in recent_messages, there is no post_delete
+receiver on Message, so deleting a conversation does not load its messages.
+Writes that bypass the ORM (bulk deletes, raw SQL) are caught by
+`manage.py check_activity`; `manage.py backfill_activity` computes the
+values for conversations from before this.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.db.models import Case, Count, F, OuterRef, Q, QuerySet, Subquery, Value, When
+from django.db.models.functions import Coalesce, Substr
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Conversation, Message
+from .titles import EMPTY_TITLE, make_title
+
+PREVIEW_LENGTH = 100
+
+_batch = contextvars.ContextVar('chatbot_activity_batch', default=None)
+
+
+def preview(text):
+    return text[:PREVIEW_LENGTH]
+
+
+def record_added(conversation_id, count, last, title=None):
+    """
+    Count `count` new messages of a conversation, `last` being the latest,
+    and optionally title it if it is still untitled. One UPDATE.
+    """
+    newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=last.created_at)
+    fields = {
+        'message_count': F('message_count') + count,
+        # Concurrent writers may commit out of order; the latest message wins.
+        'last_message_at': Case(When(newer, then=Value(last.created_at)), default=F('last_message_at')),
+        'last_message_preview': Case(
+            When(newer, then=Value(preview(last.content))), default=F('last_message_preview')
+        ),
+        'last_activity_at': Case(
+            When(last_activity_at__lt=last.created_at, then=Value(last.created_at)), default=F('last_activity_at')
+        ),
+    }
+    if title:
+        fields['title'] = Case(When(title=EMPTY_TITLE, then=Value(title)), default=F('title'))
+    return Conversation.objects.filter(pk=conversation_id).update(**fields)
+
+
+def record_removed(conversation_id):
+    """
+    Uncount a deleted message and re-read the conversation's latest one.
+    """
+    latest = latest_message()
+    return Conversation.objects.filter(pk=conversation_id).update(
+        message_count=Case(When(message_count__gt=0, then=F('message_count') - 1), default=Value(0)),
+        last_message_at=Subquery(latest.values('created_at')[:1]),
+        last_message_preview=Coalesce(Subquery(latest.values(start=Substr('content', 1, PREVIEW_LENGTH))[:1]), Value('')),
+        last_activity_at=Coalesce(Subquery(latest.values('created_at')[:1]), F('created_at')),
+    )
+
+
+class ActivityBatch:
+    """
+    Messages added to conversations inside batch_activity(), written once per conversation.
+    """
+
+    def __init__(self):
+        self.added = {}
+        self.titles = {}
+
+    def add(self, message):
+        count, last = self.added.get(message.conversation_id, (0, None))
+        if last is None or message.created_at >= last.created_at:
+            last = message
+        self.added[message.conversation_id] = (count + 1, last)
+
+    def set_title(self, conversation_id, text):
+        self.titles[conversation_id] = make_title(text)
+
+    def write(self):
+        for conversation_id, (count, last) in self.added.items():
+            record_added(conversation_id, count, last, self.titles.get(conversation_id))
+
+
+@contextmanager
+def batch_activity():
+    """
+    Defer the activity UPDATE of messages created in the block to its end,
+    one per conversation. Nothing is written if the block raises.
+    """
+    batch = ActivityBatch()
+    token = _batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _batch.reset(token)
+    batch.write()
+
+
+def latest_message():
+    return Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-pk')
+
+
+def actual_activity():
+    """
+    Annotations computing a conversation's activity from its messages.
+    """
+    latest = latest_message()
+    count = (
+        Message.objects.filter(conversation=OuterRef('pk')).order_by()
+        .values('conversation').annotate(n=Count('pk')).values('n')
+    )
+    return {
+        'actual_count': Coalesce(Subquery(count), Value(0)),
+        'actual_last_at': Subquery(latest.values('created_at')[:1]),
+        'actual_preview': Coalesce(Subquery(latest.values(start=Substr('content', 1, PREVIEW_LENGTH))[:1]), Value('')),
+    }
+
+
+def refresh_activity(conversations):
+    """
+    Recompute the activity of the given conversations (a queryset or pks)
+    from their messages in one UPDATE. Return how many were updated.
+    """
+    if not isinstance(conversations, QuerySet):
+        conversations = Conversation.objects.filter(pk__in=list(conversations))
+    actual = actual_activity()
+    return conversations.update(
+        message_count=actual['actual_count'],
+        last_message_at=actual['actual_last_at'],
+        last_message_preview=actual['actual_preview'],
+        last_activity_at=Coalesce(actual['actual_last_at'], F('created_at')),
+    )
+
+
+def _batches(batch_size):
+    last_pk = None
+    while True:
+        batch = Conversation.objects.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        last_pk = pks[-1]
+        yield pks
+
+
+def backfill_activity(batch_size=500):
+    """
+    Recompute every conversation's activity, `batch_size` conversations per
+    UPDATE. Yield the number updated per batch.
+    """
+    for pks in _batches(batch_size):
+        yield refresh_activity(pks)
+
+
+def inconsistent_activity(batch_size=500):
+    """
+    Yield the pks of conversations whose stored activity does not match their messages.
+    """
+    for pks in _batches(batch_size):
+        rows = (
+            Conversation.objects.filter(pk__in=pks).annotate(**actual_activity())
+            .values_list('pk', 'message_count', 'last_message_at', 'last_message_preview', 'last_activity_at',
+                         'actual_count', 'actual_last_at', 'actual_preview')
+        )
+        for pk, count, last_at, text, active_at, actual_count, actual_last_at, actual_text in rows:
+            # Without messages, the last activity is the creation, give or take the microseconds between the two.
+            if (count, last_at, text) != (actual_count, actual_last_at, actual_text) or (
+                actual_last_at is not None and active_at != actual_last_at
+            ):
+                yield pk
+
+
+@receiver(post_save, sender=Message)
+def _count_new_message(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    batch = _batch.get()
+    if batch is not None:
+        batch.add(instance)
+    else:
+        record_added(instance.conversation_id, 1, instance)
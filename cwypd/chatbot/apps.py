@@ -1,6 +1,10 @@
-from django.apps import AppConfig
-
-
-class ChatbotConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
-    name = 'chatbot'
+from django.apps import AppConfig
+
+
+class ChatbotConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'chatbot'
+
+    def ready(self):
+        from . import activity, recent_messages  # noqa: F401 (connects the signal receivers)
+        from . import purge  # noqa: F401 (registers the purge job handler)
@@ -0,0 +1,139 @@
+"""
+Native async versions of the views that wait on the LLM.
+
+DRF views are synchronous, so even under ASGI each request holds a worker
+thread for the whole OpenAI/Pinecone round trip. These views await retrieval
+and generation on the event loop and only hop to a thread for JWT checks and
+ORM calls, so one process can keep hundreds of questions in flight. They are
+only worth routing to when serving through cwypd/asgi.py.
+"""
+import json
+import math
+from contextlib import AsyncExitStack
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+
+from accounts.authentication import CachedJWTAuthentication
+
+from .audit import arecord
+from .conf import chatbot_settings
+from .history import answer_delta, build_history, get_conversation
+from .instrumentation import stage
+from .models import ChatbotResponse, Conversation, UserQuestion
+from .rag import aget_pipeline
+from .recent_messages import recent_messages, save_exchange
+from .throttling import GlobalAskThrottle, UserAskThrottle, get_admission
+from .titles import EMPTY_TITLE
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of APIView: JWT authentication, throttles and
+    JSON bodies.
+    """
+    authentication_class = CachedJWTAuthentication
+    throttle_classes = ()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # csrf_exempt() would hide the coroutine from Django in 4.2, so mark it directly.
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            with stage('auth'):
+                user_auth = await sync_to_async(self.authentication_class().authenticate)(request)
+        except AuthenticationFailed as exc:
+            return JsonResponse({'detail': exc.detail}, status=exc.status_code)
+        if user_auth is None:
+            return JsonResponse(
+                {'detail': 'Authentication credentials were not provided.'},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+        request.user = user_auth[0]
+        try:
+            self.data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'detail': 'JSON parse error.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            await self.check_throttles(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Throttled as exc:
+            response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+            if exc.wait is not None:
+                response['Retry-After'] = str(math.ceil(exc.wait))
+            return response
+
+    async def check_throttles(self, request):
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not await sync_to_async(throttle.allow_request)(request, self):
+                raise Throttled(wait=throttle.wait())
+
+
+class AsyncChatbotConversationView(AsyncAPIView):
+    """
+    Async equivalent of ChatbotConversationView.
+    """
+    throttle_classes = (UserAskThrottle, GlobalAskThrottle)
+
+    async def post(self, request, *args, **kwargs):
+        query = self.data.get('query')
+        if not query:
+            return JsonResponse({'error': 'No question provided'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with stage('conversation'):
+                conversation = await sync_to_async(get_conversation)(request.user, self.data.get('conversation_id'))
+        except Http404:
+            return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        pipeline = await aget_pipeline()
+        with stage('history'):
+            chat_history, summary = await sync_to_async(build_history)(conversation, pipeline, chatbot_settings())
+
+        admission = get_admission()
+        async with AsyncExitStack() as admitted:
+            if admission is not None:
+                with stage('queue'):
+                    await admitted.enter_async_context(admission.aadmit())
+            # Recorded once admitted: a question turned away with 429 leaves no row.
+            question = UserQuestion(conversation=conversation, user=request.user, question_text=query)
+            with stage('audit'):
+                await arecord(question)
+            result = await pipeline.aask(query, chat_history, summary)
+
+        with stage('audit'):
+            await arecord(ChatbotResponse(conversation=conversation, response_text=result['answer'], question=question))
+        return JsonResponse(answer_delta(conversation, result), status=status.HTTP_200_OK)
+
+
+class AsyncMessageCreateView(AsyncAPIView):
+    """
+    Async equivalent of MessageCreateView.
+    """
+
+    async def post(self, request, conversation_id):
+        content = self.data.get('content')
+        if not content:
+            return JsonResponse({'content': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            conversation = await Conversation.objects.only('id', 'title').aget(id=conversation_id, user=request.user)
+        except Conversation.DoesNotExist:
+            return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        message_list = await sync_to_async(recent_messages)(conversation.id)
+        message_list = message_list + [{'role': 'user', 'content': content}]
+        assistant_response = await self.generate_reply(message_list)
+        await sync_to_async(save_exchange)(
+            conversation.id, message_list, assistant_response, set_title=conversation.title == EMPTY_TITLE
+        )
+        return JsonResponse({'response': assistant_response}, status=status.HTTP_200_OK)
+
+    async def generate_reply(self, message_list):
+        # Same mock reply as MessageCreateView until a model is wired in here
+        return "This is a mock response from GPT-3."
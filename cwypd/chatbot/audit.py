@@ -0,0 +1,380 @@
+"""
+Write-behind persistence of the ask audit rows (UserQuestion, ChatbotResponse).
+
+With AUDIT_WRITE_BEHIND the ask views hand these rows to a per-process
+buffer instead of inserting them one by one inside the request. A background
+thread writes the buffer with bulk_create once AUDIT_BATCH_SIZE rows are
+waiting or every AUDIT_FLUSH_INTERVAL seconds, and once more at exit.
+
+Every row is also appended to a spool file under AUDIT_SPOOL_DIR before the
+view returns, and the spool is only dropped once its rows are committed. A
+process that dies with rows in memory leaves its spool behind, and the next
+process to start a buffer replays it. Rows keep the UUID they were given in
+the request, so a replay that overlaps a committed flush inserts nothing
+twice. The spool is flushed to the OS, not fsynced: it survives the process
+crashing, not the machine losing power.
+
+A batch that cannot be written, say while SQLite is locked, stays in memory
+and is retried from the flusher thread with exponential backoff, up to
+MAX_RETRY_DELAY seconds apart; a conversation's failed rows are retried at
+once when its history is read. Replayed rows whose conversation has been
+deleted since are dropped, and lines that cannot be read, such as one torn
+by a crash, are moved to a .failed file next to the spool for an operator.
+
+Rows become visible to other requests up to one interval late. The ask views
+flush a conversation's pending rows before reading its history, so a
+follow-up question always sees the previous turn.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from .conf import chatbot_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, so a starting buffer replays every spool
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 60
+MAX_ATTEMPTS = 10
+
+
+def dump_row(obj):
+    fields = {f.attname: getattr(obj, f.attname) for f in obj._meta.concrete_fields}
+    return json.dumps({'model': obj._meta.label_lower, 'fields': fields}, cls=DjangoJSONEncoder)
+
+
+def load_row(line):
+    data = json.loads(line)
+    model = apps.get_model(data['model'])
+    fields = {f.attname: f.to_python(data['fields'][f.attname]) for f in model._meta.concrete_fields}
+    return model(**fields)
+
+
+def bulk_insert(rows):
+    """
+    Insert rows model by model, in the order their models first appear.
+    Rows already in the table are skipped.
+    """
+    by_model = {}
+    for row in rows:
+        by_model.setdefault(type(row), []).append(row)
+    for model, objs in by_model.items():
+        model.objects.bulk_create(objs, ignore_conflicts=True)
+
+
+def drop_orphans(rows):
+    """
+    Return `rows` without those whose foreign keys point at rows that no
+    longer exist, such as a conversation purged after they were spooled.
+    ignore_conflicts skips duplicate keys, not foreign key violations.
+    """
+    wanted = {}
+    for row in rows:
+        for field in row._meta.concrete_fields:
+            value = getattr(row, field.attname)
+            if field.is_relation and value is not None:
+                wanted.setdefault(field, set()).add(value)
+    found = {}
+    for field, values in wanted.items():
+        target = field.target_field.attname
+        found[field] = set(
+            field.related_model._base_manager.filter(**{f'{target}__in': values}).values_list(target, flat=True)
+        )
+        # An answer's question may be in the same spool, inserted just before it.
+        found[field].update(getattr(row, target) for row in rows if isinstance(row, field.related_model))
+
+    def exists(row, field):
+        value = getattr(row, field.attname)
+        return value is None or value in found[field]
+
+    return [row for row in rows if all(exists(row, f) for f in row._meta.concrete_fields if f.is_relation)]
+
+
+class WriteBehindBuffer:
+    """
+    Collect model instances and insert them in batches from a thread.
+    """
+
+    def __init__(self, spool_dir, batch_size=100, interval=1.0):
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stats = {'buffered': 0, 'flushed': 0, 'flushes': 0, 'replayed': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._rows = []
+        # Batches whose insert failed: [rows, spool, attempts, retry_at, replayed].
+        self._failed = []
+        self._spool = None
+        self._thread = None
+
+    def start(self):
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.replay()
+        self._open_spool()
+        self._thread = threading.Thread(target=self._run, name='chatbot-audit', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """
+        Stop the thread and write what is left.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush(retry_now=True)
+
+    def add(self, *objs):
+        with self._lock:
+            for obj in objs:
+                self._spool.write(dump_row(obj) + '\n')
+            self._spool.flush()
+            self._rows.extend(objs)
+            self.stats['buffered'] += len(objs)
+            full = len(self._rows) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def pending(self, conversation_id=None):
+        with self._lock:
+            rows = self._rows + [row for batch in self._failed for row in batch[0]]
+        if conversation_id is None:
+            return len(rows)
+        return sum(1 for row in rows if row.conversation_id == conversation_id)
+
+    def flush(self, retry_now=False):
+        """
+        Insert the buffered rows now, and the failed batches that are due
+        for a retry (all of them with `retry_now`). Return how many rows
+        were written.
+        """
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                due = [batch for batch in self._failed if retry_now or batch[3] <= now]
+                self._failed = [batch for batch in self._failed if not (retry_now or batch[3] <= now)]
+            written = sum(
+                self._write(rows, spool, attempts, replayed) for rows, spool, attempts, _, replayed in due
+            )
+            with self._lock:
+                if not self._rows:
+                    return written
+                rows, self._rows = self._rows, []
+                spool = self._rotate_spool()
+            return written + self._write(rows, spool)
+
+    def flush_conversation(self, conversation_id):
+        """
+        Flush if any row of `conversation_id` is still buffered or failed.
+        """
+        if self.pending(conversation_id):
+            self.flush(retry_now=True)
+
+    def replay(self):
+        """
+        Insert the rows of spools left behind by processes that are gone.
+        """
+        for path in sorted(self.spool_dir.iterdir()):
+            if path.suffix not in ('.jsonl', '.flushing'):
+                continue
+            with open(path, 'a+', encoding='utf-8') as fh:
+                if not self._try_lock(fh):
+                    continue  # a live process owns it
+                fh.seek(0)
+                rows, good, bad = [], [], []
+                for line in fh:
+                    if not line.strip():
+                        continue
+                    try:
+                        rows.append(load_row(line))
+                        good.append(line)
+                    except (ValueError, LookupError, TypeError, ValidationError):
+                        bad.append(line)
+                if bad:
+                    self.stats['errors'] += 1
+                    self._quarantine(path, bad)
+                    # Keep only the readable rows, in case this process dies before they are written.
+                    fh.seek(0)
+                    fh.truncate()
+                    fh.writelines(good)
+                    fh.flush()
+            if rows:
+                self._write(rows, path, replayed=True)
+            else:
+                path.unlink(missing_ok=True)
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, 'pending': len(self._rows)}
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return  # stop() writes the rest from its own thread
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def _write(self, rows, spool, attempts=0, replayed=False):
+        """
+        Insert rows, then drop their spool. On failure keep them for a retry
+        after a backoff, and return 0.
+        """
+        try:
+            if replayed:
+                kept = drop_orphans(rows)
+                if len(kept) < len(rows):
+                    logger.warning("Dropped %s audit rows from %s whose conversation no longer exists",
+                                   len(rows) - len(kept), spool)
+                rows = kept
+            bulk_insert(rows)
+        except Exception:
+            attempts += 1
+            self.stats['errors'] += 1
+            if attempts >= MAX_ATTEMPTS:
+                logger.exception("Giving up on %s audit rows from %s", len(rows), spool)
+                if spool.exists():
+                    self._quarantine(spool, spool.read_text(encoding='utf-8').splitlines(keepends=True))
+                    spool.unlink()
+                return 0
+            delay = min(self.interval * 2 ** attempts, MAX_RETRY_DELAY)
+            # The spool stays on disk too, for the next buffer to start should this process die.
+            logger.exception("Could not write %s audit rows from %s; retrying in %.1fs", len(rows), spool, delay)
+            with self._lock:
+                self._failed.append([rows, spool, attempts, time.monotonic() + delay, replayed])
+            return 0
+        spool.unlink(missing_ok=True)
+        if replayed:
+            self.stats['replayed'] += len(rows)
+            if rows:
+                logger.info("Replayed %s audit rows from %s", len(rows), spool)
+        else:
+            self.stats['flushed'] += len(rows)
+            self.stats['flushes'] += 1
+        return len(rows)
+
+    def _quarantine(self, spool, lines):
+        failed = spool.with_suffix('.failed')
+        with open(failed, 'a', encoding='utf-8') as fh:
+            fh.writelines(line if line.endswith('\n') else line + '\n' for line in lines)
+        logger.error("Moved %s audit rows from %s to %s", len(lines), spool, failed)
+
+    def _open_spool(self):
+        path = self.spool_dir / f'{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl'
+        self._spool = open(path, 'a', encoding='utf-8')
+        self._try_lock(self._spool)
+
+    def _rotate_spool(self):
+        # Called with self._lock held: later rows go to a fresh spool.
+        old = self._spool
+        old.close()
+        self._open_spool()
+        rotated = Path(old.name).with_suffix('.flushing')
+        try:
+            os.replace(old.name, rotated)
+        except FileNotFoundError:
+            pass  # replayed by a buffer starting meanwhile; inserting again is harmless
+        return rotated
+
+    def _try_lock(self, fh):
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_audit_buffer():
+    """
+    Return this process's started buffer, or None when write-behind is off.
+    """
+    global _buffer
+    config = chatbot_settings()
+    if not config['AUDIT_WRITE_BEHIND']:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(
+                config['AUDIT_SPOOL_DIR'], config['AUDIT_BATCH_SIZE'], config['AUDIT_FLUSH_INTERVAL']
+            ).start()
+        return _buffer
+
+
+def record(*objs):
+    """
+    Save new audit rows, now or through the write-behind buffer.
+    """
+    buffer = get_audit_buffer()
+    if buffer is not None:
+        buffer.add(*objs)
+        return
+    for obj in objs:
+        obj.save(force_insert=True)
+
+
+async def arecord(*objs):
+    if chatbot_settings()['AUDIT_WRITE_BEHIND']:
+        await sync_to_async(record)(*objs)
+        return
+    for obj in objs:
+        await obj.asave(force_insert=True)
+
+
+def flush_conversation(conversation_id):
+    """
+    Make the buffered turns of a conversation visible before its history is read.
+    """
+    buffer = get_audit_buffer()
+    if buffer is not None:
+        buffer.flush_conversation(conversation_id)
+
+
+def _reset_after_fork():
+    # The flusher thread does not survive a fork; the child starts its own buffer.
+    global _buffer, _buffer_lock
+    _buffer = None
+    _buffer_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    global _buffer
+    if setting == 'CHATBOT' and _buffer is not None:
+        _buffer.stop()
+        _buffer = None
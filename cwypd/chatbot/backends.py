@@ -0,0 +1,46 @@
+"""
+Factories for the retrieval pipeline backends.
+
+Each factory takes the CHATBOT settings dict; the vector store factory also
+gets the embeddings instance. They are referenced by dotted path from settings
+so that tests and local runs can swap in the fakes from chatbot.fakes.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from langchain.chat_models import ChatOpenAI
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+
+def required(config, name):
+    if not config[name]:
+        raise ImproperlyConfigured(f"CHATBOT['{name}'] is not set; export {name} in the environment")
+    return config[name]
+
+
+def openai_embeddings(config):
+    return OpenAIEmbeddings(
+        openai_api_key=required(config, 'OPENAI_API_KEY'),
+        openai_api_base=config['OPENAI_API_BASE'] or None,
+    )
+
+
+def openai_chat_model(config):
+    return ChatOpenAI(
+        model=config['OPENAI_MODEL'],
+        temperature=config['TEMPERATURE'],
+        openai_api_key=required(config, 'OPENAI_API_KEY'),
+        openai_api_base=config['OPENAI_API_BASE'] or None,
+    )
+
+
+def pinecone_vectorstore(config, embeddings):
+    import pinecone
+    from langchain.vectorstores import Pinecone
+
+    pinecone.init(api_key=required(config, 'PINECONE_API_KEY'), environment=config['PINECONE_ENVIRONMENT'])
+    return Pinecone.from_existing_index(index_name=config['PINECONE_INDEX_NAME'], embedding=embeddings)
+
+
+def local_vectorstore(config, embeddings):
+    from .vectorstores import LocalVectorStore
+
+    return LocalVectorStore(embeddings, path=config['LOCAL_INDEX_PATH'], nprobe=config['LOCAL_INDEX_NPROBE'])
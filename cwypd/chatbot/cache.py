@@ -0,0 +1,187 @@
+"""
+Answer cache in front of the retrieval chain.
+
+Repeated HR/policy questions are answered from memory instead of paying for
+retrieval and a completion again. Lookups go through two tiers:
+
+* exact: a hash of the normalized question, checked before anything is embedded;
+* semantic: cosine similarity between the question embedding and those of
+  recently answered questions, accepted above a threshold.
+
+Entries expire after a TTL and the least recently used entry is evicted when
+the cache is full. Re-ingesting the index calls invalidate_answer_caches(),
+which bumps a version stored in the Django cache so that every process using
+a shared cache backend drops its entries on the next lookup. A per-process
+cache (the default LocMemCache) would never see the bump made by
+`manage.py ingest`, so unless ANSWER_CACHE_ENABLED says otherwise the answer
+cache is only on when the Django cache is shared.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+VERSION_KEY = 'chatbot:answer-cache-version'
+
+
+def answer_cache_enabled(config):
+    """
+    ANSWER_CACHE_ENABLED, where None means "if the Django cache is shared by
+    the processes", the only case in which invalidation reaches them all.
+    """
+    if config['ANSWER_CACHE_ENABLED'] is None:
+        return not isinstance(caches['default'], (LocMemCache, DummyCache))
+    return config['ANSWER_CACHE_ENABLED']
+
+
+def normalize_question(question):
+    return ' '.join(question.lower().split())
+
+
+class _Entry:
+    __slots__ = ('slot', 'result', 'expires_at')
+
+    def __init__(self, slot, result, expires_at):
+        self.slot = slot
+        self.result = result
+        self.expires_at = expires_at
+
+
+class SemanticCache:
+    """
+    Thread-safe TTL/LRU cache of answers (and their source documents) keyed by
+    question. Hits are returned as {'answer', 'source_documents', 'cached'}
+    where 'cached' names the tier that matched.
+    """
+
+    def __init__(self, similarity=0.95, ttl=3600, max_entries=1000):
+        self.similarity = similarity
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._matrix = None
+        self._version = cache.get(VERSION_KEY, 0)
+
+    @staticmethod
+    def key(question):
+        return hashlib.sha256(normalize_question(question).encode()).hexdigest()
+
+    def get_exact(self, question):
+        """
+        Return the cached result for this exact (normalized) question, if any.
+        """
+        key = self.key(question)
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None or not self._alive(key, entry):
+                return None
+            self._entries.move_to_end(key)
+            self.stats['exact_hits'] += 1
+            return self._hit(entry, 'exact')
+
+    def get_similar(self, vector):
+        """
+        Return the result of the most similar cached question when it clears the
+        similarity threshold. Counts a miss otherwise.
+        """
+        with self._lock:
+            self._check_version()
+            if self._matrix is not None and self._entries:
+                query = self._unit(vector)
+                scores = self._matrix @ query
+                scores[self._free] = -np.inf
+                slot = int(np.argmax(scores))
+                key = self._keys[slot]
+                if scores[slot] >= self.similarity:
+                    entry = self._entries[key]
+                    if self._alive(key, entry):
+                        self._entries.move_to_end(key)
+                        self.stats['semantic_hits'] += 1
+                        return self._hit(entry, 'semantic')
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, question, vector, answer, source_documents=()):
+        key = self.key(question)
+        with self._lock:
+            self._check_version()
+            if key in self._entries:
+                self._release(key)
+            if not self._free:
+                oldest = next(iter(self._entries))
+                self._release(oldest)
+                self.stats['evictions'] += 1
+            slot = self._free.pop()
+            unit = self._unit(vector)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, unit.shape[0]), dtype=np.float32)
+            self._matrix[slot] = unit
+            self._keys[slot] = key
+            cached = {'answer': answer, 'source_documents': list(source_documents)}
+            self._entries[key] = _Entry(slot, cached, time.monotonic() + self.ttl)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._release(key)
+            self.stats['invalidations'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats['exact_hits'] + self.stats['semantic_hits'] + self.stats['misses']
+            hits = lookups - self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+    # The helpers below expect self._lock to be held.
+
+    def _check_version(self):
+        version = cache.get(VERSION_KEY, 0)
+        if version != self._version:
+            for key in list(self._entries):
+                self._release(key)
+            self._version = version
+            self.stats['invalidations'] += 1
+
+    def _alive(self, key, entry):
+        if entry.expires_at > time.monotonic():
+            return True
+        self._release(key)
+        return False
+
+    def _release(self, key):
+        entry = self._entries.pop(key)
+        self._keys[entry.slot] = None
+        self._free.append(entry.slot)
+
+    def _hit(self, entry, tier):
+        return {**entry.result, 'cached': tier}
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def invalidate_answer_caches():
+    """
+    Drop cached answers in every process, e.g. after the index was re-ingested.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
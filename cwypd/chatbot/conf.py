@@ -0,0 +1,66 @@
+from django.conf import settings
+
+DEFAULTS = {
+    'EMBEDDINGS_BACKEND': 'chatbot.backends.openai_embeddings',
+    'VECTORSTORE_BACKEND': 'chatbot.backends.pinecone_vectorstore',
+    'LLM_BACKEND': 'chatbot.backends.openai_chat_model',
+    'OPENAI_API_KEY': '',
+    'OPENAI_API_BASE': '',
+    'OPENAI_MODEL': 'gpt-3.5-turbo',
+    'TEMPERATURE': 0.0,
+    'PINECONE_API_KEY': '',
+    'PINECONE_ENVIRONMENT': '',
+    'PINECONE_INDEX_NAME': '',
+    'LOCAL_INDEX_PATH': settings.BASE_DIR / 'vector_index',
+    'LOCAL_INDEX_NPROBE': 8,
+    'ANSWER_CACHE_ENABLED': None,
+    'ANSWER_CACHE_SIMILARITY': 0.95,
+    'ANSWER_CACHE_TTL': 60 * 60,
+    'ANSWER_CACHE_MAX_ENTRIES': 1000,
+    'EMBEDDING_CACHE_ENABLED': True,
+    'EMBEDDING_CACHE_PATH': settings.BASE_DIR / 'embeddings.sqlite3',
+    'EMBEDDING_CACHE_MAX_ENTRIES': 10000,
+    'EMBEDDING_BATCH_WINDOW': 0.005,
+    'EMBEDDING_BATCH_SIZE': 256,
+    'HISTORY_TOKEN_BUDGET': 1500,
+    'HISTORY_MAX_TURNS': 20,
+    'HISTORY_SUMMARY_ENABLED': False,
+    'COALESCE_ENABLED': True,
+    'COALESCE_ACROSS_PROCESSES': False,
+    'COALESCE_TIMEOUT': 60,
+    'ASK_IN_BACKGROUND': False,
+    'JOB_MAX_ATTEMPTS': 3,
+    'JOB_RETRY_BACKOFF': 2.0,
+    'JOB_LEASE': 300,
+    'JOB_POLL_INTERVAL': 0.5,
+    'ASK_USER_RATE': '30/min',
+    'ASK_USER_BURST': 10,
+    'ASK_GLOBAL_RATE': None,
+    'ASK_GLOBAL_BURST': 100,
+    'ASK_MAX_CONCURRENT': 64,
+    'ASK_MAX_QUEUE': 128,
+    'ASK_QUEUE_TIMEOUT': 30,
+    'ADMISSION_SHARED': False,
+    'ADMISSION_LEASE': 300,
+    'AUDIT_WRITE_BEHIND': False,
+    'AUDIT_BATCH_SIZE': 100,
+    'AUDIT_FLUSH_INTERVAL': 1.0,
+    'AUDIT_SPOOL_DIR': settings.BASE_DIR / 'audit_spool',
+    'PURGE_BATCH_SIZE': 1000,
+    'SEARCH_PAGE_SIZE': 20,
+    'EXPORT_CHUNK_SIZE': 2000,
+    'IMPORT_BATCH_SIZE': 1000,
+    'INSTRUMENTATION_ENABLED': False,
+    'INSTRUMENTATION_SERVER_TIMING': True,
+    'METRICS_TOKEN': '',
+    'PROFILE_SLOW_REQUESTS': None,
+    'PROFILE_SAMPLE_RATE': 0.1,
+    'PROFILE_DIR': settings.BASE_DIR / 'profiles',
+}
+
+
+def chatbot_settings():
+    """
+    Return the CHATBOT settings dict merged over the defaults.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CHATBOT', {})}
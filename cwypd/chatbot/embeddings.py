@@ -0,0 +1,179 @@
+"""
+Caching and batching wrapper around the embeddings backend.
+
+Vectors are keyed by a hash of the backend name and the text. They are looked
+up in an in-process LRU first, then in a small SQLite database kept next to
+db.sqlite3, and only the remaining texts are sent to the backend. Concurrent
+embed_query() calls from different request threads are collected for a few
+milliseconds and sent as a single backend call.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+
+class EmbeddingStore:
+    """
+    Persistent float32 vectors in a SQLite table, shared by threads.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vector BLOB NOT NULL)')
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embedding WHERE key IN ({",".join("?" * len(chunk))})', chunk
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO embedding (key, vector) VALUES (?, ?)',
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+class _Batcher:
+    """
+    Coalesce concurrent single-text calls into one call of `fn(texts)`.
+
+    The first caller of a batch waits `window` seconds for others to join,
+    then runs the whole batch; a batch reaching `max_size` is run at once.
+    """
+
+    def __init__(self, fn, window, max_size):
+        self.fn = fn
+        self.window = window
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def submit(self, text):
+        future = Future()
+        with self._lock:
+            self._pending.append((text, future))
+            leader = len(self._pending) == 1
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._flush()
+        elif leader:
+            time.sleep(self.window)
+            self._flush()
+        return future.result()
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            vectors = self.fn([text for text, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that memoize `backend` and batch concurrent queries.
+    """
+
+    def __init__(self, backend, namespace, store=None, max_entries=10000, batch_window=0.005, batch_size=256):
+        self.backend = backend
+        self.namespace = namespace
+        self.store = store
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.stats = {'memory_hits': 0, 'store_hits': 0, 'misses': 0, 'backend_calls': 0}
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._batcher = _Batcher(self._embed_uncached, batch_window, batch_size) if batch_window else None
+
+    def key(self, text):
+        return hashlib.sha256(f'{self.namespace}\0{text}'.encode()).hexdigest()
+
+    def embed_documents(self, texts):
+        return self._embed_uncached(texts)
+
+    def embed_query(self, text):
+        # Memory hits return at once; only misses wait for a batch to form.
+        vector = self._from_memory([self.key(text)])
+        if vector:
+            return next(iter(vector.values())).tolist()
+        if self._batcher is None:
+            return self._embed_uncached([text])[0]
+        return self._batcher.submit(text)
+
+    def _embed_uncached(self, texts):
+        keys = [self.key(text) for text in texts]
+        vectors = self._from_memory(keys)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+        if missing and self.store is not None:
+            stored = self.store.get_many(missing)
+            self._count('store_hits', len(stored))
+            vectors.update(stored)
+            self._remember(stored.items())
+
+        todo = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if todo:
+            self._count('misses', len(todo))
+            todo_keys, todo_texts = list(todo), list(todo.values())
+            computed = []
+            for start in range(0, len(todo_texts), self.batch_size):
+                self._count('backend_calls', 1)
+                computed.extend(self.backend.embed_documents(todo_texts[start:start + self.batch_size]))
+            computed = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(todo_keys, computed)]
+            vectors.update(computed)
+            self._remember(computed)
+            if self.store is not None:
+                self.store.put_many(computed)
+
+        return [vectors[key].tolist() for key in keys]
+
+    def _from_memory(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.stats['memory_hits'] += len(found)
+        return found
+
+    def _count(self, stat, amount):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def _remember(self, items):
+        with self._lock:
+            for key, vector in items:
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
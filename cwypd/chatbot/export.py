@@ -0,0 +1,296 @@
+"""
+Exporting a user's chat history as NDJSON, and importing it back.
+
+The export is one JSON object per line: a header, then the user's
+conversations, their messages, questions and answers, each tagged with its
+`type`. Rows are read with .values().iterator(chunk_size=EXPORT_CHUNK_SIZE)
+and written out as they come, in blocks of about 64 KB, gzipped on the fly
+if asked, so memory stays flat however long the history is. Deleted
+conversations are not exported.
+
+Importing reads such a file line by line and writes IMPORT_BATCH_SIZE rows
+at a time with bulk_create, each batch in its own short transaction. Rows
+get new ids, so a file can be imported next to the conversations it was
+exported from; the import keeps a map of old to new ids to relink them.
+Timestamps are kept. The conversations' activity (chatbot.activity) is
+recomputed at the end, and the search index follows through its triggers.
+"""
+import datetime
+import gzip
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .activity import refresh_activity
+from .conf import chatbot_settings
+from .models import ChatbotResponse, Conversation, Message, UserQuestion
+
+FORMAT = 'cwypd-chat-history'
+VERSION = 1
+BLOCK_SIZE = 64 * 1024
+
+# Exported fields of each record type, in import order: a row's references come before it.
+FIELDS = {
+    'conversation': (
+        Conversation, ('id', 'title', 'created_at', 'updated_at', 'favourite', 'archive', 'prompt', 'status',
+                       'history_summary', 'summary_until'),
+    ),
+    'message': (Message, ('id', 'conversation_id', 'content', 'created_at', 'is_from_user', 'in_reply_to_id')),
+    'user_question': (UserQuestion, ('id', 'conversation_id', 'question_text', 'timestamp')),
+    'chatbot_response': (
+        ChatbotResponse, ('id', 'conversation_id', 'question_id', 'response_text', 'sources', 'timestamp'),
+    ),
+}
+# Fields that exports written before they existed leave out.
+OPTIONAL_FIELDS = {'question_id'}
+DATETIME_FIELDS = {'created_at', 'updated_at', 'summary_until', 'timestamp'}
+# Written after bulk_create: auto_now(_add) overrides timestamps on insert,
+# and a reply may point at a message of its own batch.
+LATE_FIELDS = {'conversation': ['created_at', 'updated_at'], 'message': ['created_at', 'in_reply_to_id']}
+
+
+class InvalidExport(ValueError):
+    pass
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder without its rounding of datetimes to milliseconds.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def export_records(user, chunk_size=None):
+    """
+    Yield the header and every record of the user's chat history.
+    """
+    chunk_size = chunk_size or chatbot_settings()['EXPORT_CHUNK_SIZE']
+    yield {'type': 'header', 'format': FORMAT, 'version': VERSION, 'user': user.pk, 'exported_at': timezone.now()}
+    conversations = Conversation.objects.filter(user=user)
+    for kind, (model, fields) in FIELDS.items():
+        rows = conversations if model is Conversation else model.objects.filter(conversation__in=conversations)
+        for values in rows.order_by('pk').values(*fields).iterator(chunk_size=chunk_size):
+            yield {'type': kind, **values}
+
+
+def ndjson(records, compress=False):
+    """
+    Encode records as NDJSON, yielding blocks of about BLOCK_SIZE bytes,
+    gzipped if `compress`.
+    """
+    encoder = ExportEncoder(ensure_ascii=False)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # gzip container
+    block, size = [], 0
+    for record in records:
+        line = (encoder.encode(record) + '\n').encode()
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            data = b''.join(block)
+            block, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(block)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+async def aiterate(iterator):
+    """
+    Serve a synchronous iterator to an async consumer, one item per thread hop.
+    """
+    iterator = iter(iterator)
+    done = object()
+    while (item := await sync_to_async(next)(iterator, done)) is not done:
+        yield item
+
+
+def read_lines(stream, compressed=None):
+    """
+    Iterate over the lines of a binary stream, gunzipping it if it starts
+    like gzip or `compressed` is true.
+    """
+    head = stream.read(2)
+    if compressed is None:
+        compressed = head == b'\x1f\x8b'
+    stream = _Rewound(head, stream)
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream)
+    return iter(stream.readline, b'')
+
+
+class _Rewound:
+    """
+    A stream with the bytes already read from it put back in front.
+    """
+
+    def __init__(self, head, stream):
+        self.head, self.stream = head, stream
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            head, self.head = self.head, b''
+            return head + self.stream.read()
+        head, self.head = self.head[:size], self.head[size:]
+        return head + self.stream.read(size - len(head)) if size > len(head) else head
+
+    def readline(self, size=-1):
+        newline = self.head.find(b'\n')
+        if newline >= 0:
+            line, self.head = self.head[:newline + 1], self.head[newline + 1:]
+            return line
+        head, self.head = self.head, b''
+        return head + self.stream.readline()
+
+    def readable(self):
+        return True
+
+
+def import_records(user, lines, batch_size=None):
+    """
+    Import an export into the user's history. Return the number of rows
+    imported per record type. Raise InvalidExport on a malformed line or a
+    corrupt gzip stream; the batches before it stay imported, with their
+    conversations' activity up to date.
+    """
+    batch_size = batch_size or chatbot_settings()['IMPORT_BATCH_SIZE']
+    state = _Import(user, batch_size)
+    try:
+        state.read(lines)
+    finally:
+        # Also after an error, for the conversations of the batches already committed.
+        for start in range(0, len(state.new_conversations), 500):
+            refresh_activity(state.new_conversations[start:start + 500])
+    return state.counts
+
+
+def _numbered(lines):
+    """
+    Yield (number, line) pairs, turning read errors of a gzipped body into
+    InvalidExport.
+    """
+    lines, number = iter(lines), 0
+    while True:
+        number += 1
+        try:
+            line = next(lines)
+        except StopIteration:
+            return
+        except (OSError, EOFError, zlib.error):
+            raise InvalidExport(f"Line {number}: corrupt gzip stream")
+        yield number, line
+
+
+class _Import:
+
+    def __init__(self, user, batch_size):
+        self.user, self.batch_size = user, batch_size
+        self.pending = {kind: [] for kind in FIELDS}
+        self.ids = {'conversation': {}, 'message': {}, 'user_question': {}}
+        self.new_conversations = []
+        self.counts = {kind: 0 for kind in FIELDS}
+
+    def read(self, lines):
+        header = False
+        for number, line in _numbered(lines):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                kind = record.pop('type')
+            except (ValueError, AttributeError, KeyError, TypeError):
+                # TypeError: a JSON array, whose pop() wants an index.
+                raise InvalidExport(f"Line {number} is not an exported record")
+            if not header or kind == 'header':
+                if header or kind != 'header' or record.get('format') != FORMAT or record.get('version') != VERSION:
+                    raise InvalidExport(f"Line {number}: not the header of a version {VERSION} {FORMAT} export")
+                header = True
+                continue
+            if kind not in FIELDS:
+                raise InvalidExport(f"Line {number}: unknown record type {kind!r}")
+            self.add(kind, record, number)
+        if not header:
+            raise InvalidExport("The export is empty")
+        self.flush_all()
+
+    def add(self, kind, record, number):
+        model, fields = FIELDS[kind]
+        try:
+            values = {field: record.get(field) if field in OPTIONAL_FIELDS else record[field] for field in fields}
+            for field in DATETIME_FIELDS.intersection(values):
+                if values[field] is not None:
+                    values[field] = parse_datetime(values[field])
+        except KeyError as exc:
+            raise InvalidExport(f"Line {number}: {kind} without {exc.args[0]}")
+        except (TypeError, ValueError):
+            raise InvalidExport(f"Line {number}: {kind} with an invalid date")
+        self.pending[kind].append((number, values))
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush(kind)
+
+    def flush_all(self):
+        for kind in FIELDS:
+            self.flush(kind)
+
+    def flush(self, kind):
+        # A row's conversation must have its new id first.
+        for earlier in FIELDS:
+            if earlier == kind:
+                break
+            self.flush(earlier)
+        pending, self.pending[kind] = self.pending[kind], []
+        if not pending:
+            return
+        model = FIELDS[kind][0]
+        objs = [self.build(kind, model, number, values) for number, values in pending]
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(objs)
+                if kind in self.ids:
+                    self.ids[kind].update((str(values['id']), obj.pk) for obj, (_, values) in zip(objs, pending))
+                if kind in LATE_FIELDS:
+                    for obj, (_, values) in zip(objs, pending):
+                        self.restore(kind, obj, values)
+                    model.objects.bulk_update(objs, LATE_FIELDS[kind])
+        except (DatabaseError, ValidationError, TypeError, ValueError) as exc:
+            raise InvalidExport(f"Lines {pending[0][0]}-{pending[-1][0]}: {exc}")
+        if kind == 'conversation':
+            self.new_conversations += [obj.pk for obj in objs]
+        self.counts[kind] += len(objs)
+
+    def build(self, kind, model, number, values):
+        values = {field: value for field, value in values.items() if field not in ('id', 'in_reply_to_id')}
+        if kind == 'conversation':
+            return model(user=self.user, **values)
+        conversation_id = self.ids['conversation'].get(str(values.pop('conversation_id')))
+        if conversation_id is None:
+            raise InvalidExport(f"Line {number}: {kind} of a conversation not in the file")
+        if kind == 'user_question':
+            values['user'] = self.user
+        if kind == 'chatbot_response':
+            # Answers to questions outside the file lose the link and drop out of the history.
+            question_id = values.pop('question_id')
+            values['question_id'] = self.ids['user_question'].get(str(question_id)) if question_id else None
+        return model(conversation_id=conversation_id, **values)
+
+    def restore(self, kind, obj, values):
+        for field in LATE_FIELDS[kind]:
+            if field == 'in_reply_to_id':
+                # Replies to messages outside the file lose the link, as if those had been deleted.
+                reply_to = values['in_reply_to_id']
+                obj.in_reply_to_id = self.ids['message'].get(str(reply_to)) if reply_to is not None else None
+            else:
+                setattr(obj, field, values[field])
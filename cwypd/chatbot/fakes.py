@@ -0,0 +1,168 @@
+"""
+Offline stand-ins for the OpenAI and Pinecone backends.
+
+Point the CHATBOT backend settings at these factories to run the chatbot
+without network access, e.g. in tests:
+
+    CHATBOT = {
+        'EMBEDDINGS_BACKEND': 'chatbot.fakes.fake_embeddings',
+        'VECTORSTORE_BACKEND': 'chatbot.fakes.fake_vectorstore',
+        'LLM_BACKEND': 'chatbot.fakes.fake_chat_model',
+    }
+
+Latencies are medians; with a *_LATENCY_SIGMA setting every call draws its
+latency from a log-normal distribution around it, which gives the long tail
+real APIs have. benchmarks/fake_openai.py serves the same fakes over HTTP.
+"""
+import asyncio
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, List
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.fake import DeterministicFakeEmbedding
+from langchain.schema import ChatGeneration, ChatResult
+from langchain.schema.messages import AIMessage, AIMessageChunk
+from langchain.schema.output import ChatGenerationChunk
+
+from .vectorstores import LocalVectorStore
+
+
+def sample_latency(median, sigma=0.0):
+    """
+    Draw a latency in seconds: `median`, or log-normal around it with `sigma`.
+    """
+    if not median or not sigma:
+        return median
+    return median * random.lognormvariate(0, sigma)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model cycling through canned responses.
+
+    `latency` is waited before the first token and `token_delay` after each
+    word-sized token. The async paths use asyncio.sleep, so a slow fake model
+    behaves like a slow upstream API instead of blocking the event loop.
+    With `capacity`, at most that many calls are served at once and the rest
+    wait their turn, like a provider's concurrency limit.
+    """
+    responses: List[str]
+    latency: float = 0.0
+    latency_sigma: float = 0.0
+    token_delay: float = 0.0
+    capacity: int = 0
+    i: int = 0
+    upstream: Any = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.capacity:
+            self.upstream = threading.Semaphore(self.capacity)
+
+    @property
+    def _llm_type(self):
+        return 'fake-chat-model'
+
+    def _next_tokens(self):
+        response = self.responses[self.i % len(self.responses)]
+        self.i += 1
+        return re.findall(r'\s*\S+', response) or [response]
+
+    def _result(self, tokens):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=''.join(tokens)))])
+
+    @contextmanager
+    def _slot(self):
+        if self.upstream is None:
+            yield
+            return
+        with self.upstream:
+            yield
+
+    @asynccontextmanager
+    async def _aslot(self):
+        if self.upstream is None:
+            yield
+            return
+        while not self.upstream.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+        try:
+            yield
+        finally:
+            self.upstream.release()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._next_tokens()
+        with self._slot():
+            time.sleep(sample_latency(self.latency, self.latency_sigma) + self.token_delay * len(tokens))
+        return self._result(tokens)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._next_tokens()
+        async with self._aslot():
+            await asyncio.sleep(sample_latency(self.latency, self.latency_sigma) + self.token_delay * len(tokens))
+        return self._result(tokens)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        with self._slot():
+            time.sleep(sample_latency(self.latency, self.latency_sigma))
+            for token in self._next_tokens():
+                time.sleep(self.token_delay)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async with self._aslot():
+            await asyncio.sleep(sample_latency(self.latency, self.latency_sigma))
+            for token in self._next_tokens():
+                await asyncio.sleep(self.token_delay)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """
+    Deterministic embeddings that take `latency` seconds per call.
+    """
+    latency: float = 0.0
+    latency_sigma: float = 0.0
+
+    def embed_documents(self, texts):
+        time.sleep(sample_latency(self.latency, self.latency_sigma))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        time.sleep(sample_latency(self.latency, self.latency_sigma))
+        return super().embed_query(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(sample_latency(self.latency, self.latency_sigma))
+        return super().embed_documents(texts)
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(sample_latency(self.latency, self.latency_sigma))
+        return super().embed_query(text)
+
+
+def fake_embeddings(config):
+    return FakeEmbeddings(
+        size=config.get('FAKE_EMBEDDING_SIZE', 64),
+        latency=config.get('FAKE_EMBEDDING_LATENCY', 0.0),
+        latency_sigma=config.get('FAKE_EMBEDDING_LATENCY_SIGMA', 0.0),
+    )
+
+
+def fake_chat_model(config):
+    return FakeChatModel(
+        responses=config.get('FAKE_RESPONSES', ['This is a fake answer.']),
+        latency=config.get('FAKE_LLM_LATENCY', 0.0),
+        latency_sigma=config.get('FAKE_LLM_LATENCY_SIGMA', 0.0),
+        token_delay=config.get('FAKE_LLM_TOKEN_DELAY', 0.0),
+        capacity=config.get('FAKE_LLM_CAPACITY', 0),
+    )
+
+
+def fake_vectorstore(config, embeddings):
+    return LocalVectorStore.from_texts(config.get('FAKE_DOCUMENTS', ['Placeholder document.']), embeddings)
@@ -0,0 +1,102 @@
+"""
+Server-side conversation history.
+
+The history given to the chain is rebuilt from the conversation's stored
+UserQuestion/ChatbotResponse rows instead of being sent by the client, so
+requests and prompts stay the same size however long a conversation runs.
+Only the most recent turns that fit in HISTORY_TOKEN_BUDGET are kept. With
+HISTORY_SUMMARY_ENABLED, turns that fall out of the budget or past the last
+HISTORY_MAX_TURNS are folded into a rolling summary stored on the
+Conversation, at most HISTORY_MAX_TURNS turns in one call per request.
+Turns still in the write-behind buffer (chatbot.audit) are flushed first.
+"""
+from django.core.exceptions import ValidationError
+from django.http import Http404
+
+from .audit import flush_conversation
+from .models import ChatbotResponse, Conversation
+
+
+def estimate_tokens(text):
+    # ~4 characters per token, as in ingest, to avoid a tokenizer dependency.
+    return len(text) // 4 + 1
+
+
+def get_conversation(user, conversation_id=None):
+    """
+    Return the user's conversation with this id, or their latest one
+    (created on first use) when no id is given.
+    """
+    if conversation_id:
+        try:
+            return Conversation.objects.get(id=conversation_id, user=user)
+        except (Conversation.DoesNotExist, ValidationError):
+            raise Http404('No Conversation matches the given query.')
+    conversation = Conversation.objects.filter(user=user).order_by('-created_at').first()
+    return conversation or Conversation.objects.create(user=user)
+
+
+def recent_turns(conversation, max_turns=None, since=None, before=None, oldest=False):
+    """
+    Return up to `max_turns` (all with None) answered (question, answer,
+    answered_at) turns answered after `since` and before `before`, oldest
+    first. They are the latest such turns, or the earliest with `oldest`.
+    Questions left without an answer are skipped.
+    """
+    flush_conversation(conversation.id)
+    answers = ChatbotResponse.objects.filter(conversation=conversation, question__isnull=False)
+    if since is not None:
+        answers = answers.filter(timestamp__gt=since)
+    if before is not None:
+        answers = answers.filter(timestamp__lt=before)
+    # Paired through the answer's question, not by time, so concurrent asks cannot cross.
+    turns = (
+        answers.order_by('timestamp' if oldest else '-timestamp')
+        .values_list('question__question_text', 'response_text', 'timestamp')[:max_turns]
+    )
+    return list(turns) if oldest else list(reversed(turns))
+
+
+def build_history(conversation, pipeline, config):
+    """
+    Return (chat_history, summary) for the next question in `conversation`:
+    the latest (question, answer) pairs that fit the token budget, oldest
+    first, and the summary of the turns before them.
+    """
+    summary = conversation.history_summary
+    max_turns = config['HISTORY_MAX_TURNS']
+    turns = recent_turns(conversation, max_turns, since=conversation.summary_until)
+
+    budget = config['HISTORY_TOKEN_BUDGET'] - (estimate_tokens(summary) if summary else 0)
+    start = len(turns)
+    for question, answer, _ in reversed(turns):
+        budget -= estimate_tokens(question) + estimate_tokens(answer)
+        if budget < 0:
+            break
+        start -= 1
+    dropped, kept = turns[:start], turns[start:]
+
+    if config['HISTORY_SUMMARY_ENABLED'] and turns:
+        # Turns that moved past the window since the last summary come first.
+        # At most one summarizing call of HISTORY_MAX_TURNS turns per request:
+        # a longer backlog is caught up over the following requests.
+        older = recent_turns(conversation, max_turns, since=conversation.summary_until, before=turns[0][2], oldest=True)
+        folded = (older + dropped)[:max_turns]
+        if folded:
+            summary = pipeline.summarize(summary, [(question, answer) for question, answer, _ in folded])
+            Conversation.objects.filter(pk=conversation.pk).update(
+                history_summary=summary, summary_until=folded[-1][2]
+            )
+            conversation.history_summary, conversation.summary_until = summary, folded[-1][2]
+    return [(question, answer) for question, answer, _ in kept], summary
+
+
+def answer_delta(conversation, result):
+    """
+    The body returned for an answered question: only the new turn, which
+    clients append to their own copy of the conversation.
+    """
+    return {
+        'conversation_id': conversation.id,
+        'result': {key: result[key] for key in ('question', 'answer', 'cached') if key in result},
+    }
@@ -0,0 +1,215 @@
+"""
+Streaming document ingestion into the configured vector store.
+
+Files are read in blocks and cut into overlapping chunks by generators, so
+memory is bounded by the batch size and the number of batches in flight,
+not by the corpus. Chunks are embedded in batches on a thread pool and
+upserted in bulk. IngestedChunk records the content hash of every chunk
+that made it into the index, so a re-run (or a resumed, interrupted one)
+only embeds chunks that are new or changed.
+"""
+import hashlib
+import logging
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+from .cache import invalidate_answer_caches
+from .models import IngestedChunk
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = {'.txt', '.md', '.markdown'}
+PDF_EXTENSIONS = {'.pdf'}
+
+Chunk = namedtuple('Chunk', 'chunk_id source position text content_hash')
+
+
+def iter_sources(root):
+    """
+    Yield ingestible files under `root` in a stable order.
+    """
+    root = Path(root)
+    if not root.exists():
+        raise FileNotFoundError(f"No such file or directory: '{root}'")
+    paths = [root] if root.is_file() else sorted(p for p in root.rglob('*') if p.is_file())
+    for path in paths:
+        if path.suffix.lower() in TEXT_EXTENSIONS | PDF_EXTENSIONS:
+            yield path
+
+
+def read_blocks(path, block_size=1 << 16):
+    """
+    Yield the text of a file in blocks; PDFs page by page.
+    """
+    if path.suffix.lower() in PDF_EXTENSIONS:
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            logger.warning("Skipping %s: install pypdf to ingest PDF files", path)
+            return
+        for page in PdfReader(str(path)).pages:
+            yield (page.extract_text() or '') + '\n'
+        return
+    with open(path, encoding='utf-8', errors='replace') as fh:
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+def _split_point(text, size):
+    # Prefer a paragraph, then a line, then a word boundary in the second half of the chunk.
+    for separator in ('\n\n', '\n', ' '):
+        cut = text.rfind(separator, size // 2, size)
+        if cut != -1:
+            return cut + len(separator)
+    return size
+
+
+def iter_chunks(blocks, chunk_size=1000, overlap=200):
+    """
+    Cut a stream of text blocks into chunks of at most `chunk_size` characters,
+    each repeating the last `overlap` characters of the previous one.
+    """
+    overlap = min(overlap, chunk_size // 4)
+    buffer, emitted = '', 0
+    for block in blocks:
+        buffer += block
+        while len(buffer) >= chunk_size:
+            cut = _split_point(buffer, chunk_size)
+            yield buffer[:cut]
+            buffer = buffer[cut - overlap:]
+            emitted = overlap
+    if buffer[emitted:].strip():
+        yield buffer
+
+
+def iter_document_chunks(root, chunk_size=1000, overlap=200, counts=None):
+    """
+    Yield Chunks for every file under `root`. When given, `counts` is filled
+    with the number of chunks per source once that source is exhausted.
+    """
+    root = Path(root)
+    base = root if root.is_dir() else root.parent
+    for path in iter_sources(root):
+        source = path.relative_to(base).as_posix()
+        position = 0
+        for position, text in enumerate(iter_chunks(read_blocks(path), chunk_size, overlap), 1):
+            digest = hashlib.sha256(text.encode()).hexdigest()
+            yield Chunk(f'{source}#{position - 1}', source, position - 1, text, digest)
+        if counts is not None:
+            counts[source] = position
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class Ingestor:
+    """
+    Embed and upsert the chunks of a directory into `vectorstore`.
+    """
+
+    def __init__(self, embeddings, vectorstore, chunk_size=1000, overlap=200, batch_size=256, workers=4):
+        self.embeddings = embeddings
+        self.vectorstore = vectorstore
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.workers = workers
+        self.stats = {'chunks': 0, 'embedded': 0, 'skipped': 0, 'deleted': 0, 'tokens': 0}
+
+    def run(self, root, prune=False):
+        started = time.perf_counter()
+        counts = {}
+        chunks = iter_document_chunks(root, self.chunk_size, self.overlap, counts)
+        in_flight = deque()
+        with ThreadPoolExecutor(self.workers) as pool:
+            for batch in batched(chunks, self.batch_size):
+                self.stats['chunks'] += len(batch)
+                changed = self._changed(batch)
+                self.stats['skipped'] += len(batch) - len(changed)
+                if changed:
+                    in_flight.append((changed, pool.submit(self.embeddings.embed_documents, [c.text for c in changed])))
+                # Bound memory: at most two batches per worker are held at once.
+                while len(in_flight) > self.workers * 2:
+                    self._upsert(*in_flight.popleft())
+            while in_flight:
+                self._upsert(*in_flight.popleft())
+
+        if prune and not counts:
+            # An empty walk would make every indexed chunk look stale.
+            raise ValueError(f"Found no files to ingest under '{root}'; refusing to prune the whole index")
+        self._delete_stale(counts, prune)
+        if self.stats['embedded'] or self.stats['deleted']:
+            invalidate_answer_caches()
+
+        elapsed = time.perf_counter() - started
+        return {
+            **self.stats,
+            'sources': len(counts),
+            'elapsed_s': round(elapsed, 2),
+            'chunks_per_s': round(self.stats['chunks'] / elapsed, 1) if elapsed else None,
+            'tokens_per_s': round(self.stats['tokens'] / elapsed, 1) if elapsed else None,
+            'peak_memory_mb': peak_memory_mb(),
+        }
+
+    def _changed(self, batch):
+        known = dict(
+            IngestedChunk.objects.filter(chunk_id__in=[c.chunk_id for c in batch])
+            .values_list('chunk_id', 'content_hash')
+        )
+        return [c for c in batch if known.get(c.chunk_id) != c.content_hash]
+
+    def _upsert(self, chunks, future):
+        vectors = future.result()
+        texts = [c.text for c in chunks]
+        ids = [c.chunk_id for c in chunks]
+        metadatas = [{'source': c.source, 'position': c.position} for c in chunks]
+        if hasattr(self.vectorstore, 'add_embeddings'):
+            self.vectorstore.add_embeddings(texts, vectors, metadatas, ids)
+        else:
+            # Other stores embed again, which the embedding cache answers.
+            self.vectorstore.add_texts(texts, metadatas, ids=ids)
+        # Recorded only after the upsert, so an interrupted run resumes here.
+        IngestedChunk.objects.bulk_create(
+            [IngestedChunk(chunk_id=c.chunk_id, source=c.source, position=c.position, content_hash=c.content_hash)
+             for c in chunks],
+            update_conflicts=True,
+            unique_fields=['chunk_id'],
+            update_fields=['source', 'position', 'content_hash', 'updated_at'],
+        )
+        self.stats['embedded'] += len(chunks)
+        # Rough token estimate (~4 characters per token) to avoid a tokenizer dependency.
+        self.stats['tokens'] += sum(len(text) for text in texts) // 4
+
+    def _delete_stale(self, counts, prune):
+        """
+        Remove chunks past the new end of a shrunk file and, with `prune`,
+        chunks of files that no longer exist.
+        """
+        stale = [
+            chunk_id
+            for chunk_id, source, position in IngestedChunk.objects.values_list('chunk_id', 'source', 'position')
+            .iterator(chunk_size=2000)
+            if (source in counts and position >= counts[source]) or (prune and source not in counts)
+        ]
+        for ids in batched(stale, 1000):
+            self.vectorstore.delete(ids=ids)
+            IngestedChunk.objects.filter(chunk_id__in=ids).delete()
+            self.stats['deleted'] += len(ids)
@@ -0,0 +1,389 @@
+"""
+Per-request timings of the ask hot path.
+
+With INSTRUMENTATION_ENABLED, InstrumentationMiddleware times every request
+and the stages marked with stage(): JWT authentication, the conversation
+lookup, history, queueing for admission, the answer cache embedding,
+retrieval, generation, the audit writes and rendering the response. Each
+stage's time and database queries go back to the client in a Server-Timing
+header and are added to this process's totals, served by metrics/ in the
+Prometheus text format.
+
+With PROFILE_SLOW_REQUESTS set to a number of seconds, a PROFILE_SAMPLE_RATE
+share of requests run under a profiler (pyinstrument when it is installed,
+cProfile otherwise), and the profiles of those that took longer are written
+under PROFILE_DIR. One request is profiled at a time per process.
+
+Turned off, the middleware costs a settings lookup per request and stage()
+a context variable lookup.
+"""
+import cProfile
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from langchain.callbacks.base import BaseCallbackHandler
+
+from .conf import chatbot_settings
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('chatbot_trace', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Trace:
+    """
+    Time and queries of one request, in total and by stage.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.queries = 0
+        self.query_time = 0.0
+
+    def add(self, name, seconds, queries=0):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += queries
+
+    def server_timing(self, total):
+        parts = [f'total;dur={total * 1000:.1f}', f'db;desc="{self.queries} queries";dur={self.query_time * 1000:.1f}']
+        for name, (seconds, queries) in self.stages.items():
+            desc = f';desc="{queries} queries"' if queries else ''
+            parts.append(f'{name}{desc};dur={seconds * 1000:.1f}')
+        return ', '.join(parts)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the enclosed block as stage `name` of the current request, if traced.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start, queries = time.perf_counter(), trace.queries
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start, trace.queries - queries)
+
+
+class StageCallbackHandler(BaseCallbackHandler):
+    """
+    Record the retrieval and LLM calls made inside a chain as stages.
+    """
+    run_inline = True
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._started = {}
+
+    def _start(self, run_id):
+        self._started[run_id] = (time.perf_counter(), self.trace.queries)
+
+    def _end(self, name, run_id):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.trace.add(name, time.perf_counter() - started[0], self.trace.queries - started[1])
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end('retrieve', run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end('retrieve', run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end('llm', run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end('llm', run_id)
+
+
+def stage_callbacks():
+    """
+    Callbacks to pass to a chain run, or None when the request is not traced.
+    """
+    trace = _current.get()
+    return None if trace is None else [StageCallbackHandler(trace)]
+
+
+def _count_query(execute, sql, params, many, context):
+    trace = _current.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.queries += 1
+        trace.query_time += time.perf_counter() - start
+
+
+def watch_connection(conn):
+    if _count_query not in conn.execute_wrappers:
+        conn.execute_wrappers.append(_count_query)
+
+
+@receiver(connection_created)
+def _watch_new_connection(sender, connection, **kwargs):
+    # Covers the connections sync_to_async threads open for async views.
+    if chatbot_settings()['INSTRUMENTATION_ENABLED']:
+        watch_connection(connection)
+
+
+class Metrics:
+    """
+    Totals of the traced requests of this process.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.durations = {}
+            self.stages = {}
+            self.queries = {}
+            self.profiles = 0
+
+    def observe(self, view, method, status, total, trace):
+        with self._lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            counts, seconds = self.durations.setdefault(view, ([0] * len(self.buckets), [0.0]))
+            for i, bound in enumerate(self.buckets):
+                if total <= bound:
+                    counts[i] += 1
+            seconds[0] += total
+            self.queries[view] = self.queries.get(view, 0) + trace.queries
+            for name, (stage_seconds, stage_queries) in trace.stages.items():
+                entry = self.stages.setdefault((view, name), [0.0, 0, 0])
+                entry[0] += stage_seconds
+                entry[1] += 1
+                entry[2] += stage_queries
+
+    def prometheus(self):
+        """
+        Render the totals in the Prometheus text exposition format.
+        """
+        with self._lock:
+            lines = [
+                '# HELP chatbot_requests_total Requests served, by view, method and status.',
+                '# TYPE chatbot_requests_total counter',
+            ]
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'chatbot_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+            lines += [
+                '# HELP chatbot_request_duration_seconds Time to build the response, by view.',
+                '# TYPE chatbot_request_duration_seconds histogram',
+            ]
+            for view, (counts, seconds) in sorted(self.durations.items()):
+                count = sum(c for key, c in self.requests.items() if key[0] == view)
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f'chatbot_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {bucket}')
+                lines.append(f'chatbot_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {count}')
+                lines.append(f'chatbot_request_duration_seconds_sum{{view="{view}"}} {seconds[0]:.6f}')
+                lines.append(f'chatbot_request_duration_seconds_count{{view="{view}"}} {count}')
+            lines += [
+                '# HELP chatbot_stage_duration_seconds Time spent in each stage of a request, by view.',
+                '# TYPE chatbot_stage_duration_seconds summary',
+            ]
+            for (view, name), (seconds, count, _) in sorted(self.stages.items()):
+                lines.append(f'chatbot_stage_duration_seconds_sum{{view="{view}",stage="{name}"}} {seconds:.6f}')
+                lines.append(f'chatbot_stage_duration_seconds_count{{view="{view}",stage="{name}"}} {count}')
+            lines += [
+                '# HELP chatbot_stage_queries_total Database queries run in each stage, by view.',
+                '# TYPE chatbot_stage_queries_total counter',
+            ]
+            for (view, name), (_, _, queries) in sorted(self.stages.items()):
+                lines.append(f'chatbot_stage_queries_total{{view="{view}",stage="{name}"}} {queries}')
+            lines += [
+                '# HELP chatbot_db_queries_total Database queries run, by view.',
+                '# TYPE chatbot_db_queries_total counter',
+            ]
+            for view, queries in sorted(self.queries.items()):
+                lines.append(f'chatbot_db_queries_total{{view="{view}"}} {queries}')
+            lines += [
+                '# HELP chatbot_slow_request_profiles_total Profiles written for slow requests.',
+                '# TYPE chatbot_slow_request_profiles_total counter',
+                f'chatbot_slow_request_profiles_total {self.profiles}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class SlowRequestProfiler:
+    """
+    Profile a sampled request and keep the profile if it turns out slow.
+    """
+    _busy = threading.Lock()
+
+    def __init__(self, config, is_async=False):
+        self.config = config
+        self._profiler = None
+        # cProfile only sees the current thread, which an event loop shares with other requests.
+        if pyinstrument is None and is_async:
+            return
+        if random.random() >= config['PROFILE_SAMPLE_RATE'] or not self._busy.acquire(blocking=False):
+            return
+        if pyinstrument is not None:
+            self._profiler = pyinstrument.Profiler(async_mode='enabled' if is_async else 'disabled')
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def finish(self, view, total):
+        """
+        Stop profiling and write the profile if the request took too long.
+        """
+        if self._profiler is None:
+            return None
+        try:
+            self._stop()
+            if total < self.config['PROFILE_SLOW_REQUESTS']:
+                return None
+            directory = Path(self.config['PROFILE_DIR'])
+            directory.mkdir(parents=True, exist_ok=True)
+            name = f'{time.strftime("%Y%m%dT%H%M%S")}-{view.replace(":", "-")}-{total * 1000:.0f}ms'
+            if pyinstrument is not None:
+                path = directory / f'{name}.html'
+                path.write_text(self._profiler.output_html(), encoding='utf-8')
+            else:
+                path = directory / f'{name}.prof'
+                self._profiler.dump_stats(path)
+        finally:
+            self._profiler = None
+            self._busy.release()
+        with metrics._lock:
+            metrics.profiles += 1
+        logger.info("Profiled slow request to %s (%.0f ms) in %s", view, total * 1000, path)
+        return path
+
+    def cancel(self):
+        """
+        Stop profiling a request that raised, without keeping the profile.
+        """
+        if self._profiler is None:
+            return
+        try:
+            self._stop()
+        finally:
+            self._profiler = None
+            self._busy.release()
+
+    def _stop(self):
+        if pyinstrument is not None:
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+
+class InstrumentationMiddleware:
+    """
+    Trace requests when INSTRUMENTATION_ENABLED; see the module docstring.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        config = chatbot_settings()
+        if not config['INSTRUMENTATION_ENABLED']:
+            return self.get_response(request)
+        watch_connection(connection)
+        trace, profiler = self._begin(config, is_async=False)
+        token = _current.set(trace)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            if profiler is not None:
+                # Or the profiling slot stays taken until the process restarts.
+                profiler.cancel()
+            raise
+        finally:
+            _current.reset(token)
+        return self._end(request, response, trace, profiler, config)
+
+    async def __acall__(self, request):
+        config = chatbot_settings()
+        if not config['INSTRUMENTATION_ENABLED']:
+            return await self.get_response(request)
+        trace, profiler = self._begin(config, is_async=True)
+        token = _current.set(trace)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            if profiler is not None:
+                # Or the profiling slot stays taken until the process restarts.
+                profiler.cancel()
+            raise
+        finally:
+            _current.reset(token)
+        return self._end(request, response, trace, profiler, config)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that too.
+        trace = _current.get()
+        if trace is not None:
+            start, queries = time.perf_counter(), trace.queries
+            response.add_post_render_callback(
+                lambda r: trace.add('render', time.perf_counter() - start, trace.queries - queries)
+            )
+        return response
+
+    def _begin(self, config, is_async):
+        profiler = None
+        if config['PROFILE_SLOW_REQUESTS'] is not None:
+            profiler = SlowRequestProfiler(config, is_async)
+        return Trace(), profiler
+
+    def _end(self, request, response, trace, profiler, config):
+        total = time.perf_counter() - trace.start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unmatched'
+        metrics.observe(view, request.method, response.status_code, total, trace)
+        if profiler is not None:
+            profiler.finish(view, total)
+        if config['INSTRUMENTATION_SERVER_TIMING']:
+            response['Server-Timing'] = trace.server_timing(total)
+        return response
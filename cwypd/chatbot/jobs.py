@@ -0,0 +1,228 @@
+"""
+Database-backed job queue, so slow work such as LLM answers does not hold a
+web worker (`ask/` with "background": true).
+
+Jobs are rows of chatbot.Job, run by `manage.py worker`. A worker claims a
+job with SELECT ... FOR UPDATE SKIP LOCKED where the database supports it
+(PostgreSQL, MySQL 8), and otherwise with a conditional UPDATE from 'queued'
+to 'running' that only one worker can win (SQLite serializes writers
+anyway). A job that raises is retried with exponential backoff until
+max_attempts. A job whose worker died is requeued once its lease expires. No
+broker is involved.
+
+Handlers are registered per job kind with @handler and return a
+JSON-serializable result. They may run more than once, so their writes
+should be idempotent.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .conf import chatbot_settings
+from .models import ChatbotResponse, Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """
+    Register the decorated function as the handler of `kind` jobs.
+    """
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payload=None, user=None, conversation=None, max_attempts=None):
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        user=user,
+        conversation=conversation,
+        max_attempts=max_attempts or chatbot_settings()['JOB_MAX_ATTEMPTS'],
+    )
+
+
+def claim(worker_id, kinds=None, max_running=None):
+    """
+    Mark the next due job as running for `worker_id` and return it, or None.
+    With `max_running`, nothing is claimed while that many jobs are running.
+    """
+    if max_running and Job.objects.filter(status=Job.RUNNING).count() >= max_running:
+        return None
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('run_after')
+    if kinds:
+        due = due.filter(kind__in=kinds)
+    claimed = {'status': Job.RUNNING, 'locked_by': worker_id, 'locked_at': now, 'attempts': F('attempts') + 1}
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = due.select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            Job.objects.filter(pk=pk).update(**claimed)
+    else:
+        # Several workers may read the same candidates; the status check in
+        # the UPDATE lets exactly one of them have each.
+        for pk in due.values_list('pk', flat=True)[:10]:
+            if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**claimed):
+                break
+        else:
+            return None
+    return Job.objects.get(pk=pk)
+
+
+def run_job(job):
+    """
+    Run a claimed job and record its result, or schedule its retry.
+    """
+    try:
+        result = HANDLERS[job.kind](job)
+    except Exception:
+        logger.exception("Job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts)
+        fail(job, traceback.format_exc(limit=5))
+        return False
+    # Filtered on the lock owner: a worker whose lease was taken over must not finish the job.
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by).update(
+        status=Job.DONE, result=result, error='', finished_at=timezone.now()
+    )
+    return True
+
+
+def fail(job, error):
+    owned = Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by)
+    if job.attempts < job.max_attempts:
+        delay = chatbot_settings()['JOB_RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+        owned.update(
+            status=Job.QUEUED, run_after=timezone.now() + timedelta(seconds=delay),
+            error=error, locked_by='', locked_at=None,
+        )
+    else:
+        owned.update(status=Job.FAILED, error=error, finished_at=timezone.now())
+
+
+def requeue_stale(lease):
+    """
+    Put back jobs whose worker has held them for more than `lease` seconds,
+    or fail them when they are out of attempts.
+    """
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - timedelta(seconds=lease))
+    error = f'Worker lease of {lease}s expired'
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error=error, finished_at=timezone.now()
+    )
+    return stale.update(status=Job.QUEUED, error=error, locked_by='', locked_at=None)
+
+
+def run_pending(worker_id='inline', kinds=None):
+    """
+    Run due jobs in this thread until none are left. Return how many ran.
+    """
+    count = 0
+    while (job := claim(worker_id, kinds)) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+def queue_stats():
+    """
+    Queue depth by status and the age of the oldest queued job.
+    """
+    counts = dict(Job.objects.order_by().values_list('status').annotate(Count('pk')))
+    oldest = (
+        Job.objects.filter(status=Job.QUEUED).order_by('created_at').values_list('created_at', flat=True).first()
+    )
+    return {
+        **{status: counts.get(status, 0) for status, _ in Job.STATUS_CHOICES},
+        'due': Job.objects.filter(status=Job.QUEUED, run_after__lte=timezone.now()).count(),
+        'oldest_queued_age_s': round((timezone.now() - oldest).total_seconds(), 1) if oldest else None,
+    }
+
+
+class Worker:
+    """
+    Claim jobs and run up to `concurrency` of them at once on threads.
+    """
+
+    def __init__(self, concurrency=4, poll_interval=None, max_running=None, lease=None, kinds=None):
+        config = chatbot_settings()
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval or config['JOB_POLL_INTERVAL']
+        self.max_running = max_running
+        self.lease = lease or config['JOB_LEASE']
+        self.kinds = kinds
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def run(self, stop=None, once=False):
+        """
+        Work until `stop` is set or, with `once`, until the queue is drained.
+        """
+        stop = stop or threading.Event()
+        slots = threading.Semaphore(self.concurrency)
+        last_sweep = 0
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix='chatbot-worker') as pool:
+            while not stop.is_set():
+                if time.monotonic() - last_sweep > self.lease / 4:
+                    requeue_stale(self.lease)
+                    last_sweep = time.monotonic()
+                slots.acquire()
+                job = claim(self.worker_id, self.kinds, self.max_running)
+                if job is None:
+                    slots.release()
+                    with self._lock:
+                        idle = self._in_flight == 0
+                    if once and idle:
+                        break
+                    stop.wait(self.poll_interval)
+                    continue
+                with self._lock:
+                    self._in_flight += 1
+                pool.submit(self._run, job, slots)
+
+    def _run(self, job, slots):
+        try:
+            run_job(job)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._in_flight -= 1
+            slots.release()
+
+
+@handler('answer')
+def answer_question(job):
+    """
+    Answer a question queued by `ask/`. The response row takes the job's id,
+    so a retried job updates it instead of adding a second answer.
+    """
+    from .history import answer_delta, build_history
+    from .rag import get_pipeline
+
+    conversation = job.conversation
+    pipeline = get_pipeline()
+    chat_history, summary = build_history(conversation, pipeline, chatbot_settings())
+    result = pipeline.ask(job.payload['question'], chat_history, summary)
+    # One upsert statement: a read-then-write transaction can deadlock on SQLite's lock upgrade.
+    ChatbotResponse.objects.bulk_create(
+        [ChatbotResponse(id=job.id, conversation=conversation, response_text=result['answer'],
+                         question_id=job.payload.get('question_id'))],
+        update_conflicts=True, unique_fields=['id'], update_fields=['response_text'],
+    )
+    delta = answer_delta(conversation, result)
+    return {**delta, 'conversation_id': str(conversation.id), 'response_id': str(job.id)}
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.activity import backfill_activity
+
+
+class Command(BaseCommand):
+    help = "Compute every conversation's message count, last message and last activity from its messages, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='conversations per UPDATE')
+
+    def handle(self, *args, **options):
+        total = 0
+        for updated in backfill_activity(options['batch_size']):
+            total += updated
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{total} conversations updated so far")
+        self.stdout.write(self.style.SUCCESS(f"Updated {total} conversations"))
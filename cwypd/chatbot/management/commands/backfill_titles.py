@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.titles import backfill_titles
+
+
+class Command(BaseCommand):
+    help = 'Title the conversations still titled "Empty" from their first user message, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='conversations per UPDATE')
+
+    def handle(self, *args, **options):
+        total = 0
+        for titled in backfill_titles(options['batch_size']):
+            total += titled
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{total} conversations titled so far")
+        self.stdout.write(self.style.SUCCESS(f"Titled {total} conversations"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.activity import inconsistent_activity, refresh_activity
+
+
+class Command(BaseCommand):
+    help = "Find conversations whose stored message count or last message disagree with their messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='conversations checked per query')
+        parser.add_argument('--repair', action='store_true', help='recompute the conversations found')
+
+    def handle(self, *args, **options):
+        stale = list(inconsistent_activity(options['batch_size']))
+        if options['verbosity'] > 1:
+            for pk in stale:
+                self.stdout.write(f"Conversation {pk} is out of date")
+        if not stale:
+            self.stdout.write(self.style.SUCCESS("All conversations are consistent"))
+            return
+        if not options['repair']:
+            raise CommandError(f"{len(stale)} conversations are out of date; run with --repair to fix them")
+        for start in range(0, len(stale), options['batch_size']):
+            refresh_activity(stale[start:start + options['batch_size']])
+        self.stdout.write(self.style.SUCCESS(f"Repaired {len(stale)} conversations"))
@@ -0,0 +1,33 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.export import export_records, ndjson
+
+
+class Command(BaseCommand):
+    help = "Write a user's conversations, messages, questions and answers as NDJSON, streamed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='whose history to export')
+        parser.add_argument('--output', default='-', help='file to write, - for stdout')
+        parser.add_argument('--gzip', action='store_true', help='gzip the output')
+        parser.add_argument('--chunk-size', type=int, help='rows per fetch (default: EXPORT_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+        records = export_records(user, options['chunk_size'])
+        if options['output'] == '-':
+            for block in ndjson(records, options['gzip']):
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+        written = 0
+        with open(options['output'], 'wb') as output:
+            for block in ndjson(records, options['gzip']):
+                written += output.write(block)
+        self.stdout.write(self.style.SUCCESS(f"Exported {user.email} to {options['output']} ({written} bytes)"))
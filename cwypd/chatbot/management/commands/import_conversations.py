@@ -0,0 +1,31 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.export import InvalidExport, import_records, read_lines
+
+
+class Command(BaseCommand):
+    help = "Add the conversations of an NDJSON export, gzipped or not, to a user's history, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='whose history to import into')
+        parser.add_argument('path', help='export file, - for stdin')
+        parser.add_argument('--batch-size', type=int, help='rows per INSERT (default: IMPORT_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['email'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+        source = sys.stdin.buffer if options['path'] == '-' else open(options['path'], 'rb')
+        try:
+            counts = import_records(user, read_lines(source), options['batch_size'])
+        except InvalidExport as exc:
+            raise CommandError(str(exc))
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        summary = ', '.join(f'{count} {kind}s' for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Imported {summary} into {user.email}"))
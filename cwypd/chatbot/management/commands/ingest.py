@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.ingest import Ingestor
+from chatbot.rag import get_pipeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Chunk, embed and upsert the .txt/.md/.pdf files under PATH into the configured "
+        "vector store. Unchanged chunks from earlier runs are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='characters per chunk')
+        parser.add_argument('--overlap', type=int, default=200, help='characters shared by consecutive chunks')
+        parser.add_argument('--batch-size', type=int, default=256, help='chunks per embedding call')
+        parser.add_argument('--workers', type=int, default=4, help='concurrent embedding calls')
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='also delete chunks of files that are no longer under PATH (PATH must be the whole corpus)',
+        )
+        parser.add_argument('--build-ivf', action='store_true', help='rebuild the local index clusters afterwards')
+
+    def handle(self, *args, **options):
+        pipeline = get_pipeline()
+        ingestor = Ingestor(
+            pipeline.embeddings,
+            pipeline.vectorstore,
+            chunk_size=options['chunk_size'],
+            overlap=options['overlap'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+        )
+        try:
+            stats = ingestor.run(options['path'], prune=options['prune'])
+        except (FileNotFoundError, ValueError) as exc:
+            raise CommandError(exc)
+
+        if hasattr(pipeline.vectorstore, 'compact'):
+            # Re-ingested and deleted chunks leave retired rows behind in the local index.
+            pipeline.vectorstore.compact()
+        if options['build_ivf']:
+            if not hasattr(pipeline.vectorstore, 'build_ivf'):
+                raise CommandError("The configured vector store does not support --build-ivf")
+            pipeline.vectorstore.build_ivf()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingested {stats['sources']} files: {stats['chunks']} chunks, {stats['embedded']} embedded, "
+            f"{stats['skipped']} unchanged, {stats['deleted']} deleted"
+        ))
+        self.stdout.write(
+            f"{stats['elapsed_s']}s, {stats['chunks_per_s']} chunks/s, ~{stats['tokens_per_s']} tokens/s, "
+            f"peak memory {stats['peak_memory_mb']} MB"
+        )
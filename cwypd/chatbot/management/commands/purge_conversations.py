@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.purge import purge
+
+
+class Command(BaseCommand):
+    help = 'Delete the rows of deleted conversations in batches, for when no worker runs the purge jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='rows per DELETE (default: PURGE_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        purged = purge(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} conversations"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text index of the messages from chatbot_message, and compact it."
+
+    def handle(self, *args, **options):
+        kind = rebuild_index()
+        if kind == 'scan':
+            raise CommandError("This database has no search index; search scans the messages instead.")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the {kind} search index"))
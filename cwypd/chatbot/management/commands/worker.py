@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from chatbot.jobs import Worker, queue_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (e.g. answers requested with \"background\": true). "
+        "Start as many worker processes as the LLM rate limits allow."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='worker processes to start')
+        parser.add_argument('--concurrency', type=int, default=4, help='jobs run at once per process')
+        parser.add_argument('--max-running', type=int, help='stop claiming while this many jobs run in total')
+        parser.add_argument('--kind', action='append', dest='kinds', help='only run jobs of this kind')
+        parser.add_argument('--poll-interval', type=float, help='seconds between polls of an empty queue')
+        parser.add_argument('--lease', type=int, help='seconds before a running job is presumed lost')
+        parser.add_argument('--once', action='store_true', help='exit once the queue is drained')
+        parser.add_argument('--stats', action='store_true', help='print queue depth and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for key, value in queue_stats().items():
+                self.stdout.write(f"{key}: {value}")
+            return
+
+        if options['processes'] == 1:
+            self.work(options)
+            return
+        # Children must not inherit the parent's database connections.
+        connections.close_all()
+        children = [
+            multiprocessing.Process(target=self.work, args=(options,), daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for child in children:
+            child.start()
+
+        def forward(signum, frame):
+            # Each child finishes the jobs in hand; the parent waits for them below.
+            for child in children:
+                if child.is_alive():
+                    os.kill(child.pid, signum)
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, forward)
+        for child in children:
+            child.join()
+
+    def work(self, options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            # Finish the jobs in hand, then exit.
+            signal.signal(signum, lambda *args: stop.set())
+        worker = Worker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            max_running=options['max_running'],
+            lease=options['lease'],
+            kinds=options['kinds'],
+        )
+        self.stdout.write(f"Worker {worker.worker_id} started with {worker.concurrency} threads")
+        worker.run(stop, once=options['once'])
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotresponse',
+            name='sources',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_chatbotresponse_sources'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestedChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_id', models.CharField(max_length=1024, unique=True)),
+                ('source', models.CharField(max_length=1024)),
+                ('position', models.PositiveIntegerField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
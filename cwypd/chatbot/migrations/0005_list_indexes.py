@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_conversation_history_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatbotresponse',
+            index=models.Index(fields=['conversation', 'timestamp'], name='response_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'archive', 'favourite', 'created_at'], name='conversation_user_list_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userquestion',
+            index=models.Index(fields=['conversation', 'timestamp'], name='question_conversation_idx'),
+        ),
+    ]
@@ -0,0 +1,99 @@
+"""
+Full-text index over Message.content (see chatbot/search.py).
+
+SQLite: an FTS5 table over a view of the messages and their owner, kept in
+sync by triggers. PostgreSQL: a GIN index on the content's tsvector. Other
+databases, and SQLite builds without FTS5, get nothing and search falls
+back to a scan.
+"""
+from django.db import migrations
+from django.db.utils import OperationalError
+
+SQLITE_FORWARDS = [
+    # The owner is indexed as a token so a user's matches are found in the index, not by a join.
+    # Prefixes of up to four characters, what is typed while searching, get their own index.
+    """
+    CREATE VIEW chatbot_message_search AS
+    SELECT m.id, m.content, 'u' || c.user_id AS owner
+    FROM chatbot_message m JOIN chatbot_conversation c ON c.id = m.conversation_id
+    """,
+    """
+    CREATE VIRTUAL TABLE chatbot_message_fts USING fts5(
+        content, owner, content='chatbot_message_search', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER chatbot_message_fts_insert AFTER INSERT ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(rowid, content, owner)
+        SELECT new.id, new.content, 'u' || user_id FROM chatbot_conversation WHERE id = new.conversation_id;
+    END
+    """,
+    """
+    CREATE TRIGGER chatbot_message_fts_delete AFTER DELETE ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(chatbot_message_fts, rowid, content, owner)
+        SELECT 'delete', old.id, old.content, 'u' || user_id FROM chatbot_conversation WHERE id = old.conversation_id;
+    END
+    """,
+    """
+    CREATE TRIGGER chatbot_message_fts_update AFTER UPDATE OF content, conversation_id ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(chatbot_message_fts, rowid, content, owner)
+        SELECT 'delete', old.id, old.content, 'u' || user_id FROM chatbot_conversation WHERE id = old.conversation_id;
+        INSERT INTO chatbot_message_fts(rowid, content, owner)
+        SELECT new.id, new.content, 'u' || user_id FROM chatbot_conversation WHERE id = new.conversation_id;
+    END
+    """,
+    """
+    CREATE TRIGGER chatbot_conversation_fts_owner AFTER UPDATE OF user_id ON chatbot_conversation BEGIN
+        INSERT INTO chatbot_message_fts(chatbot_message_fts, rowid, content, owner)
+        SELECT 'delete', id, content, 'u' || old.user_id FROM chatbot_message WHERE conversation_id = old.id;
+        INSERT INTO chatbot_message_fts(rowid, content, owner)
+        SELECT id, content, 'u' || new.user_id FROM chatbot_message WHERE conversation_id = new.id;
+    END
+    """,
+    "INSERT INTO chatbot_message_fts(chatbot_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = [
+    'DROP TRIGGER IF EXISTS chatbot_conversation_fts_owner',
+    'DROP TRIGGER IF EXISTS chatbot_message_fts_update',
+    'DROP TRIGGER IF EXISTS chatbot_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chatbot_message_fts_insert',
+    'DROP TABLE IF EXISTS chatbot_message_fts',
+    'DROP VIEW IF EXISTS chatbot_message_search',
+]
+
+POSTGRES_FORWARDS = [
+    "CREATE INDEX IF NOT EXISTS message_search_idx ON chatbot_message USING gin (to_tsvector('english', content))",
+]
+
+POSTGRES_BACKWARDS = [
+    'DROP INDEX IF EXISTS message_search_idx',
+]
+
+
+def run(statements_by_vendor):
+    def operation(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        for statement in statements_by_vendor.get(vendor, []):
+            try:
+                schema_editor.execute(statement)
+            except OperationalError as exc:
+                if vendor == 'sqlite' and 'fts5' in str(exc):
+                    return  # compiled without FTS5: search scans instead
+                raise
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_conversation_deleted_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRES_FORWARDS}),
+            run({'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRES_BACKWARDS}),
+        ),
+    ]
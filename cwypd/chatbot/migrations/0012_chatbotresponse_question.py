@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_questions(apps, schema_editor):
+    # Existing answers answer the latest question asked before them.
+    ChatbotResponse = apps.get_model('chatbot', 'ChatbotResponse')
+    UserQuestion = apps.get_model('chatbot', 'UserQuestion')
+    asked = UserQuestion.objects.filter(
+        conversation_id=models.OuterRef('conversation_id'), timestamp__lte=models.OuterRef('timestamp')
+    ).order_by('-timestamp')
+    ChatbotResponse.objects.filter(question__isnull=True).update(question=models.Subquery(asked.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0011_conversation_activity_idx_pk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatbotresponse',
+            name='question',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chatbot.userquestion'),
+        ),
+        migrations.RunPython(link_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+"""
+Index only the content of messages in the SQLite full-text table.
+
+The triggers of 0010 looked up the message's owner in chatbot_conversation,
+which made concurrent message writes fail with "database is locked" on the
+default `sqlite` profile. The FTS5 table now reads chatbot_message directly
+and its triggers only use the row being written; searches filter by owner
+with a join instead (see chatbot/search.py). PostgreSQL is unchanged.
+"""
+from importlib import import_module
+
+from django.db import migrations
+
+message_search = import_module('chatbot.migrations.0010_message_search')
+
+SQLITE_FORWARDS = message_search.SQLITE_BACKWARDS + [
+    """
+    CREATE VIRTUAL TABLE chatbot_message_fts USING fts5(
+        content, content='chatbot_message', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER chatbot_message_fts_insert AFTER INSERT ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER chatbot_message_fts_delete AFTER DELETE ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(chatbot_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER chatbot_message_fts_update AFTER UPDATE OF content ON chatbot_message BEGIN
+        INSERT INTO chatbot_message_fts(chatbot_message_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chatbot_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO chatbot_message_fts(chatbot_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = message_search.SQLITE_BACKWARDS + message_search.SQLITE_FORWARDS
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0012_chatbotresponse_question'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            message_search.run({'sqlite': SQLITE_FORWARDS}),
+            message_search.run({'sqlite': SQLITE_BACKWARDS}),
+        ),
+    ]
@@ -1,68 +1,165 @@
-from django.db import models
-from django.conf import settings
-import uuid
-
-class Chat(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    created_at = models.DateTimeField(auto_now_add=True)
-
-    def __str__(self):
-        return f"Chat {self.pk}"
-
-class Conversation(models.Model):
-    STATUS_CHOICES = [
-        ('active', 'Active'),
-        ('archived', 'Archived'),
-        ('ended', 'Ended'),
-    ]
-
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    title = models.CharField(max_length=255, default="Empty")
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-    favourite = models.BooleanField(default=False)
-    archive = models.BooleanField(default=False)
-    prompt = models.TextField(null=True, blank=True)
-    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
-
-    class Meta:
-        ordering = ['created_at']
-
-    def __str__(self):
-        return f"Conversation {self.title} - {self.user.username}"
-
-
-class Message(models.Model):
-    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
-    content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
-    is_from_user = models.BooleanField(default=True)
-    in_reply_to = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='replies')
-
-    class Meta:
-        ordering = ['-created_at']
-
-    def __str__(self):
-        return f"Message {self.id} - {self.conversation}"
-
-
-class UserQuestion(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    question_text = models.TextField()
-    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
-
-    def __str__(self):
-        return f"Question '{self.question_text[:50]}' by {self.user.username}"
-
-
-class ChatbotResponse(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
-    response_text = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
-
-    def __str__(self):
-        return f"Response in conversation {self.conversation.id}: '{self.response_text[:50]}'"
+from django.db import models
+from django.conf import settings
+from django.utils import timezone
+import uuid
+
+class Chat(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Chat {self.pk}"
+
+class LiveConversationManager(models.Manager):
+    """
+    Conversations that have not been deleted.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class Conversation(models.Model):
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('archived', 'Archived'),
+        ('ended', 'Ended'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=255, default="Empty")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    favourite = models.BooleanField(default=False)
+    archive = models.BooleanField(default=False)
+    prompt = models.TextField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active')
+    history_summary = models.TextField(blank=True, default='')
+    summary_until = models.DateTimeField(null=True, blank=True)
+    # Kept up to date by chatbot.activity for the conversation list.
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_message_preview = models.CharField(max_length=100, blank=True, default='', editable=False)
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Set when the conversation is deleted; its rows are purged later by chatbot.purge.
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = LiveConversationManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['user', 'archive', 'favourite', 'created_at'], name='conversation_user_list_idx'),
+            models.Index(fields=['user', '-last_activity_at', '-id'], name='conversation_activity_idx'),
+        ]
+
+    def __str__(self):
+        return f"Conversation {self.title} - {self.user.username}"
+
+
+class Message(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    is_from_user = models.BooleanField(default=True)
+    in_reply_to = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='replies')
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'created_at'], name='message_conversation_idx'),
+        ]
+
+    def __str__(self):
+        return f"Message {self.id} - {self.conversation}"
+
+
+class UserQuestion(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    question_text = models.TextField()
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    # Set when the instance is built, not saved, so buffered rows keep their request time.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='question_conversation_idx'),
+        ]
+
+    def __str__(self):
+        return f"Question '{self.question_text[:50]}' by {self.user.username}"
+
+
+class ChatbotResponse(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    response_text = models.TextField()
+    sources = models.JSONField(default=list, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # The question this answers, so concurrent asks in a conversation pair up right.
+    question = models.ForeignKey(UserQuestion, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='response_conversation_idx'),
+        ]
+
+    def __str__(self):
+        return f"Response in conversation {self.conversation_id}: '{self.response_text[:50]}'"
+
+
+class IngestedChunk(models.Model):
+    """
+    Manifest of document chunks upserted into the vector index by `manage.py ingest`.
+    """
+    chunk_id = models.CharField(max_length=1024, unique=True)
+    source = models.CharField(max_length=1024)
+    position = models.PositiveIntegerField()
+    content_hash = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Chunk {self.chunk_id}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work in the database-backed queue (see chatbot/jobs.py).
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, null=True, blank=True, on_delete=models.CASCADE)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.kind} {self.id} ({self.status})"
@@ -0,0 +1,143 @@
+"""
+Pagination for the conversation and message lists.
+
+Offset pagination reads and discards every row before the requested page, so
+deep pages of long conversations get slower and slower. Passing
+?pagination=cursor switches a list to keyset pagination instead: each page
+seeks through the (conversation, created_at) or (user, last_activity_at)
+index from the position encoded in the cursor, so its cost does not depend
+on how deep the page is. Follow the `next`/`previous` links to page.
+
+The conversation list pages on last_activity_at, which many rows can share
+(every conversation that existed before migration 0008 has the same value)
+and which changes while a client pages. Its cursor therefore holds the
+primary key too and seeks past (last_activity_at, pk), so rows are neither
+skipped nor repeated at page boundaries.
+"""
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, LimitOffsetPagination, _reverse_ordering
+
+
+class KeysetOrOffsetPagination(BasePagination):
+    """
+    Delegate to `keyset_class` when a cursor is requested, else to `offset_class`.
+    """
+    offset_class = None
+    keyset_class = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        use_keyset = request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params
+        self.delegate = (self.keyset_class if use_keyset else self.offset_class)()
+        return self.delegate.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.delegate.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.offset_class().get_paginated_response_schema(schema)
+
+
+class LastMessagesPagination(LimitOffsetPagination):
+    """
+    Pagination class for last messages.
+    """
+    default_limit = 10
+    max_limit = 10
+
+
+class MessageKeysetPagination(CursorPagination):
+    ordering = '-created_at'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class MessagePagination(KeysetOrOffsetPagination):
+    offset_class = LastMessagesPagination
+    keyset_class = MessageKeysetPagination
+
+
+class ConversationOffsetPagination(LimitOffsetPagination):
+    # No default limit: the full list is returned unless ?limit= is given.
+    default_limit = None
+    max_limit = 100
+
+
+class TiebreakCursorPagination(CursorPagination):
+    """
+    CursorPagination whose cursor position is (ordering field, pk) instead of
+    the ordering field alone plus an offset into its ties.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset with the seek on both fields.
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        ordering = self.get_ordering(request, queryset, view)[:1]
+        self.ordering = ordering + ('-pk' if ordering[0].startswith('-') else 'pk',)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            queryset = self.seek(queryset, current_position, reverse)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position, self.previous_position = following_position, current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def seek(self, queryset, position, reverse):
+        """
+        Keep the rows after `position` in the direction of the page.
+        """
+        field = self.ordering[0].lstrip('-')
+        lookup = 'lt' if reverse != self.ordering[0].startswith('-') else 'gt'
+        try:
+            value, pk = json.loads(position)
+            return queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'pk__{lookup}': pk})
+            )
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _get_position_from_instance(self, instance, ordering):
+        field = ordering[0].lstrip('-')
+        if isinstance(instance, dict):
+            return json.dumps([str(instance[field]), str(instance['pk'])])
+        return json.dumps([str(getattr(instance, field)), str(instance.pk)])
+
+
+class ConversationKeysetPagination(TiebreakCursorPagination):
+    ordering = '-last_activity_at'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # Page in whichever order the view sorted the conversations.
+        return tuple(queryset.query.order_by) or super().get_ordering(request, queryset, view)
+
+
+class ConversationPagination(KeysetOrOffsetPagination):
+    offset_class = ConversationOffsetPagination
+    keyset_class = ConversationKeysetPagination
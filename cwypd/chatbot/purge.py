@@ -0,0 +1,84 @@
+"""
+Deleting conversations without holding the database.
+
+Deleting a Conversation through the ORM loads every one of its messages,
+questions and answers into Python, nulls the in_reply_to links pointing at
+the messages and deletes it all in one transaction, holding SQLite's write
+lock for as long as that takes. The delete views instead only set
+deleted_at, which hides the conversation from every query through
+Conversation.objects, and queue a `purge_conversations` job.
+
+The job removes the rows in batches of PURGE_BATCH_SIZE, each its own short
+statement, so other writers get in between. Questions, answers and jobs are
+removed with a plain DELETE. Messages go through Django's collector,
+limited to their ids, because of the in_reply_to links. The conversation
+row goes last. Purging is idempotent, and `manage.py purge_conversations`
+purges whatever is left without a worker.
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .conf import chatbot_settings
+from .jobs import enqueue, handler
+from .models import ChatbotResponse, Conversation, Job, Message, UserQuestion
+
+logger = logging.getLogger(__name__)
+
+# Messages first: replies in other conversations are unlinked from them before the rows go.
+# Answers before questions: deleting a question would otherwise update the answers pointing at it.
+CHILD_MODELS = (Message, ChatbotResponse, UserQuestion, Job)
+
+
+def soft_delete(user, ids):
+    """
+    Hide the user's conversations among `ids` and queue their purge.
+    Return how many were deleted.
+    """
+    ids = [str(pk) for pk in ids]
+    with transaction.atomic():
+        count = Conversation.objects.filter(user=user, pk__in=ids).update(deleted_at=timezone.now())
+        if count:
+            # The job does not reference the conversations, or purging them would delete it.
+            enqueue('purge_conversations', {'conversation_ids': ids}, user=user)
+    return count
+
+
+def purge_conversation(conversation_id, batch_size=None):
+    """
+    Delete a conversation's rows `batch_size` at a time, then the
+    conversation. Return the number of rows deleted.
+    """
+    batch_size = batch_size or chatbot_settings()['PURGE_BATCH_SIZE']
+    total = 0
+    for model in CHILD_MODELS:
+        while True:
+            batch = list(model.objects.filter(conversation_id=conversation_id).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            deleted, _ = model.objects.filter(pk__in=batch).only('pk').delete()
+            total += deleted
+    deleted, _ = Conversation.all_objects.filter(pk=conversation_id).delete()
+    return total + deleted
+
+
+def purge(ids=None, batch_size=None):
+    """
+    Purge the deleted conversations among `ids`, or all of them. Return
+    how many conversations were purged.
+    """
+    deleted = Conversation.all_objects.filter(deleted_at__isnull=False)
+    if ids is not None:
+        deleted = deleted.filter(pk__in=ids)
+    count = 0
+    for conversation_id in list(deleted.values_list('pk', flat=True)):
+        rows = purge_conversation(conversation_id, batch_size)
+        logger.info("Purged conversation %s (%s rows)", conversation_id, rows)
+        count += 1
+    return count
+
+
+@handler('purge_conversations')
+def purge_conversations(job):
+    return {'purged': purge(job.payload['conversation_ids'])}
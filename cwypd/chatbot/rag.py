@@ -0,0 +1,234 @@
+"""
+Process-wide retrieval pipeline.
+
+Building the embeddings client, connecting to the vector store and creating
+the chat model is slow and opens new HTTP clients, so it is done once per
+worker process and shared by every request. Only the conversation memory is
+per request, seeded with the turns rebuilt by chatbot.history.
+"""
+import os
+import threading
+
+from asgiref.sync import sync_to_async
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from langchain.chains import ConversationalRetrievalChain, LLMChain
+from langchain.chains.conversation.memory import ConversationBufferMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import SystemMessage, get_buffer_string
+
+from .cache import SemanticCache, answer_cache_enabled
+from .conf import chatbot_settings
+from .embeddings import CachedEmbeddings, EmbeddingStore
+from .instrumentation import stage, stage_callbacks
+from .singleflight import SingleFlight, flight_key
+
+
+class RAGPipeline:
+    """
+    Shared backends plus the sub-chains reused by every per-request chain.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.embeddings = import_string(config['EMBEDDINGS_BACKEND'])(config)
+        if config['EMBEDDING_CACHE_ENABLED']:
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                namespace=config['EMBEDDINGS_BACKEND'],
+                store=EmbeddingStore(config['EMBEDDING_CACHE_PATH']) if config['EMBEDDING_CACHE_PATH'] else None,
+                max_entries=config['EMBEDDING_CACHE_MAX_ENTRIES'],
+                batch_window=config['EMBEDDING_BATCH_WINDOW'],
+                batch_size=config['EMBEDDING_BATCH_SIZE'],
+            )
+        self.vectorstore = import_string(config['VECTORSTORE_BACKEND'])(config, self.embeddings)
+        self.retriever = self.vectorstore.as_retriever()
+        self.llm = import_string(config['LLM_BACKEND'])(config)
+        template = ConversationalRetrievalChain.from_llm(llm=self.llm, retriever=self.retriever)
+        self._combine_docs_chain = template.combine_docs_chain
+        self._question_generator = template.question_generator
+        self._summary_chain = LLMChain(llm=self.llm, prompt=SUMMARY_PROMPT)
+        self.answer_cache = None
+        if answer_cache_enabled(config):
+            self.answer_cache = SemanticCache(
+                similarity=config['ANSWER_CACHE_SIMILARITY'],
+                ttl=config['ANSWER_CACHE_TTL'],
+                max_entries=config['ANSWER_CACHE_MAX_ENTRIES'],
+            )
+        self.coalescer = None
+        if config['COALESCE_ENABLED']:
+            self.coalescer = SingleFlight(
+                shared=config['COALESCE_ACROSS_PROCESSES'],
+                lock_timeout=config['COALESCE_TIMEOUT'],
+                wait=config['COALESCE_TIMEOUT'],
+            )
+
+    def new_memory(self, chat_history=(), summary=''):
+        """
+        Return a memory holding the summary of earlier turns, if any, followed
+        by the given (question, answer) pairs.
+        """
+        memory = ConversationBufferMemory(memory_key='chat_history', output_key='answer', return_messages=False)
+        if summary:
+            memory.chat_memory.add_message(SystemMessage(content=summary))
+        for question, answer in chat_history:
+            memory.chat_memory.add_user_message(question)
+            memory.chat_memory.add_ai_message(answer)
+        return memory
+
+    def chain(self, memory=None):
+        """
+        Return a chain bound to its own memory. The sub-chains, LLM and
+        retriever it wraps are shared.
+        """
+        return ConversationalRetrievalChain(
+            combine_docs_chain=self._combine_docs_chain,
+            question_generator=self._question_generator,
+            retriever=self.retriever,
+            memory=memory or self.new_memory(),
+            get_chat_history=lambda h: h,
+            return_source_documents=True,
+        )
+
+    def summarize(self, summary, chat_history):
+        """
+        Fold (question, answer) pairs into the running summary of a conversation.
+        """
+        new_lines = get_buffer_string(self.new_memory(chat_history).chat_memory.messages)
+        return self._summary_chain.predict(summary=summary, new_lines=new_lines)
+
+    def _run_chain(self, question, memory):
+        # Identical questions with identical history in flight at once share one run.
+        callbacks = stage_callbacks()
+        if self.coalescer is None:
+            return self.chain(memory)({'question': question}, callbacks=callbacks)
+        key = flight_key(question, memory.buffer)
+        return self.coalescer.do(key, lambda: self.chain(memory)({'question': question}, callbacks=callbacks))
+
+    async def _arun_chain(self, question, memory):
+        callbacks = stage_callbacks()
+        if self.coalescer is None:
+            return await self.chain(memory).acall({'question': question}, callbacks=callbacks)
+        key = flight_key(question, memory.buffer)
+        return await self.coalescer.ado(
+            key, lambda: self.chain(memory).acall({'question': question}, callbacks=callbacks)
+        )
+
+    def ask(self, question, chat_history=(), summary=''):
+        """
+        Run the chain, going through the answer cache for questions asked
+        without history (a follow-up depends on the turns before it).
+        """
+        memory = self.new_memory(chat_history, summary)
+        if self.answer_cache is None or memory.buffer:
+            return self._run_chain(question, memory)
+        cached = self.answer_cache.get_exact(question)
+        if cached is None:
+            with stage('embed'):
+                vector = self.embeddings.embed_query(question)
+            cached = self.answer_cache.get_similar(vector)
+            if cached is None:
+                result = self._run_chain(question, memory)
+                self.answer_cache.put(question, vector, result['answer'], result['source_documents'])
+                return result
+        return {'question': question, 'chat_history': '', **cached}
+
+    async def aask(self, question, chat_history=(), summary=''):
+        memory = self.new_memory(chat_history, summary)
+        if self.answer_cache is None or memory.buffer:
+            return await self._arun_chain(question, memory)
+        cached = self.answer_cache.get_exact(question)
+        if cached is None:
+            with stage('embed'):
+                vector = await self.embeddings.aembed_query(question)
+            cached = self.answer_cache.get_similar(vector)
+            if cached is None:
+                result = await self._arun_chain(question, memory)
+                self.answer_cache.put(question, vector, result['answer'], result['source_documents'])
+                return result
+        return {'question': question, 'chat_history': '', **cached}
+
+    async def astream(self, question, chat_history=(), summary=''):
+        """
+        Yield the answer token by token as {'token': ...} events, followed by
+        a final {'answer': ..., 'source_documents': [...]} event.
+
+        Mirrors what the chain does in one call: condense the question against
+        the history, retrieve, then stream the stuffed-prompt completion.
+        """
+        history = self.new_memory(chat_history, summary).buffer
+        vector = None
+        if history:
+            question = await self._question_generator.arun(question=question, chat_history=history)
+        elif self.answer_cache is not None:
+            cached = self.answer_cache.get_exact(question)
+            if cached is None:
+                vector = await self.embeddings.aembed_query(question)
+                cached = self.answer_cache.get_similar(vector)
+            if cached is not None:
+                yield {'token': cached['answer']}
+                yield cached
+                return
+        docs = await self.retriever.aget_relevant_documents(question)
+        llm_chain = self._combine_docs_chain.llm_chain
+        inputs = self._combine_docs_chain._get_inputs(docs, question=question)
+        messages = llm_chain.prompt.format_prompt(**inputs).to_messages()
+
+        answer = []
+        async for chunk in self.llm.astream(messages):
+            answer.append(chunk.content)
+            yield {'token': chunk.content}
+        answer = ''.join(answer)
+        if vector is not None:
+            self.answer_cache.put(question, vector, answer, docs)
+        yield {'answer': answer, 'source_documents': docs}
+
+
+_pipeline = None
+_lock = threading.Lock()
+
+
+def get_pipeline():
+    """
+    Return the pipeline for this process, building it on first use.
+    """
+    global _pipeline
+    pipeline = _pipeline
+    if pipeline is None:
+        with _lock:
+            if _pipeline is None:
+                _pipeline = RAGPipeline(chatbot_settings())
+            pipeline = _pipeline
+    return pipeline
+
+
+async def aget_pipeline():
+    """
+    Async variant of get_pipeline; the one-off build runs in a worker thread.
+    """
+    if _pipeline is not None:
+        return _pipeline
+    return await sync_to_async(get_pipeline, thread_sensitive=False)()
+
+
+def reset_pipeline():
+    global _pipeline
+    with _lock:
+        _pipeline = None
+
+
+def _reset_after_fork():
+    # Clients created before a preforking server forked must not be shared.
+    global _pipeline, _lock
+    _pipeline = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    if setting == 'CHATBOT':
+        reset_pipeline()
@@ -0,0 +1,83 @@
+"""
+Per-conversation cache of the last messages, used as the model's context.
+
+MessageCreateView used to re-read the last messages after every insert.
+They are kept in the Django cache instead and rewritten by the request that
+adds to them, so a warm conversation is never read back from the database.
+Messages saved anywhere else drop the cached list through post_save. There
+is deliberately no post_delete receiver on Message: it would make every
+conversation delete load its messages row by row, so deletes call
+forget_recent_messages() instead.
+Two requests writing to the same conversation at once may each cache a list
+missing the other's messages; the next write through another path, or the
+TTL, repairs it.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .activity import batch_activity
+from .models import Conversation, Message
+
+RECENT_MESSAGES = 10
+TIMEOUT = 60 * 60
+
+
+def cache_key(conversation_id):
+    return f'chatbot:recent-messages:{conversation_id}'
+
+
+def as_context(is_from_user, content):
+    return {'role': 'user' if is_from_user else 'assistant', 'content': content}
+
+
+def recent_messages(conversation_id):
+    """
+    Return the last RECENT_MESSAGES messages as role/content dicts, oldest first.
+    """
+    messages = cache.get(cache_key(conversation_id))
+    if messages is None:
+        rows = (
+            Message.objects.filter(conversation_id=conversation_id)
+            .order_by('-created_at')
+            .values_list('is_from_user', 'content')[:RECENT_MESSAGES]
+        )
+        messages = [as_context(*row) for row in reversed(rows)]
+        cache.set(cache_key(conversation_id), messages, TIMEOUT)
+    return messages
+
+
+def save_exchange(conversation_id, context, reply, set_title=False):
+    """
+    Store the user message ending `context` and the assistant's `reply` in one
+    transaction, then cache the new tail of the conversation. With
+    `set_title`, the message also titles a still untitled conversation, in
+    the same UPDATE that records the conversation's new activity.
+    """
+    with transaction.atomic(savepoint=False), batch_activity() as activity:
+        message = Message.objects.create(
+            conversation_id=conversation_id, content=context[-1]['content'], is_from_user=True
+        )
+        if set_title:
+            activity.set_title(conversation_id, message.content)
+        reply_message = Message.objects.create(
+            conversation_id=conversation_id, content=reply, is_from_user=False, in_reply_to=message
+        )
+    messages = context + [as_context(False, reply)]
+    cache.set(cache_key(conversation_id), messages[-RECENT_MESSAGES:], TIMEOUT)
+    return message, reply_message
+
+
+def forget_recent_messages(conversation_id):
+    cache.delete(cache_key(conversation_id))
+
+
+@receiver(post_save, sender=Message)
+def _forget_on_message_saved(sender, instance, **kwargs):
+    forget_recent_messages(instance.conversation_id)
+
+
+@receiver(post_delete, sender=Conversation)
+def _forget_on_conversation_deleted(sender, instance, **kwargs):
+    forget_recent_messages(instance.pk)
@@ -0,0 +1,250 @@
+"""
+Full-text search over a user's messages.
+
+Searching with `content__icontains` reads every message. Migrations 0010
+and 0013 instead build an inverted index: on SQLite an FTS5 table over the
+message content, kept in sync with chatbot_message by triggers; on
+PostgreSQL a GIN index on to_tsvector('english', content). Both are filtered
+to the user's conversations by a join. Matches are ranked (BM25 on
+SQLite, ts_rank_cd on PostgreSQL), most relevant first, and paged by keyset
+on (score, id): the cursor holds the last row's score and id. Snippets are
+only made for the rows of the page.
+
+Databases without either index, including SQLite builds without FTS5, fall
+back to a scan, newest first and unranked. `manage.py rebuild_search_index`
+rebuilds the index from the messages if it ever drifts, e.g. after writes
+that bypassed the triggers.
+"""
+import base64
+import binascii
+import datetime
+import json
+import re
+import uuid
+from html import escape
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Conversation, Message
+
+FTS_TABLE = 'chatbot_message_fts'
+MAX_TERMS = 16
+SNIPPET_TOKENS = 12
+# Snippets are marked with control characters, escaped, then given <mark> tags.
+START, STOP = '\x02', '\x03'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def terms(query):
+    """
+    The words of a query, as the index tokenizes them.
+    """
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def encode_cursor(score, pk):
+    return base64.urlsafe_b64encode(json.dumps([score, pk]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        score, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(pk, int) or not (score is None or isinstance(score, (int, float))):
+            raise ValueError
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    return score, pk
+
+
+def highlight(snippet):
+    return escape(snippet).replace(START, '<mark>').replace(STOP, '</mark>')
+
+
+def backend(using='default'):
+    """
+    'fts5', 'tsvector' or 'scan': how the database searches.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return 'tsvector'
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone():
+                return 'fts5'
+    return 'scan'
+
+
+def rebuild_index(using='default'):
+    """
+    Rebuild the index from the messages and compact it. Return the backend.
+    """
+    kind = backend(using)
+    with connections[using].cursor() as cursor:
+        if kind == 'fts5':
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        elif kind == 'tsvector':
+            cursor.execute('REINDEX INDEX message_search_idx')
+    return kind
+
+
+def search(user, query, limit=20, cursor=None, using='default'):
+    """
+    Return the page of the user's messages matching `query` after `cursor`,
+    and the cursor of the next page, or None if this is the last one.
+    Each result is a dict with the message, its conversation, a score
+    (higher is better) and an HTML snippet with the matches in <mark>.
+    """
+    words = terms(query)
+    if not words:
+        return [], None
+    # The last word may still be being typed.
+    prefix = not query[-1:].isspace()
+    after = decode_cursor(cursor) if cursor else None
+    kind = backend(using)
+    if kind == 'scan':
+        rows = _scan(user, words, limit + 1, after, using)
+    else:
+        search_page = _fts5_page if kind == 'fts5' else _tsvector_page
+        rows = search_page(user, words, prefix, limit + 1, after, using)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if kind == 'fts5':
+        _fts5_snippets(rows, words, prefix, using)
+    next_cursor = encode_cursor(rows[-1]['score'], rows[-1]['id']) if more else None
+    return rows, next_cursor
+
+
+def _row(pk, score, conversation_id, title, is_from_user, created_at, snippet=None):
+    # Raw SQLite rows hold the uuid as hex and the datetime as text.
+    if isinstance(created_at, str):
+        created_at = parse_datetime(created_at)
+        if settings.USE_TZ and timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at, datetime.timezone.utc)
+    return {
+        'id': pk, 'score': score, 'conversation_id': str(uuid.UUID(str(conversation_id))), 'conversation_title': title,
+        'is_from_user': bool(is_from_user), 'created_at': created_at,
+        'snippet': highlight(snippet) if snippet is not None else None,
+    }
+
+
+def _fts5_query(words, prefix, completions=None):
+    phrases = [f'"{word}"' for word in words]
+    if completions:
+        alternatives = ' OR '.join(f'"{word}"' for word in sorted(completions))
+        phrases[-1] = f'({alternatives})'
+    elif prefix:
+        phrases[-1] += '*'
+    return f'content : ({" AND ".join(phrases)})'
+
+
+def _fts5_page(user, words, prefix, limit, after, using):
+    sql = f"""
+        SELECT {FTS_TABLE}.rowid, -bm25({FTS_TABLE}) AS score, m.conversation_id, c.title, m.is_from_user,
+               m.created_at
+        FROM {FTS_TABLE}
+        JOIN chatbot_message m ON m.id = {FTS_TABLE}.rowid
+        JOIN chatbot_conversation c ON c.id = m.conversation_id
+        WHERE {FTS_TABLE} MATCH %s AND c.user_id = %s AND c.deleted_at IS NULL
+    """
+    params = [_fts5_query(words, prefix), user.pk]
+    if after:
+        sql += ' AND (score < %s OR (score = %s AND m.id < %s))'
+        params += [after[0], after[0], after[1]]
+    sql += ' ORDER BY score DESC, m.id DESC LIMIT %s'
+    return _fetch(sql, params + [limit], using)
+
+
+def _fts5_snippets(rows, words, prefix, using):
+    if not rows:
+        return
+    ids = [row['id'] for row in rows]
+    snippets = {}
+    if prefix:
+        # FTS5 expands a prefix again for every rowid looked up, reading the
+        # doclists of every word it starts; the words it stands for on this
+        # page are looked up directly instead. The porter stemmer makes the
+        # odd prefix match other words; those rows take the slow path.
+        contents = Message.objects.using(using).filter(pk__in=ids).values_list('content', flat=True)
+        completions = {
+            word for content in contents for word in re.findall(r'\w+', content.lower()) if word.startswith(words[-1])
+        }
+        if completions:
+            snippets = _fts5_snippet_rows(ids, _fts5_query(words, prefix, completions), using)
+    missing = [pk for pk in ids if pk not in snippets]
+    if missing:
+        snippets.update(_fts5_snippet_rows(missing, _fts5_query(words, prefix), using))
+    for row in rows:
+        row['snippet'] = highlight(snippets.get(row['id'], ''))
+
+
+def _fts5_snippet_rows(ids, query, using):
+    sql = f"""
+        SELECT rowid, snippet({FTS_TABLE}, 0, %s, %s, '…', {SNIPPET_TOKENS}) FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH %s AND rowid IN ({', '.join(['%s'] * len(ids))})
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [START, STOP, query, *ids])
+        return dict(cursor.fetchall())
+
+
+def _tsvector_page(user, words, prefix, limit, after, using):
+    query = ' & '.join(f"'{word}'" for word in words) + (':*' if prefix else '')
+    options = f'StartSel={START}, StopSel={STOP}, MaxWords={SNIPPET_TOKENS * 2}, MinWords={SNIPPET_TOKENS}'
+    # ts_headline runs on the outer query, once per row of the page.
+    sql = """
+        SELECT id, score, conversation_id, title, is_from_user, created_at,
+               ts_headline('english', content, to_tsquery('english', %s), %s)
+        FROM (
+            SELECT m.id, ts_rank_cd(to_tsvector('english', m.content), q) AS score, m.conversation_id, c.title,
+                   m.is_from_user, m.created_at, m.content
+            FROM chatbot_message m
+            JOIN chatbot_conversation c ON c.id = m.conversation_id,
+            to_tsquery('english', %s) q
+            WHERE to_tsvector('english', m.content) @@ q AND c.user_id = %s AND c.deleted_at IS NULL
+        ) matches
+    """
+    params = [query, options, query, user.pk]
+    if after:
+        sql += ' WHERE score < %s::real OR (score = %s::real AND id < %s)'
+        params += [after[0], after[0], after[1]]
+    sql += ' ORDER BY score DESC, id DESC LIMIT %s'
+    return _fetch(sql, params + [limit], using)
+
+
+def _fetch(sql, params, using):
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [_row(*row) for row in cursor.fetchall()]
+
+
+def _scan(user, words, limit, after, using):
+    conversations = Conversation.objects.using(using).filter(user=user)
+    messages = Message.objects.using(using).filter(conversation__in=conversations)
+    for word in words:
+        messages = messages.filter(content__icontains=word)
+    if after:
+        messages = messages.filter(pk__lt=after[1])
+    rows = messages.order_by('-pk').values_list(
+        'pk', 'conversation_id', 'conversation__title', 'is_from_user', 'created_at', 'content'
+    )[:limit]
+    results = []
+    for pk, conversation_id, title, is_from_user, created_at, content in rows:
+        results.append(_row(pk, None, conversation_id, title, is_from_user, created_at, _scan_snippet(content, words)))
+    return results
+
+
+def _scan_snippet(content, words):
+    pattern = re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    match = pattern.search(content)
+    start = max(0, match.start() - 60) if match else 0
+    text = content[start:start + 160]
+    text = pattern.sub(lambda m: f'{START}{m.group(0)}{STOP}', text)
+    return ('…' if start else '') + text + ('…' if start + 160 < len(content) else '')
@@ -1,22 +1,97 @@
-from rest_framework import serializers
-from .models import Conversation, Message, UserQuestion, ChatbotResponse
-
-class ConversationSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Conversation
-        fields = '__all__'
-
-class MessageSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Message
-        fields = '__all__'
-
-class UserQuestionSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = UserQuestion
-        fields = '__all__'
-
-class ChatbotResponseSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ChatbotResponse
-        fields = '__all__'
+from rest_framework import serializers
+from .models import Conversation, Message, UserQuestion, ChatbotResponse
+from .search import terms
+
+# Conversation.__str__ shows the username; the browsable API renders one
+# choice per conversation, so the user is joined up front.
+CONVERSATION_CHOICES = Conversation.objects.select_related('user')
+
+class ConversationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = '__all__'
+
+class ConversationListSerializer(serializers.ModelSerializer):
+    """
+    Conversation listing without the stored history summary, with what the
+    sidebar previews of each conversation.
+    """
+    class Meta:
+        model = Conversation
+        fields = (
+            'id', 'title', 'user', 'created_at', 'updated_at', 'favourite', 'archive', 'prompt', 'status',
+            'message_count', 'last_message_at', 'last_message_preview', 'last_activity_at',
+        )
+
+class ConversationBulkSerializer(serializers.Serializer):
+    """
+    Input of ConversationBulkView.
+    """
+    ACTIONS = ('archive', 'unarchive', 'favourite', 'unfavourite', 'delete', 'set_status')
+    MAX_IDS = 1000
+
+    ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=MAX_IDS)
+    action = serializers.ChoiceField(choices=ACTIONS)
+    status = serializers.ChoiceField(choices=Conversation.STATUS_CHOICES, required=False)
+
+    def validate(self, attrs):
+        if attrs['action'] == 'set_status' and 'status' not in attrs:
+            raise serializers.ValidationError({'status': 'This field is required to set the status.'})
+        return attrs
+
+class MessageSearchSerializer(serializers.Serializer):
+    """
+    Query parameters of MessageSearchView. The query is not trimmed: a
+    trailing space ends the last word, otherwise it matches as a prefix.
+    """
+    MAX_PAGE_SIZE = 100
+
+    q = serializers.CharField(trim_whitespace=False, max_length=500)
+    page_size = serializers.IntegerField(min_value=1, max_value=MAX_PAGE_SIZE, required=False)
+    cursor = serializers.CharField(required=False)
+
+    def validate_q(self, value):
+        if not terms(value):
+            raise serializers.ValidationError('Enter at least one word to search for.')
+        return value
+
+class MessageSerializer(serializers.ModelSerializer):
+    conversation = serializers.PrimaryKeyRelatedField(queryset=CONVERSATION_CHOICES)
+    in_reply_to = serializers.PrimaryKeyRelatedField(
+        queryset=Message.objects.select_related('conversation__user'), allow_null=True, required=False
+    )
+
+    class Meta:
+        model = Message
+        fields = '__all__'
+
+class MessageContentSerializer(serializers.ModelSerializer):
+    """
+    Input of MessageCreateView; the conversation comes from the URL.
+    """
+    class Meta:
+        model = Message
+        fields = ('content',)
+
+class UserQuestionSerializer(serializers.ModelSerializer):
+    conversation = serializers.PrimaryKeyRelatedField(queryset=CONVERSATION_CHOICES)
+
+    class Meta:
+        model = UserQuestion
+        fields = '__all__'
+
+class ChatbotResponseSerializer(serializers.ModelSerializer):
+    conversation = serializers.PrimaryKeyRelatedField(queryset=CONVERSATION_CHOICES)
+    question = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = ChatbotResponse
+        fields = '__all__'
+
+class ChatbotResponseListSerializer(serializers.ModelSerializer):
+    """
+    Response listing without the retrieved sources.
+    """
+    class Meta:
+        model = ChatbotResponse
+        fields = ('id', 'conversation', 'response_text', 'timestamp')
@@ -0,0 +1,165 @@
+"""
+Request coalescing ("single flight") for identical in-flight generations.
+
+When the same question with the same history is asked several times at
+once, e.g. right after an announcement, only the first caller (the leader)
+runs the chain. The others wait for its result instead of each paying for
+retrieval and a completion. Callers are still separate requests, so every
+view records its own UserQuestion and ChatbotResponse.
+
+Within a process the followers wait on the leader's future. With
+`shared=True` the leader also takes a lock in the Django cache and publishes
+its result there, so that followers in other processes wait for it too.
+That needs a cache shared by the processes (Redis, Memcached, database);
+with the default per-process LocMemCache it has no effect beyond the
+process. A follower that outwaits `wait` seconds runs the call itself.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from django.core.cache import cache
+
+from .cache import normalize_question
+
+
+def flight_key(question, context=''):
+    return hashlib.sha256(f'{normalize_question(question)}\0{context}'.encode()).hexdigest()
+
+
+class SingleFlight:
+    """
+    Share one call of `fn` among concurrent callers asking for the same key.
+    """
+
+    def __init__(self, shared=False, lock_timeout=60, wait=60, result_ttl=10, poll_interval=0.05):
+        self.shared = shared
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.stats = {'leaders': 0, 'followers': 0, 'remote_followers': 0}
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Return fn(), or the result of a call of it already in flight for `key`.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            return call.result()
+        try:
+            result = self._lead_shared(key, fn) if self.shared else fn()
+        except BaseException as exc:
+            self._finish(key, call, exception=exc)
+            raise
+        self._finish(key, call, result=result)
+        return result
+
+    async def ado(self, key, afn):
+        """
+        Async variant of do(); `afn` is a coroutine function.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            # Shielded: a cancelled follower must not cancel the leader's future.
+            return await asyncio.shield(asyncio.wrap_future(call))
+        try:
+            result = await self._alead_shared(key, afn) if self.shared else await afn()
+        except BaseException as exc:
+            self._finish(key, call, exception=exc)
+            raise
+        self._finish(key, call, result=result)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            return {**self.stats, 'in_flight': len(self._calls)}
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats['followers'] += 1
+                return call, False
+            call = self._calls[key] = Future()
+            self.stats['leaders'] += 1
+            return call, True
+
+    def _finish(self, key, call, result=None, exception=None):
+        with self._lock:
+            del self._calls[key]
+        if exception is not None:
+            call.set_exception(exception)
+        else:
+            call.set_result(result)
+
+    # Across processes
+
+    def _keys(self, key):
+        return f'chatbot:singleflight:lock:{key}', f'chatbot:singleflight:result:{key}'
+
+    def _lead_shared(self, key, fn):
+        lock_key, result_key = self._keys(key)
+        deadline = time.monotonic() + self.wait
+        while (state := self._poll_remote(lock_key, result_key, deadline))[0] == 'wait':
+            time.sleep(self.poll_interval)
+        outcome, result = state
+        if outcome == 'result':
+            return result
+        if outcome == 'timeout':
+            return fn()
+        try:
+            result = fn()
+        except BaseException:
+            cache.delete(lock_key)
+            raise
+        return self._publish(lock_key, result_key, result)
+
+    async def _alead_shared(self, key, afn):
+        lock_key, result_key = self._keys(key)
+        deadline = time.monotonic() + self.wait
+        while (state := self._poll_remote(lock_key, result_key, deadline))[0] == 'wait':
+            await asyncio.sleep(self.poll_interval)
+        outcome, result = state
+        if outcome == 'result':
+            return result
+        if outcome == 'timeout':
+            return await afn()
+        try:
+            result = await afn()
+        except BaseException:
+            cache.delete(lock_key)
+            raise
+        return self._publish(lock_key, result_key, result)
+
+    def _poll_remote(self, lock_key, result_key, deadline):
+        """
+        Return ('result', r) once a holder published r, ('locked', None) once
+        this process holds the lock, ('timeout', None) past the deadline, and
+        ('wait', None) otherwise.
+        """
+        # The result is looked at first: the holder publishes it before
+        # releasing the lock, and a result up to result_ttl old is as good.
+        result = cache.get(result_key)
+        if result is not None:
+            self._count_remote()
+            return 'result', result
+        if cache.add(lock_key, uuid.uuid4().hex, self.lock_timeout):
+            return 'locked', None
+        if time.monotonic() > deadline:
+            return 'timeout', None
+        return 'wait', None
+
+    def _publish(self, lock_key, result_key, result):
+        cache.set(result_key, result, self.result_ttl)
+        cache.delete(lock_key)
+        return result
+
+    def _count_remote(self):
+        with self._lock:
+            self.stats['remote_followers'] += 1
@@ -1,3 +1,1771 @@
-from django.test import TestCase
-
-# Create your tests here.
+import asyncio
+import gzip
+import json
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.db.utils import ConnectionHandler
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import Throttled
+from rest_framework.test import APIClient
+
+from accounts.tokens import create_jwt_pair_for_user
+from cwypd.databases import database_settings
+from . import fakes
+from .activity import inconsistent_activity
+from .audit import WriteBehindBuffer, get_audit_buffer
+from .cache import SemanticCache, invalidate_answer_caches
+from .embeddings import CachedEmbeddings, EmbeddingStore
+from .export import InvalidExport, import_records
+from .history import build_history, recent_turns
+from .instrumentation import InstrumentationMiddleware, SlowRequestProfiler, metrics
+from .jobs import HANDLERS, claim, enqueue, requeue_stale, run_pending
+from .purge import purge_conversation, soft_delete
+from .recent_messages import recent_messages
+from .singleflight import SingleFlight
+from .throttling import AdmissionController, get_admission
+from .views import MessageCreateView
+from .ingest import iter_chunks
+from .vectorstores import LocalVectorStore
+from .models import ChatbotResponse, Conversation, IngestedChunk, Job, Message, UserQuestion
+from .rag import get_pipeline, reset_pipeline
+
+User = get_user_model()
+
+FAKE_CHATBOT = {
+    'EMBEDDINGS_BACKEND': 'chatbot.tests.counting_embeddings',
+    'VECTORSTORE_BACKEND': 'chatbot.fakes.fake_vectorstore',
+    'LLM_BACKEND': 'chatbot.tests.counting_chat_model',
+    'FAKE_RESPONSES': ['Holiday allowance is 25 days.'],
+    'FAKE_DOCUMENTS': ['Employees get 25 days of holiday.', 'Expenses are paid monthly.'],
+    'EMBEDDING_CACHE_PATH': None,
+    # One process, so the in-memory cache sees every invalidation.
+    'ANSWER_CACHE_ENABLED': True,
+}
+
+backend_calls = {'embeddings': 0, 'llm': 0}
+
+
+def counting_embeddings(config):
+    backend_calls['embeddings'] += 1
+    return fakes.fake_embeddings(config)
+
+
+def counting_chat_model(config):
+    backend_calls['llm'] += 1
+    return fakes.fake_chat_model(config)
+
+
+@override_settings(CHATBOT=FAKE_CHATBOT)
+class ChatbotTestCase(TestCase):
+    """
+    Base test case running the chatbot against the fake backends.
+    """
+
+    def setUp(self):
+        reset_pipeline()
+        # Rate-limit buckets and cached messages would outlive the rolled back rows.
+        cache.clear()
+        backend_calls.update(embeddings=0, llm=0)
+        self.user = User.objects.create_user(email='jane@example.com', password='pass12345', username='jane')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.async_client = AsyncClient()
+        self.auth_header = 'Bearer ' + create_jwt_pair_for_user(self.user)['access']
+
+    def tearDown(self):
+        reset_pipeline()
+
+
+class RAGPipelineTests(ChatbotTestCase):
+
+    def test_backends_built_once_across_requests(self):
+        for _ in range(3):
+            response = self.client.post('/ask/', {'query': 'How much holiday do I get?'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['result']['answer'], 'Holiday allowance is 25 days.')
+
+        self.assertEqual(backend_calls, {'embeddings': 1, 'llm': 1})
+        self.assertEqual(UserQuestion.objects.count(), 3)
+        self.assertEqual(ChatbotResponse.objects.count(), 3)
+
+    def test_concurrent_first_use_builds_once(self):
+        pipelines = []
+        threads = [threading.Thread(target=lambda: pipelines.append(get_pipeline())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(p) for p in pipelines}), 1)
+        self.assertEqual(backend_calls['embeddings'], 1)
+
+    def test_each_chain_gets_its_own_memory(self):
+        pipeline = get_pipeline()
+        first, second = pipeline.chain(), pipeline.chain()
+
+        self.assertIsNot(first.memory, second.memory)
+        self.assertIs(first.retriever.vectorstore, second.retriever.vectorstore)
+        self.assertIs(first.combine_docs_chain.llm_chain.llm, second.combine_docs_chain.llm_chain.llm)
+
+
+class StreamingAnswerTests(ChatbotTestCase):
+
+    async def read_events(self, response):
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    async def test_streams_tokens_then_stores_answer_once(self):
+        response = await self.async_client.post(
+            '/ask/stream/', {'query': 'How much holiday do I get?'},
+            content_type='application/json',
+            headers={'Accept': 'text/event-stream', 'Authorization': self.auth_header},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = await self.read_events(response)
+        tokens = [data['token'] for name, data in events if name == 'token']
+        self.assertGreater(len(tokens), 1)
+        self.assertEqual(''.join(tokens), 'Holiday allowance is 25 days.')
+
+        name, done = events[-1]
+        self.assertEqual(name, 'done')
+        self.assertEqual(done['answer'], 'Holiday allowance is 25 days.')
+        self.assertEqual(len(done['sources']), 2)
+
+        stored = await ChatbotResponse.objects.aget()
+        self.assertEqual(stored.response_text, done['answer'])
+        self.assertEqual(stored.sources, done['sources'])
+
+    def test_missing_query_is_rejected(self):
+        response = self.client.post('/ask/stream/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewTests(ChatbotTestCase):
+
+    async def apost(self, path, data, **headers):
+        return await self.async_client.post(
+            path, data, content_type='application/json',
+            headers={'Authorization': self.auth_header, **headers},
+        )
+
+    async def test_async_ask(self):
+        response = await self.apost('/ask/async/', {'query': 'How much holiday do I get?'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['result']['answer'], 'Holiday allowance is 25 days.')
+        self.assertEqual(await UserQuestion.objects.acount(), 1)
+        self.assertEqual(await ChatbotResponse.objects.acount(), 1)
+
+    async def test_async_ask_requires_token(self):
+        response = await self.async_client.post('/ask/async/', {'query': 'hi'}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_async_create_message_stores_reply(self):
+        conversation = await Conversation.objects.acreate(user=self.user)
+        response = await self.apost(f'/conversation/{conversation.id}/create-message/async/', {'content': 'Hello'})
+        self.assertEqual(response.status_code, 200)
+
+        question = await Message.objects.aget(is_from_user=True)
+        reply = await Message.objects.aget(is_from_user=False)
+        self.assertEqual(question.content, 'Hello')
+        self.assertEqual(reply.in_reply_to_id, question.id)
+        self.assertEqual(reply.content, json.loads(response.content)['response'])
+
+    async def test_async_create_message_in_foreign_conversation(self):
+        other = await sync_to_async(User.objects.create_user)(email='joe@example.com', password='pass12345', username='joe')
+        conversation = await Conversation.objects.acreate(user=other)
+        response = await self.apost(f'/conversation/{conversation.id}/create-message/async/', {'content': 'Hello'})
+        self.assertEqual(response.status_code, 404)
+
+
+class SemanticCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = SemanticCache(similarity=0.9, ttl=60, max_entries=2)
+
+    def test_exact_tier_normalizes_question(self):
+        self.cache.put('How much holiday?', [1.0, 0.0], '25 days')
+        hit = self.cache.get_exact('  how much   HOLIDAY? ')
+        self.assertEqual(hit['answer'], '25 days')
+        self.assertEqual(hit['cached'], 'exact')
+
+    def test_semantic_tier_uses_threshold(self):
+        self.cache.put('How much holiday?', [1.0, 0.0], '25 days')
+        self.assertEqual(self.cache.get_similar([0.99, 0.1])['cached'], 'semantic')
+        self.assertIsNone(self.cache.get_similar([0.5, 0.5]))
+        self.assertEqual(self.cache.snapshot()['misses'], 1)
+
+    def test_expired_entries_are_dropped(self):
+        self.cache.put('q', [1.0, 0.0], 'a')
+        with mock.patch('chatbot.cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(self.cache.get_exact('q'))
+        self.assertEqual(self.cache.snapshot()['entries'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.put('first', [1.0, 0.0], 'a')
+        self.cache.put('second', [0.0, 1.0], 'b')
+        self.cache.get_exact('first')
+        self.cache.put('third', [0.7, 0.7], 'c')
+
+        self.assertIsNotNone(self.cache.get_exact('first'))
+        self.assertIsNone(self.cache.get_exact('second'))
+        self.assertEqual(self.cache.snapshot()['evictions'], 1)
+
+    def test_invalidation_clears_entries(self):
+        self.cache.put('q', [1.0, 0.0], 'a')
+        invalidate_answer_caches()
+        self.assertIsNone(self.cache.get_exact('q'))
+        self.assertIsNone(self.cache.get_similar([1.0, 0.0]))
+
+
+class AnswerCacheViewTests(ChatbotTestCase):
+
+    def test_repeated_question_skips_llm(self):
+        for query in ['How much holiday do I get?', 'how much holiday do i get?']:
+            conversation = Conversation.objects.create(user=self.user)
+            response = self.client.post('/ask/', {'query': query, 'conversation_id': conversation.id}, format='json')
+            self.assertEqual(response.data['result']['answer'], 'Holiday allowance is 25 days.')
+
+        self.assertEqual(get_pipeline().llm.i, 1)
+        self.assertEqual(response.data['result']['cached'], 'exact')
+
+    def test_follow_up_questions_bypass_cache(self):
+        conversation = Conversation.objects.create(user=self.user)
+        question = UserQuestion.objects.create(conversation=conversation, user=self.user, question_text='Holiday?')
+        ChatbotResponse.objects.create(conversation=conversation, question=question,
+                                       response_text='Holiday allowance is 25 days.')
+        self.client.post('/ask/', {'query': 'And sick leave?', 'conversation_id': conversation.id}, format='json')
+        self.assertEqual(get_pipeline().answer_cache.snapshot()['entries'], 0)
+
+    def test_cache_hits_keep_their_sources(self):
+        pipeline = get_pipeline()
+        answered = pipeline.ask('How much holiday do I get?')
+        cached = pipeline.ask('How much holiday do I get?')
+        self.assertEqual(cached['cached'], 'exact')
+        self.assertTrue(answered['source_documents'])
+        self.assertEqual(cached['source_documents'], answered['source_documents'])
+
+    def test_cache_needs_a_shared_cache_backend_by_default(self):
+        with self.settings(CHATBOT={**FAKE_CHATBOT, 'ANSWER_CACHE_ENABLED': None}):
+            reset_pipeline()
+            self.assertIsNone(get_pipeline().answer_cache)
+            location = tempfile.mkdtemp()
+            with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+            }}):
+                reset_pipeline()
+                self.assertIsNotNone(get_pipeline().answer_cache)
+
+    def test_stats_require_staff(self):
+        self.assertEqual(self.client.get('/ask/cache-stats/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/ask/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['enabled'])
+
+
+class ServerHistoryTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def add_turns(self, count, size=40):
+        first = ChatbotResponse.objects.filter(conversation=self.conversation).count()
+        for n in range(first, first + count):
+            question = UserQuestion.objects.create(
+                conversation=self.conversation, user=self.user, question_text=f'question {n} ' + 'q' * size
+            )
+            ChatbotResponse.objects.create(
+                conversation=self.conversation, question=question, response_text=f'answer {n} ' + 'a' * size
+            )
+
+    def test_history_is_rebuilt_from_stored_turns(self):
+        UserQuestion.objects.create(conversation=self.conversation, user=self.user, question_text='unanswered')
+        self.add_turns(2)
+
+        turns = recent_turns(self.conversation, 10)
+        self.assertEqual([q.split()[:2] for q, a, _ in turns], [['question', '0'], ['question', '1']])
+        self.assertTrue(turns[1][1].startswith('answer 1'))
+
+    def test_history_is_cut_to_token_budget(self):
+        self.add_turns(10)
+        config = {**get_pipeline().config, 'HISTORY_TOKEN_BUDGET': 60}
+
+        chat_history, summary = build_history(self.conversation, get_pipeline(), config)
+
+        # Each turn is ~26 estimated tokens, so only the last two fit.
+        self.assertEqual([q.split()[1] for q, a in chat_history], ['8', '9'])
+        self.assertEqual(summary, '')
+
+    def test_dropped_turns_are_summarized_once(self):
+        self.add_turns(4)
+        pipeline = get_pipeline()
+        config = {**pipeline.config, 'HISTORY_TOKEN_BUDGET': 60, 'HISTORY_SUMMARY_ENABLED': True}
+
+        with mock.patch.object(pipeline, 'summarize', return_value='They asked about holidays.') as summarize:
+            chat_history, summary = build_history(self.conversation, pipeline, config)
+            build_history(self.conversation, pipeline, config)
+
+        summarize.assert_called_once()
+        self.assertEqual(len(summarize.call_args[0][1]), 2)
+        self.assertEqual(summary, 'They asked about holidays.')
+        self.assertEqual([q.split()[1] for q, a in chat_history], ['2', '3'])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.history_summary, summary)
+        self.assertIn('System: They asked about holidays.', pipeline.new_memory(chat_history, summary).buffer)
+
+    def test_turns_past_max_turns_are_summarized(self):
+        self.add_turns(5)
+        pipeline = get_pipeline()
+        config = {**pipeline.config, 'HISTORY_MAX_TURNS': 2, 'HISTORY_SUMMARY_ENABLED': True}
+
+        def folded():
+            return [[q.split()[1] for q, a in call[0][1]] for call in summarize.call_args_list]
+
+        with mock.patch.object(pipeline, 'summarize', side_effect=lambda summary, turns: summary + 'x') as summarize:
+            chat_history, summary = build_history(self.conversation, pipeline, config)
+            # One call of at most HISTORY_MAX_TURNS turns per request, oldest first.
+            self.assertEqual(folded(), [['0', '1']])
+            self.assertEqual([q.split()[1] for q, a in chat_history], ['3', '4'])
+
+            self.add_turns(1)
+            chat_history, summary = build_history(self.conversation, pipeline, config)
+            self.assertEqual(folded(), [['0', '1'], ['2', '3']])
+            self.assertEqual([q.split()[1] for q, a in chat_history], ['4', '5'])
+            build_history(self.conversation, pipeline, config)
+        self.assertEqual(summarize.call_count, 2)
+        self.assertEqual(summary, 'xx')
+
+    def test_concurrent_asks_pair_through_the_question(self):
+        first, second = (
+            UserQuestion.objects.create(conversation=self.conversation, user=self.user, question_text=text)
+            for text in ('Holiday?', 'Sick leave?')
+        )
+        # The second question is answered first.
+        ChatbotResponse.objects.create(conversation=self.conversation, question=second, response_text='10 days.')
+        ChatbotResponse.objects.create(conversation=self.conversation, question=first, response_text='25 days.')
+        self.assertEqual(
+            [(q, a) for q, a, _ in recent_turns(self.conversation, 10)],
+            [('Sick leave?', '10 days.'), ('Holiday?', '25 days.')],
+        )
+
+    def test_response_is_a_constant_size_delta(self):
+        sizes = []
+        for _ in range(3):
+            response = self.client.post(
+                '/ask/', {'query': 'How much holiday do I get?', 'conversation_id': self.conversation.id},
+                format='json',
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('chat_history', response.data)
+            self.assertEqual(response.data['conversation_id'], self.conversation.id)
+            sizes.append(len(response.content))
+
+        self.assertEqual(len(set(sizes)), 1)
+        self.assertEqual(ChatbotResponse.objects.filter(conversation=self.conversation).count(), 3)
+        self.assertEqual(ChatbotResponse.objects.first().response_text, 'Holiday allowance is 25 days.')
+
+    def test_other_users_conversation_is_not_found(self):
+        other = User.objects.create_user(email='john@example.com', password='pass12345', username='john')
+        conversation = Conversation.objects.create(user=other)
+        response = self.client.post('/ask/', {'query': 'Hi', 'conversation_id': conversation.id}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class PaginationTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+        for n in range(25):
+            Message.objects.create(conversation=self.conversation, content=f'message {n}')
+
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['content'] if 'content' in item else item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_offset_pagination_is_the_default(self):
+        response = self.client.get(f'/conversation/{self.conversation.id}/list-messages/')
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_keyset_pagination_walks_every_message_once(self):
+        seen = self.walk(f'/conversation/{self.conversation.id}/list-messages/?pagination=cursor')
+        self.assertEqual(seen, [f'message {n}' for n in reversed(range(25))])
+
+    def test_conversation_list_filters_and_keyset(self):
+        for n in range(4):
+            Conversation.objects.create(user=self.user, archive=n % 2 == 0)
+
+        self.assertEqual(len(self.client.get('/conversations/').data), 5)
+        self.assertEqual(len(self.client.get('/conversations/?archive=true').data), 2)
+        self.assertEqual(len(self.client.get('/conversations/?limit=2').data['results']), 2)
+        seen = self.walk('/conversations/?pagination=cursor&page_size=2')
+        self.assertEqual(seen, [str(c.id) for c in Conversation.objects.order_by('-last_activity_at')])
+        seen = self.walk('/conversations/?pagination=cursor&page_size=2&ordering=created')
+        self.assertEqual(seen, [str(c.id) for c in Conversation.objects.order_by('created_at')])
+
+
+    def test_conversation_keyset_breaks_ties_on_pk(self):
+        for _ in range(4):
+            Conversation.objects.create(user=self.user)
+        # As after migration 0008, which gave existing conversations the same activity time.
+        Conversation.objects.update(last_activity_at=timezone.now())
+        expected = [str(pk) for pk in Conversation.objects.order_by('-pk').values_list('pk', flat=True)]
+
+        self.assertEqual(self.walk('/conversations/?pagination=cursor&page_size=2'), expected)
+        last = self.client.get('/conversations/?pagination=cursor&page_size=2')
+        while last.data['next']:
+            last = self.client.get(last.data['next'])
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual([item['id'] for item in previous.data['results']], expected[2:4])
+        self.assertEqual(self.client.get('/conversations/', {'cursor': 'cD14'}).status_code, 404)
+
+class QueryCountTests(ChatbotTestCase):
+    """
+    List endpoints must run the same number of queries however many rows they return.
+    """
+
+    def add_rows(self, count):
+        for _ in range(count):
+            conversation = Conversation.objects.create(user=self.user)
+            self.conversations.append(conversation)
+            message = Message.objects.create(conversation=self.conversations[0], content='Hi')
+            Message.objects.create(conversation=self.conversations[0], content='Hello', in_reply_to=message)
+            UserQuestion.objects.create(conversation=conversation, user=self.user, question_text='Holiday?')
+            ChatbotResponse.objects.create(conversation=conversation, response_text='25 days.', sources=[{}])
+
+    def count_queries(self, url, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url, **extra):
+        self.conversations = []
+        self.add_rows(2)
+        few = self.count_queries(url.format(conversation=self.conversations[0].id), **extra)
+        self.add_rows(18)
+        many = self.count_queries(url.format(conversation=self.conversations[0].id), **extra)
+        self.assertEqual(few, many, url)
+
+    def test_conversation_list(self):
+        self.assertConstantQueries('/conversations/')
+        self.assertConstantQueries('/conversations/?pagination=cursor&page_size=50')
+
+    def test_message_list(self):
+        self.assertConstantQueries('/conversation/{conversation}/list-messages/?pagination=cursor&page_size=50')
+
+    def test_question_and_response_lists(self):
+        self.assertConstantQueries('/user-questions/')
+        self.assertConstantQueries('/chatbot-responses/')
+
+    def test_browsable_api_forms(self):
+        # The HTML forms list every conversation and message as a choice, by __str__.
+        for url in ['/user-questions/', '/chatbot-responses/', '/messages/']:
+            self.assertConstantQueries(url, HTTP_ACCEPT='text/html')
+
+    def test_response_list_leaves_out_sources(self):
+        self.conversations = []
+        self.add_rows(1)
+        self.assertNotIn('sources', self.client.get('/chatbot-responses/').data[0])
+
+
+class MessageCreateTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.url = f'/conversation/{self.conversation.id}/create-message/'
+
+    def test_query_budget(self):
+        with self.assertNumQueries(MessageCreateView.MAX_QUERIES):
+            response = self.client.post(self.url, {'content': 'Hello'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Warm: no context read. The title is set in the activity UPDATE.
+        with self.assertNumQueries(MessageCreateView.MAX_QUERIES - 1):
+            self.client.post(self.url, {'content': 'Again'}, format='json')
+
+    def test_stores_message_and_reply(self):
+        self.client.post(self.url, {'content': 'Hello'}, format='json')
+
+        question = Message.objects.get(is_from_user=True)
+        reply = Message.objects.get(is_from_user=False)
+        self.assertEqual(question.content, 'Hello')
+        self.assertEqual(reply.in_reply_to_id, question.id)
+
+    def test_cached_context_matches_database(self):
+        for n in range(7):
+            self.client.post(self.url, {'content': f'message {n}'}, format='json')
+        Message.objects.create(conversation=self.conversation, content='added elsewhere')
+
+        self.client.post(self.url, {'content': 'last'}, format='json')
+
+        stored = Message.objects.filter(conversation=self.conversation).order_by('-created_at')[:10]
+        cached = recent_messages(self.conversation.id)
+        self.assertEqual([m['content'] for m in cached], [m.content for m in reversed(stored)])
+        self.assertIn({'role': 'user', 'content': 'added elsewhere'}, cached)
+
+    def test_reply_failure_rolls_back_message(self):
+        create = Message.objects.create
+
+        def fail_on_reply(**kwargs):
+            if not kwargs['is_from_user']:
+                raise RuntimeError('reply not stored')
+            return create(**kwargs)
+
+        # save_exchange joins the enclosing transaction, as it would ATOMIC_REQUESTS.
+        with mock.patch.object(Message.objects, 'create', side_effect=fail_on_reply):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.client.post(self.url, {'content': 'Hello'}, format='json')
+        self.assertFalse(Message.objects.exists())
+
+
+class ConversationActivityTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def activity(self):
+        self.conversation.refresh_from_db()
+        return self.conversation.message_count, self.conversation.last_message_preview
+
+    def test_messages_update_the_conversation(self):
+        self.client.post(f'/conversation/{self.conversation.id}/create-message/', {'content': 'Hello'}, format='json')
+        self.assertEqual(self.activity(), (2, 'This is a mock response from GPT-3.'))
+        self.assertEqual(self.conversation.title, 'Hello')
+        self.assertEqual(self.conversation.last_activity_at, self.conversation.last_message_at)
+
+        message = Message.objects.create(conversation=self.conversation, content='x' * 300)
+        self.assertEqual(self.activity(), (3, 'x' * 100))
+        self.assertEqual(self.client.delete(f'/messages/{message.id}/').status_code, 204)
+        self.assertEqual(self.activity(), (2, 'This is a mock response from GPT-3.'))
+        self.assertEqual(list(inconsistent_activity()), [])
+
+    def test_list_is_sorted_by_activity_without_extra_queries(self):
+        older = Conversation.objects.create(user=self.user)
+        Message.objects.create(conversation=older, content='Recent')
+        response = self.client.get('/conversations/')
+        self.assertEqual([c['id'] for c in response.data], [str(older.id), str(self.conversation.id)])
+        self.assertEqual(
+            (response.data[0]['message_count'], response.data[0]['last_message_preview']), (1, 'Recent')
+        )
+        self.assertEqual(response.data[1]['message_count'], 0)
+
+    def test_counts_are_read_only(self):
+        response = self.client.post(
+            '/conversations/', {'user': self.user.id, 'message_count': 99, 'last_message_preview': 'x'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Conversation.objects.get(id=response.data['id']).message_count, 0)
+
+    def test_check_and_backfill_commands(self):
+        for n in range(3):
+            Message.objects.create(conversation=self.conversation, content=f'message {n}')
+        other = Conversation.objects.create(user=self.user)
+        Message.objects.create(conversation=other, content='Hi')
+        # Bypasses the ORM signals, as rows from before the counters would.
+        Message.objects.filter(conversation=self.conversation).delete()
+        Conversation.objects.filter(pk=other.pk).update(message_count=0, last_message_preview='')
+
+        with self.assertRaises(CommandError):
+            call_command('check_activity', batch_size=1, stdout=StringIO())
+        call_command('check_activity', '--repair', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(inconsistent_activity()), [])
+        self.assertEqual(self.activity(), (0, ''))
+        self.assertEqual(self.conversation.last_activity_at, self.conversation.created_at)
+
+        Conversation.objects.update(message_count=7)
+        out = StringIO()
+        call_command('backfill_activity', batch_size=1, stdout=out)
+        self.assertIn('Updated 2 conversations', out.getvalue())
+        self.assertEqual(Conversation.objects.get(pk=other.pk).message_count, 1)
+
+
+class ConversationBulkTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversations = [Conversation.objects.create(user=self.user) for _ in range(3)]
+        self.ids = [str(c.id) for c in self.conversations]
+        other = User.objects.create_user(email='joe@example.com', password='pass12345', username='joe')
+        self.foreign = Conversation.objects.create(user=other)
+
+    def bulk(self, ids, action, **extra):
+        return self.client.post('/conversations/bulk/', {'ids': ids, 'action': action, **extra}, format='json')
+
+    def test_archive_in_one_update_scoped_to_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.bulk(self.ids + [str(self.foreign.id)], 'archive')
+        self.assertEqual(response.data, {'action': 'archive', 'count': 3, 'missing': 1})
+        statements = [q['sql'].split()[0] for q in queries]
+        self.assertEqual([s for s in statements if s not in ('SAVEPOINT', 'RELEASE')], ['UPDATE'])
+        self.assertEqual(Conversation.objects.filter(archive=True).count(), 3)
+        self.assertFalse(Conversation.objects.get(pk=self.foreign.pk).archive)
+
+        self.bulk(self.ids[:1], 'unarchive')
+        self.assertEqual(Conversation.objects.filter(archive=True).count(), 2)
+
+    def test_set_status_needs_a_valid_status(self):
+        self.assertEqual(self.bulk(self.ids, 'set_status').status_code, 400)
+        self.assertEqual(self.bulk(self.ids, 'set_status', status='closed').status_code, 400)
+        self.assertEqual(self.bulk(self.ids, 'set_status', status='ended').data['count'], 3)
+        self.assertEqual(Conversation.objects.filter(status='ended').count(), 3)
+
+    def test_delete_removes_conversations_and_their_rows(self):
+        Message.objects.create(conversation=self.conversations[0], content='Hi')
+        UserQuestion.objects.create(conversation=self.conversations[1], user=self.user, question_text='Holiday?')
+        response = self.bulk(self.ids[:2] + [str(self.foreign.id)], 'delete')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(set(Conversation.objects.values_list('id', flat=True)), {self.conversations[2].id, self.foreign.id})
+        run_pending()
+        self.assertFalse(Message.objects.exists() or UserQuestion.objects.exists())
+        self.assertEqual(Conversation.all_objects.count(), 2)
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.bulk([], 'archive').status_code, 400)
+        self.assertEqual(self.bulk(['not-a-uuid'], 'archive').status_code, 400)
+        self.assertEqual(self.bulk(self.ids, 'explode').status_code, 400)
+
+    def test_toggle_writes_only_the_flag(self):
+        conversation = self.conversations[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/conversations/{conversation.id}/archive/')
+        self.assertEqual(response.data['message'], 'add to archive')
+        update = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')][0]
+        self.assertNotIn('"title"', update)
+        self.assertIn('"archive"', update)
+        self.assertEqual(self.client.patch(f'/conversations/{conversation.id}/favourite/').data['message'],
+                         'add to favourite')
+        self.assertEqual(self.client.patch(f'/conversations/{self.foreign.id}/archive/').status_code, 404)
+
+    def test_single_delete_is_scoped_to_user(self):
+        self.assertEqual(self.client.delete(f'/conversations/{self.foreign.id}/delete/').status_code, 404)
+        self.assertEqual(self.client.delete(f'/conversations/{self.ids[0]}/delete/').status_code, 200)
+        self.assertFalse(Conversation.objects.filter(id=self.ids[0]).exists())
+
+
+@override_settings(CHATBOT={**FAKE_CHATBOT, 'PURGE_BATCH_SIZE': 2})
+class ConversationPurgeTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+        for n in range(5):
+            question = Message.objects.create(conversation=self.conversation, content=f'question {n}')
+            Message.objects.create(conversation=self.conversation, content=f'reply {n}', in_reply_to=question)
+            UserQuestion.objects.create(conversation=self.conversation, user=self.user, question_text=f'question {n}')
+            ChatbotResponse.objects.create(conversation=self.conversation, response_text=f'answer {n}')
+        self.other = Conversation.objects.create(user=self.user)
+        first = Message.objects.filter(conversation=self.conversation).first()
+        self.crosslink = Message.objects.create(conversation=self.other, content='see above', in_reply_to=first)
+
+    def test_delete_hides_at_once_and_purges_later(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(f'/conversations/{self.conversation.id}/delete/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(q['sql'].startswith('DELETE') for q in queries))
+        self.assertEqual(self.client.get(f'/conversations/{self.conversation.id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/conversation/{self.conversation.id}/list-messages/').status_code, 404)
+        self.assertEqual([c['id'] for c in self.client.get('/conversations/').data], [str(self.other.id)])
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 10)
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(Job.objects.get(kind='purge_conversations').result, {'purged': 1})
+        self.assertFalse(Conversation.all_objects.filter(pk=self.conversation.pk).exists())
+        for model in (Message, UserQuestion, ChatbotResponse):
+            self.assertFalse(model.objects.filter(conversation_id=self.conversation.pk).exists())
+        self.crosslink.refresh_from_db()
+        self.assertIsNone(self.crosslink.in_reply_to_id)
+
+    def test_detail_delete_and_command(self):
+        self.assertEqual(self.client.delete(f'/conversations/{self.conversation.id}/').status_code, 204)
+        self.assertIsNotNone(Conversation.all_objects.get(pk=self.conversation.pk).deleted_at)
+        out = StringIO()
+        call_command('purge_conversations', stdout=out)
+        self.assertIn('Purged 1 conversations', out.getvalue())
+        self.assertEqual(list(Conversation.all_objects.values_list('pk', flat=True)), [self.other.pk])
+        # The queued job finds nothing left to do.
+        run_pending()
+        self.assertEqual(Job.objects.get(kind='purge_conversations').result, {'purged': 0})
+
+
+class MessageSearchTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user, title='Leave')
+        self.holiday = Message.objects.create(conversation=self.conversation, content='How is holiday pay calculated?')
+        self.often = Message.objects.create(
+            conversation=self.conversation, content='Holiday, holiday, holiday: I ask about holidays a lot.'
+        )
+        Message.objects.create(conversation=self.conversation, content='Expenses are paid monthly.')
+        other = User.objects.create_user(username='john', email='john@example.com', password='pass')
+        Message.objects.create(conversation=Conversation.objects.create(user=other), content='My holiday pay is wrong')
+
+    def search(self, query, **params):
+        response = self.client.get('/messages/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_ranked_snippets_of_own_messages(self):
+        results = self.search('holiday')['results']
+        self.assertEqual([r['id'] for r in results], [self.often.id, self.holiday.id])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(results[1]['conversation_id'], str(self.conversation.id))
+        self.assertEqual(results[1]['conversation_title'], 'Leave')
+        self.assertEqual(results[1]['snippet'], 'How is <mark>holiday</mark> pay calculated?')
+        # Stemmed, every word required, the last one as a prefix.
+        self.assertEqual([r['id'] for r in self.search('holidays pay')['results']], [self.holiday.id])
+        self.assertEqual([r['id'] for r in self.search('calc')['results']], [self.holiday.id])
+        self.assertEqual(self.search('calc ')['results'], [])
+        # The stemmer widens a typed prefix; every match still gets its snippet.
+        results = self.search('holidays')['results']
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all('<mark>' in r['snippet'] for r in results))
+
+    def test_snippets_are_escaped(self):
+        Message.objects.create(conversation=self.conversation, content='<script>alert("vacation")</script>')
+        [result] = self.search('vacation')['results']
+        self.assertEqual(result['snippet'], '&lt;script&gt;alert(&quot;<mark>vacation</mark>&quot;)&lt;/script&gt;')
+
+    def test_index_follows_edits_and_deletes(self):
+        self.holiday.content = 'How is overtime calculated?'
+        self.holiday.save()
+        self.assertEqual([r['id'] for r in self.search('overtime')['results']], [self.holiday.id])
+        self.assertEqual([r['id'] for r in self.search('holiday')['results']], [self.often.id])
+        self.often.delete()
+        self.assertEqual(self.search('holiday')['results'], [])
+
+    def test_deleted_conversations_are_left_out(self):
+        self.client.delete(f'/conversations/{self.conversation.id}/delete/')
+        self.assertEqual(self.search('holiday')['results'], [])
+        run_pending()
+        self.assertEqual(self.search('holiday')['results'], [])
+
+    def test_keyset_pages(self):
+        Message.objects.bulk_create(
+            Message(conversation=self.conversation, content=f'Question {n} about leave') for n in range(7)
+        )
+        seen, data = [], self.search('leave', page_size=3)
+        while True:
+            self.assertLessEqual(len(data['results']), 3)
+            seen += [r['id'] for r in data['results']]
+            if not data['next']:
+                break
+            data = self.client.get(data['next']).data
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual(self.client.get('/messages/search/', {'q': 'leave', 'cursor': 'nope'}).status_code, 404)
+
+    def test_query_is_required(self):
+        self.assertEqual(self.client.get('/messages/search/').status_code, 400)
+        self.assertEqual(self.client.get('/messages/search/', {'q': '?!'}).status_code, 400)
+
+    def test_rebuild_command_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO chatbot_message_fts(chatbot_message_fts) VALUES ('delete-all')")
+        self.assertEqual(self.search('holiday')['results'], [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Rebuilt the fts5 search index', out.getvalue())
+        self.assertEqual(len(self.search('holiday')['results']), 2)
+
+
+class ConversationExportTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user, title='Leave', favourite=True)
+        question = Message.objects.create(conversation=self.conversation, content='How much holiday do I get?')
+        Message.objects.create(conversation=self.conversation, content='25 days.', is_from_user=False, in_reply_to=question)
+        asked = UserQuestion.objects.create(conversation=self.conversation, user=self.user, question_text='Holiday?')
+        ChatbotResponse.objects.create(conversation=self.conversation, question=asked, response_text='25 days.',
+                                       sources=['handbook'])
+        Conversation.objects.create(user=self.user, title='Empty')
+        deleted = Conversation.objects.create(user=self.user, title='Gone')
+        Message.objects.create(conversation=deleted, content='Forget this')
+        soft_delete(self.user, [deleted.pk])
+        self.other = User.objects.create_user(username='john', email='john@example.com', password='pass')
+        Message.objects.create(conversation=Conversation.objects.create(user=self.other), content='Not jane\'s')
+
+    def export(self, **params):
+        response = self.client.get('/conversations/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_export_streams_the_users_history(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(records[0]['type'], 'header')
+        self.assertEqual(
+            [r['type'] for r in records[1:]],
+            ['conversation', 'conversation', 'message', 'message', 'user_question', 'chatbot_response'],
+        )
+        self.assertEqual({r['title'] for r in records if r['type'] == 'conversation'}, {'Leave', 'Empty'})
+        reply = records[4]
+        self.assertEqual(reply['in_reply_to_id'], records[3]['id'])
+        self.assertEqual(records[-1]['sources'], ['handbook'])
+
+        compressed, gzipped = self.export(compress='gzip')
+        self.assertEqual(compressed['Content-Type'], 'application/gzip')
+        self.assertEqual(
+            [json.loads(line)['type'] for line in gzip.decompress(gzipped).splitlines()],
+            [r['type'] for r in records],
+        )
+
+    async def test_export_streams_under_asgi(self):
+        response = await self.async_client.get('/conversations/export/', headers={'Authorization': self.auth_header})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        body = b''.join([block async for block in response.streaming_content])
+        self.assertEqual(len(body.splitlines()), 7)
+
+    def test_export_of_another_user_is_for_staff(self):
+        self.assertEqual(self.client.get('/conversations/export/', {'user': self.other.pk}).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response, body = self.export(user=self.other.pk)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="chat-history-{self.other.pk}.ndjson"')
+        self.assertIn(b"Not jane's", body)
+
+    def test_import_round_trip(self):
+        _, body = self.export(compress='gzip')
+        client = APIClient()
+        client.force_authenticate(self.other)
+        response = client.post('/conversations/import/', body, content_type='application/gzip')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            response.data['imported'], {'conversation': 2, 'message': 2, 'user_question': 1, 'chatbot_response': 1}
+        )
+        imported = Conversation.objects.get(user=self.other, title='Leave')
+        self.assertNotEqual(imported.pk, self.conversation.pk)
+        self.assertTrue(imported.favourite)
+        self.assertEqual(imported.created_at, self.conversation.created_at)
+        self.assertEqual(imported.message_count, 2)
+        self.assertEqual(imported.last_message_preview, '25 days.')
+        original = Message.objects.get(conversation=self.conversation, is_from_user=True)
+        question, reply = Message.objects.filter(conversation=imported).order_by('pk')
+        self.assertEqual(question.created_at, original.created_at)
+        self.assertEqual(reply.in_reply_to_id, question.pk)
+        self.assertEqual(UserQuestion.objects.get(conversation=imported).user, self.other)
+        self.assertEqual(ChatbotResponse.objects.get(conversation=imported).question.conversation, imported)
+        results = client.get('/messages/search/', {'q': 'holiday'}).data['results']
+        self.assertEqual([r['id'] for r in results], [question.pk])
+
+    def test_import_in_small_batches_keeps_reply_links(self):
+        _, body = self.export()
+        counts = import_records(self.other, body.splitlines(), batch_size=1)
+        self.assertEqual(counts['message'], 2)
+        reply = Message.objects.get(conversation__user=self.other, is_from_user=False, content='25 days.')
+        self.assertEqual(reply.in_reply_to.content, 'How much holiday do I get?')
+
+    def test_import_rejects_malformed_exports(self):
+        _, body = self.export()
+        lines = body.splitlines()
+        for bad, error in [
+            (lines[1:], 'Line 1: not the header'),
+            (lines[:3] + [b'{"type": "message"}'], 'Line 4: message without id'),
+            (lines[:1] + [lines[3]], 'Line 2: message of a conversation not in the file'),
+            (lines[:1] + [b'not json'], 'Line 2 is not an exported record'),
+            (lines[:1] + [b'[1]'], 'Line 2 is not an exported record'),
+        ]:
+            response = self.client.post('/conversations/import/', b'\n'.join(bad), content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.data['detail'])
+        truncated = gzip.compress(body)[:50]
+        response = self.client.post('/conversations/import/', truncated, content_type='application/gzip')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('corrupt gzip stream', response.data['detail'])
+
+    def test_failed_import_keeps_activity_of_committed_batches(self):
+        _, body = self.export()
+        with self.assertRaises(InvalidExport):
+            import_records(self.other, body.splitlines() + [b'not json'], batch_size=1)
+        imported = Conversation.objects.get(user=self.other, title='Leave')
+        self.assertEqual(imported.message_count, 2)
+        self.assertEqual(imported.last_message_preview, '25 days.')
+
+    def test_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'jane.ndjson.gz'
+            out = StringIO()
+            call_command('export_conversations', 'jane@example.com', '--output', str(path), '--gzip', stdout=out)
+            self.assertIn('Exported jane@example.com', out.getvalue())
+            call_command('import_conversations', 'john@example.com', str(path), '--batch-size', '2', stdout=out)
+        self.assertIn('Imported 2 conversations, 2 messages, 1 user_questions, 1 chatbot_responses', out.getvalue())
+        self.assertEqual(Conversation.objects.filter(user=self.other).count(), 3)
+        with self.assertRaises(CommandError):
+            call_command('export_conversations', 'nobody@example.com', '--output', '-')
+
+
+class TitleTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create(user=self.user)
+
+    def test_first_message_sets_title_once(self):
+        url = f'/conversation/{self.conversation.id}/create-message/'
+        self.client.post(url, {'content': 'How many   days of holiday do I get this year?'}, format='json')
+        self.client.post(url, {'content': 'And sick leave?'}, format='json')
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'How many days of holiday do I ')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/conversations/{self.conversation.id}/title/')
+        self.assertEqual(response.data['title'], self.conversation.title)
+
+    def test_user_title_is_kept(self):
+        self.conversation.title = 'Holidays'
+        self.conversation.save()
+        self.client.post(f'/conversation/{self.conversation.id}/create-message/', {'content': 'Hi'}, format='json')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'Holidays')
+
+    def test_untitled_conversation_without_messages(self):
+        response = self.client.get(f'/conversations/{self.conversation.id}/title/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_backfill(self):
+        Message.objects.create(conversation=self.conversation, content='Assistant first', is_from_user=False)
+        Message.objects.create(conversation=self.conversation, content='Expenses question')
+        Message.objects.create(conversation=self.conversation, content='Later question')
+        untouched = Conversation.objects.create(user=self.user)
+        for n in range(4):
+            conversation = Conversation.objects.create(user=self.user)
+            Message.objects.create(conversation=conversation, content=f'question {n}')
+
+        out = StringIO()
+        call_command('backfill_titles', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Titled 5 conversations', out.getvalue())
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.title, 'Expenses question')
+        untouched.refresh_from_db()
+        self.assertEqual(untouched.title, 'Empty')
+
+
+class JobQueueTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.attempts = 0
+
+    def flaky(self, job):
+        self.attempts += 1
+        if self.attempts < 2:
+            raise RuntimeError('LLM timed out')
+        return {'ok': True}
+
+    def test_background_ask_is_answered_by_worker(self):
+        response = self.client.post('/ask/', {'query': 'How much holiday do I get?', 'background': True}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['job_id']
+        self.assertEqual(self.client.get(f'/ask/jobs/{job_id}/').data['status'], 'queued')
+        self.assertFalse(ChatbotResponse.objects.exists())
+
+        self.assertEqual(run_pending(), 1)
+
+        job = self.client.get(f'/ask/jobs/{job_id}/').data
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result']['result']['answer'], 'Holiday allowance is 25 days.')
+        self.assertEqual(ChatbotResponse.objects.get().id, job_id)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        with mock.patch.dict(HANDLERS, flaky=self.flaky), self.assertLogs('chatbot.jobs', 'ERROR'):
+            job = enqueue('flaky', max_attempts=3)
+            run_pending()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('queued', 1))
+            self.assertGreater(job.run_after, job.created_at)
+            self.assertIn('LLM timed out', job.error)
+
+            Job.objects.filter(pk=job.pk).update(run_after=job.created_at)
+            run_pending()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.result), ('done', 2, {'ok': True}))
+
+    def test_job_fails_after_max_attempts(self):
+        with mock.patch.dict(HANDLERS, flaky=self.flaky), self.assertLogs('chatbot.jobs', 'ERROR'):
+            job = enqueue('flaky', max_attempts=1)
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_job_is_claimed_once(self):
+        enqueue('flaky')
+        self.assertIsNotNone(claim('a'))
+        self.assertIsNone(claim('b'))
+        enqueue('flaky')
+        self.assertIsNone(claim('b', max_running=1))
+
+    def test_lost_job_is_requeued_after_lease(self):
+        enqueue('flaky')
+        job = claim('dead-worker')
+        Job.objects.filter(pk=job.pk).update(locked_at=job.locked_at - timedelta(seconds=600))
+
+        self.assertEqual(requeue_stale(lease=300), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'queued')
+
+    def test_jobs_are_private(self):
+        other = User.objects.create_user(email='john@example.com', password='pass12345', username='john')
+        job = enqueue('answer', {'question': 'Hi'}, user=other)
+        self.assertEqual(self.client.get(f'/ask/jobs/{job.id}/').status_code, 404)
+
+    def test_queue_stats(self):
+        enqueue('flaky')
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get('/ask/jobs/stats/').data
+        self.assertEqual((stats['queued'], stats['due'], stats['running']), (1, 1, 0))
+
+    async def test_events_end_with_result(self):
+        job = await sync_to_async(enqueue)('answer', {'question': 'Hi'}, user=self.user)
+        await Job.objects.filter(pk=job.pk).aupdate(status='done', result={'answer': 'Hello'})
+        response = await self.async_client.get(
+            f'/ask/jobs/{job.id}/events/', headers={'Accept': 'text/event-stream', 'Authorization': self.auth_header},
+        )
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(body.startswith('event: done\n'))
+        self.assertIn('"answer": "Hello"', body)
+
+
+class SingleFlightTests(TestCase):
+
+    def run_concurrently(self, fn, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fn())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_callers_share_one_call(self):
+        flight, release, calls = SingleFlight(), threading.Event(), []
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return 'answer'
+
+        threads, results = self.run_concurrently(lambda: flight.do('k', slow))
+        while flight.snapshot()['followers'] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['answer'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.snapshot(), {'leaders': 1, 'followers': 4, 'remote_followers': 0, 'in_flight': 0})
+
+    def test_errors_reach_followers_and_are_not_kept(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do('k', mock.Mock(side_effect=ValueError))
+        self.assertEqual(flight.do('k', lambda: 'retried'), 'retried')
+
+    async def test_cancelled_follower_leaves_the_leader_alone(self):
+        flight, release = SingleFlight(), asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return 'answer'
+
+        leader = asyncio.ensure_future(flight.ado('k', slow))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.ado('k', slow))
+        await asyncio.sleep(0)
+        follower.cancel()
+        release.set()
+        self.assertEqual(await leader, 'answer')
+
+    def test_processes_share_a_call_through_the_cache(self):
+        # Two instances stand in for two processes sharing a cache backend.
+        leader, other = SingleFlight(shared=True), SingleFlight(shared=True, poll_interval=0.01)
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'answer'
+
+        thread = threading.Thread(target=leader.do, args=('shared-k', slow))
+        thread.start()
+        started.wait(5)
+        threading.Timer(0.05, release.set).start()
+        self.assertEqual(other.do('shared-k', mock.Mock(side_effect=AssertionError)), 'answer')
+        thread.join()
+        self.assertEqual(other.snapshot()['remote_followers'], 1)
+
+
+@override_settings(CHATBOT={**FAKE_CHATBOT, 'FAKE_LLM_LATENCY': 0.2, 'ANSWER_CACHE_ENABLED': False})
+class CoalescedAskTests(ChatbotTestCase):
+
+    def test_identical_questions_share_one_llm_call(self):
+        pipeline = get_pipeline()
+        answers = []
+        threads = [
+            threading.Thread(target=lambda: answers.append(pipeline.ask('How much holiday do I get?')['answer']))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(answers, ['Holiday allowance is 25 days.'] * 5)
+        self.assertEqual(pipeline.llm.i, 1)
+        self.assertEqual(pipeline.coalescer.snapshot()['followers'], 4)
+
+    def test_different_history_is_not_coalesced(self):
+        pipeline = get_pipeline()
+        pipeline.ask('And sick leave?', [('Holiday?', '25 days.')])
+        pipeline.ask('And sick leave?', [('Expenses?', 'Monthly.')])
+        self.assertEqual(pipeline.coalescer.snapshot()['leaders'], 2)
+
+
+class WriteBehindBufferTests(ChatbotTestCase):
+
+    def make_buffer(self, spool_dir=None):
+        # Not started: these tests flush by hand instead of from the thread.
+        buffer = WriteBehindBuffer(spool_dir or tempfile.mkdtemp(), batch_size=100, interval=60)
+        buffer.spool_dir.mkdir(exist_ok=True)
+        buffer._open_spool()
+        return buffer
+
+    def add_turn(self, buffer, conversation):
+        question = UserQuestion(conversation=conversation, user=self.user, question_text='Holiday?')
+        buffer.add(question, ChatbotResponse(conversation=conversation, response_text='25 days.'))
+        return question
+
+    def test_rows_are_written_on_flush(self):
+        buffer, conversation = self.make_buffer(), Conversation.objects.create(user=self.user)
+        question = self.add_turn(buffer, conversation)
+        self.assertEqual(buffer.pending(conversation.id), 2)
+        self.assertFalse(UserQuestion.objects.exists())
+
+        with self.assertNumQueries(2):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(UserQuestion.objects.get().timestamp, question.timestamp)
+        self.assertEqual(ChatbotResponse.objects.count(), 1)
+        self.assertEqual([p.suffix for p in buffer.spool_dir.iterdir()], ['.jsonl'])
+
+    def test_spool_of_dead_process_is_replayed_once(self):
+        crashed, conversation = self.make_buffer(), Conversation.objects.create(user=self.user)
+        question = self.add_turn(crashed, conversation)
+
+        survivor = self.make_buffer(crashed.spool_dir)
+        survivor.replay()
+        self.assertFalse(UserQuestion.objects.exists(), 'a live spool must not be replayed')
+
+        crashed._spool.close()  # the process died without flushing
+        survivor.replay()
+        self.assertEqual(UserQuestion.objects.get().id, question.id)
+        self.assertEqual(ChatbotResponse.objects.count(), 1)
+        self.assertEqual(survivor.snapshot()['replayed'], 2)
+        survivor.replay()
+        self.assertEqual(UserQuestion.objects.count(), 1)
+
+    def test_replay_drops_rows_of_purged_conversation(self):
+        crashed = self.make_buffer()
+        kept, purged = (Conversation.objects.create(user=self.user) for _ in range(2))
+        self.add_turn(crashed, kept)
+        self.add_turn(crashed, purged)
+        crashed._spool.close()
+        purge_conversation(purged.id)
+
+        survivor = self.make_buffer(crashed.spool_dir)
+        survivor.replay()
+        self.assertEqual(UserQuestion.objects.get().conversation_id, kept.id)
+        self.assertEqual(ChatbotResponse.objects.count(), 1)
+        self.assertEqual(survivor.snapshot()['replayed'], 2)
+        self.assertEqual([p.suffix for p in survivor.spool_dir.iterdir()], ['.jsonl'])
+
+    def test_failed_flush_is_retried_in_process(self):
+        buffer, conversation = self.make_buffer(), Conversation.objects.create(user=self.user)
+        self.add_turn(buffer, conversation)
+        locked = OperationalError('database is locked')
+        with mock.patch('chatbot.audit.bulk_insert', side_effect=[locked, None]) as insert:
+            self.assertEqual(buffer.flush(), 0)
+            self.assertEqual(buffer.pending(conversation.id), 2)
+            self.assertEqual(buffer.flush(), 0, 'retried before the backoff')
+            self.assertEqual(insert.call_count, 1)
+            # Reading the conversation's history retries at once.
+            buffer.flush_conversation(conversation.id)
+        self.assertEqual(insert.call_count, 2)
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(buffer.snapshot()['errors'], 1)
+        self.assertEqual([p.suffix for p in buffer.spool_dir.iterdir()], ['.jsonl'])
+
+    def test_torn_line_is_set_aside_alone(self):
+        crashed, conversation = self.make_buffer(), Conversation.objects.create(user=self.user)
+        question = self.add_turn(crashed, conversation)
+        crashed._spool.write('{"model": "chatbot.userquest')  # the process died mid-write
+        crashed._spool.close()
+
+        survivor = self.make_buffer(crashed.spool_dir)
+        survivor.replay()
+        self.assertEqual(UserQuestion.objects.get().id, question.id)
+        self.assertEqual(ChatbotResponse.objects.count(), 1)
+        failed = Path(crashed._spool.name).with_suffix('.failed')
+        self.assertEqual(failed.read_text(encoding='utf-8'), '{"model": "chatbot.userquest\n')
+
+    def test_unreadable_spool_is_set_aside(self):
+        spool_dir = Path(tempfile.mkdtemp())
+        (spool_dir / '1-dead.flushing').write_text('{"model": "chatbot.userquestion"\n', encoding='utf-8')
+        buffer = WriteBehindBuffer(spool_dir, interval=60).start()
+        buffer.stop()
+        self.assertEqual(buffer.snapshot()['errors'], 1)
+        self.assertTrue((spool_dir / '1-dead.failed').exists())
+
+    def test_follow_up_question_sees_buffered_turn(self):
+        spool_dir = tempfile.mkdtemp()
+        with override_settings(CHATBOT={**FAKE_CHATBOT, 'AUDIT_WRITE_BEHIND': True, 'AUDIT_SPOOL_DIR': spool_dir,
+                                        'AUDIT_FLUSH_INTERVAL': 60}):
+            conversation = Conversation.objects.create(user=self.user)
+            ask = {'query': 'How much holiday do I get?', 'conversation_id': conversation.id}
+            self.assertEqual(self.client.post('/ask/', ask, format='json').status_code, 200)
+            self.assertFalse(UserQuestion.objects.exists())
+            self.assertEqual(get_audit_buffer().pending(), 2)
+
+            self.client.post('/ask/', {**ask, 'query': 'And sick leave?'}, format='json')
+            self.assertEqual(UserQuestion.objects.count(), 1)
+            # Two answers plus condensing the follow-up, which only happens with history.
+            self.assertEqual(get_pipeline().llm.i, 3)
+        # Turning write-behind off stops the buffer, which writes what is left.
+        self.assertEqual(UserQuestion.objects.count(), 2)
+        self.assertEqual(ChatbotResponse.objects.count(), 2)
+
+
+class AdmissionControllerTests(TestCase):
+
+    def test_sheds_when_queue_is_full(self):
+        admission = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1)
+        with admission.admit():
+            with self.assertRaises(Throttled) as raised:
+                with admission.admit():
+                    pass
+        self.assertGreaterEqual(raised.exception.wait, 1)
+        self.assertEqual(admission.snapshot()['shed'], 1)
+        with admission.admit():
+            self.assertEqual(admission.snapshot()['running'], 1)
+
+    def test_queued_caller_gets_the_next_free_slot(self):
+        admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+        entered = []
+
+        def wait_for_slot():
+            with admission.admit():
+                entered.append(time.monotonic())
+
+        with admission.admit():
+            thread = threading.Thread(target=wait_for_slot)
+            thread.start()
+            while admission.snapshot()['waiting'] < 1:
+                time.sleep(0.01)
+            released = time.monotonic()
+        thread.join()
+
+        self.assertGreaterEqual(entered[0], released)
+        self.assertEqual(admission.snapshot()['queued'], 1)
+
+    def test_queued_caller_times_out(self):
+        admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        with admission.admit():
+            with self.assertRaises(Throttled):
+                with admission.admit():
+                    pass
+        self.assertEqual(admission.snapshot()['timed_out'], 1)
+        self.assertEqual(admission.snapshot()['waiting'], 0)
+
+    def test_shared_slots_span_instances(self):
+        # Two instances stand in for two processes sharing a cache backend.
+        cache.clear()
+        first = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1, shared=True)
+        second = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1, shared=True)
+        with first.admit():
+            with self.assertRaises(Throttled):
+                with second.admit():
+                    pass
+        with second.admit():
+            pass
+
+    def test_shared_slot_of_a_dead_worker_expires(self):
+        cache.clear()
+        dead = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1, shared=True, lease=0.1)
+        self.assertTrue(dead._try_acquire())  # never released
+        alive = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1, shared=True, lease=0.1)
+        with alive.admit():
+            self.assertEqual(alive.snapshot()['queued'], 1)
+
+
+@override_settings(CHATBOT={**FAKE_CHATBOT, 'ASK_USER_RATE': '2/min', 'ASK_USER_BURST': 2})
+class AskThrottleTests(ChatbotTestCase):
+
+    def ask(self, client=None):
+        return (client or self.client).post('/ask/', {'query': 'How much holiday do I get?'}, format='json')
+
+    def test_user_bucket_limits_each_user(self):
+        self.assertEqual([self.ask().status_code for _ in range(3)], [200, 200, 429])
+        response = self.ask()
+        self.assertEqual(int(response['Retry-After']), 30)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(email='joe@example.com', password='pass12345', username='joe'))
+        self.assertEqual(self.ask(other).status_code, 200)
+
+    @override_settings(CHATBOT={**FAKE_CHATBOT, 'ASK_USER_RATE': None, 'ASK_GLOBAL_RATE': '1/min',
+                                'ASK_GLOBAL_BURST': 1})
+    def test_global_bucket_is_shared(self):
+        self.assertEqual(self.ask().status_code, 200)
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(email='joe@example.com', password='pass12345', username='joe'))
+        self.assertEqual(self.ask(other).status_code, 429)
+
+    async def test_async_view_is_throttled(self):
+        responses = []
+        for _ in range(3):
+            responses.append(await self.async_client.post(
+                '/ask/async/', {'query': 'How much holiday do I get?'},
+                content_type='application/json', headers={'Authorization': self.auth_header},
+            ))
+        self.assertEqual([r.status_code for r in responses], [200, 200, 429])
+        self.assertIn('Retry-After', responses[2])
+
+    @override_settings(CHATBOT={**FAKE_CHATBOT, 'ASK_MAX_CONCURRENT': 1, 'ASK_MAX_QUEUE': 0})
+    def test_full_server_sheds_with_retry_after(self):
+        with get_admission().admit():
+            response = self.ask()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertFalse(UserQuestion.objects.exists())
+        self.assertEqual(self.ask().status_code, 200)
+
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get('/ask/cache-stats/').data['admission']
+        self.assertEqual((stats['shed'], stats['admitted']), (1, 2))
+
+    @override_settings(CHATBOT={**FAKE_CHATBOT, 'ASK_MAX_CONCURRENT': 1, 'ASK_MAX_QUEUE': 0})
+    async def test_stream_holds_a_slot_until_it_ends(self):
+        def stream():
+            return self.async_client.post(
+                '/ask/stream/', {'query': 'How much holiday do I get?'}, content_type='application/json',
+                headers={'Accept': 'text/event-stream', 'Authorization': self.auth_header},
+            )
+
+        with get_admission().admit():
+            self.assertEqual((await stream()).status_code, 429)
+        self.assertFalse(await UserQuestion.objects.aexists())
+
+        response = await stream()
+        self.assertEqual(get_admission().snapshot()['running'], 1)
+        [chunk async for chunk in response.streaming_content]
+        self.assertEqual(get_admission().snapshot()['running'], 0)
+
+
+INSTRUMENTED_CHATBOT = {**FAKE_CHATBOT, 'INSTRUMENTATION_ENABLED': True, 'METRICS_TOKEN': 'scrape-me'}
+
+
+@override_settings(CHATBOT=INSTRUMENTED_CHATBOT)
+class InstrumentationTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.auth_header)
+
+    def timings(self, response):
+        return {part.split(';')[0].strip(): part for part in response['Server-Timing'].split(',')}
+
+    def test_ask_reports_each_stage(self):
+        response = self.client.post('/ask/', {'query': 'How much holiday do I get?'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        timings = self.timings(response)
+        for name in ('total', 'db', 'auth', 'conversation', 'history', 'queue', 'embed', 'retrieve', 'llm',
+                     'audit', 'render'):
+            self.assertIn(name, timings)
+        self.assertIn('queries', timings['auth'])  # the JWT user lookup
+
+    def test_metrics_need_staff_or_token(self):
+        self.client.post('/ask/', {'query': 'How much holiday do I get?'}, format='json')
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+        response = APIClient().get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('chatbot_requests_total{view="ask_question",method="POST",status="200"} 1', body)
+        self.assertIn('chatbot_request_duration_seconds_count{view="ask_question"} 1', body)
+        self.assertIn('chatbot_stage_duration_seconds_count{view="ask_question",stage="llm"} 1', body)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+
+    async def test_async_ask_reports_stages(self):
+        response = await self.async_client.post(
+            '/ask/async/', {'query': 'How much holiday do I get?'},
+            content_type='application/json', headers={'Authorization': self.auth_header},
+        )
+        self.assertEqual(response.status_code, 200)
+        timings = self.timings(response)
+        for name in ('auth', 'conversation', 'history', 'embed', 'retrieve', 'llm', 'audit'):
+            self.assertIn(name, timings)
+
+    @override_settings(CHATBOT={**FAKE_CHATBOT, 'INSTRUMENTATION_ENABLED': False})
+    def test_disabled_adds_nothing(self):
+        response = self.client.post('/ask/', {'query': 'How much holiday do I get?'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('ask_question', metrics.prometheus())
+
+    def test_slow_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {**INSTRUMENTED_CHATBOT, 'PROFILE_SLOW_REQUESTS': 0, 'PROFILE_SAMPLE_RATE': 1.0,
+                      'PROFILE_DIR': directory}
+            with override_settings(CHATBOT=config):
+                self.client.post('/ask/', {'query': 'How much holiday do I get?'}, format='json')
+                config['PROFILE_SLOW_REQUESTS'] = 60
+                self.client.post('/ask/', {'query': 'When are expenses paid?'}, format='json')
+            self.assertEqual(len(list(Path(directory).iterdir())), 1)
+        self.assertIn('chatbot_slow_request_profiles_total 1', metrics.prometheus())
+
+
+    def test_request_that_raises_frees_the_profiler(self):
+        def fail(request):
+            raise RuntimeError('boom')
+
+        config = {**INSTRUMENTED_CHATBOT, 'PROFILE_SLOW_REQUESTS': 0, 'PROFILE_SAMPLE_RATE': 1.0}
+        with override_settings(CHATBOT=config), self.assertRaises(RuntimeError):
+            InstrumentationMiddleware(fail)(RequestFactory().get('/'))
+        self.assertFalse(SlowRequestProfiler._busy.locked())
+
+class FakeBackendTests(TestCase):
+
+    def test_latency_is_drawn_around_the_median(self):
+        self.assertEqual(fakes.sample_latency(0.1), 0.1)
+        draws = sorted(fakes.sample_latency(0.1, 0.5) for _ in range(2000))
+        self.assertAlmostEqual(draws[1000], 0.1, delta=0.01)
+        self.assertGreater(draws[-20], 0.2)
+
+    def test_fake_embeddings_are_deterministic(self):
+        embeddings = fakes.fake_embeddings({'FAKE_EMBEDDING_SIZE': 8})
+        self.assertEqual(embeddings.embed_query('holiday'), embeddings.embed_documents(['holiday'])[0])
+        self.assertEqual(len(embeddings.embed_query('holiday')), 8)
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.backend = fakes.fake_embeddings({})
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return self.backend.embed_documents(texts)
+
+
+class CachedEmbeddingsTests(TestCase):
+
+    def setUp(self):
+        self.backend = CountingEmbeddings()
+        self.embeddings = CachedEmbeddings(self.backend, namespace='test', batch_window=0.05, batch_size=3)
+
+    def test_repeated_texts_are_embedded_once(self):
+        first = self.embeddings.embed_documents(['a', 'b', 'a'])
+        second = self.embeddings.embed_documents(['b', 'c'])
+
+        self.assertEqual(self.backend.calls, [['a', 'b'], ['c']])
+        self.assertEqual(first[0], first[2])
+        self.assertEqual(first[1], second[0])
+        self.assertAlmostEqual(self.embeddings.embed_query('a')[0], first[0][0])
+
+    def test_large_inputs_are_split_into_batches(self):
+        self.embeddings.embed_documents([str(i) for i in range(7)])
+        self.assertEqual([len(call) for call in self.backend.calls], [3, 3, 1])
+
+    def test_concurrent_queries_are_coalesced(self):
+        threads = [threading.Thread(target=self.embeddings.embed_query, args=(f'q{i}',)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(t for call in self.backend.calls for t in call), [f'q{i}' for i in range(6)])
+        self.assertLess(len(self.backend.calls), 6)
+
+    def test_persistent_store_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = EmbeddingStore(f'{tmp}/embeddings.sqlite3')
+            vector = CachedEmbeddings(self.backend, 'test', store=store).embed_documents(['a'])[0]
+            store.close()
+
+            store = EmbeddingStore(f'{tmp}/embeddings.sqlite3')
+            restarted = CachedEmbeddings(self.backend, 'test', store=store)
+            self.assertEqual(restarted.embed_documents(['a'])[0], vector)
+            self.assertEqual(restarted.stats['store_hits'], 1)
+            self.assertEqual(len(self.backend.calls), 1)
+            store.close()
+
+
+class LocalVectorStoreTests(TestCase):
+
+    def setUp(self):
+        self.embeddings = fakes.fake_embeddings({})
+        self.texts = ['Holiday policy', 'Expenses policy', 'Parking rules']
+
+    def test_retriever_returns_most_similar_document(self):
+        store = LocalVectorStore.from_texts(self.texts, self.embeddings)
+        docs = store.as_retriever(search_kwargs={'k': 1}).get_relevant_documents('Expenses policy')
+        self.assertEqual([doc.page_content for doc in docs], ['Expenses policy'])
+
+    def test_upsert_and_delete_by_id(self):
+        store = LocalVectorStore(self.embeddings)
+        store.add_texts(self.texts, ids=['a', 'b', 'c'])
+        store.add_texts(['Holiday policy v2'], ids=['a'])
+        store.delete(['b'])
+
+        self.assertEqual(len(store), 2)
+        contents = [doc.page_content for doc in store.similarity_search('Holiday policy v2', k=3)]
+        self.assertEqual(contents, ['Holiday policy v2', 'Parking rules'])
+
+    def test_memory_mapped_index_survives_reload(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = LocalVectorStore.from_texts(self.texts, self.embeddings, ids=['a', 'b', 'c'], path=tmp)
+            store.delete(['c'])
+            store.build_ivf(nlist=2)
+
+            reloaded = LocalVectorStore(self.embeddings, path=tmp)
+            self.assertEqual(len(reloaded), 2)
+            self.assertEqual(reloaded.similarity_search('Holiday policy', k=1)[0].page_content, 'Holiday policy')
+
+    def test_compaction_drops_retired_rows(self):
+        store = LocalVectorStore(self.embeddings)
+        store.add_texts(self.texts, ids=['a', 'b', 'c'])
+        store.add_texts(['Holiday policy v2'], ids=['a'])
+        self.assertFalse(store.compact())
+        store.delete(['b'])
+
+        self.assertTrue(store.compact(threshold=0.25))
+        self.assertEqual(store._count, 2)
+        contents = [doc.page_content for doc in store.similarity_search('Holiday policy v2', k=3)]
+        self.assertEqual(contents, ['Holiday policy v2', 'Parking rules'])
+
+    def test_reader_follows_another_writer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = LocalVectorStore.from_texts(self.texts, self.embeddings, ids=['a', 'b', 'c'], path=tmp)
+            reader = LocalVectorStore(self.embeddings, path=tmp, refresh_interval=0)
+
+            writer.add_texts(['Holiday policy v2'], ids=['a'])
+            writer.delete(['b'])
+            self.assertEqual(len(reader), 3, 'not refreshed before a search')
+            contents = [doc.page_content for doc in reader.similarity_search('Holiday policy v2', k=3)]
+            self.assertEqual(contents, ['Holiday policy v2', 'Parking rules'])
+
+            writer.build_ivf(nlist=2)
+            self.assertTrue(writer.compact(threshold=0))
+            self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()),
+                             ['documents.1.jsonl', 'ivf.1.npz', 'meta.json', 'vectors.1.f32'])
+            self.assertEqual(reader.similarity_search('Parking rules', k=1)[0].page_content, 'Parking rules')
+            self.assertEqual((reader._generation, reader._count, len(reader._centroids)), (1, 2, 2))
+
+    def test_ivf_search_recall_on_clustered_data(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(16, 32))
+        vectors = centers[rng.integers(0, 16, 4000)] + 0.1 * rng.normal(size=(4000, 32))
+        store = LocalVectorStore(self.embeddings, nprobe=4)
+        store.add_embeddings([str(i) for i in range(4000)], vectors)
+        queries = vectors[:50] + 0.05 * rng.normal(size=(50, 32))
+
+        exact = [set(store.search(q, k=10)[0]) for q in queries]
+        store.build_ivf(nlist=16)
+        approx = [set(store.search(q, k=10)[0]) for q in queries]
+
+        recall = np.mean([len(e & a) / 10 for e, a in zip(exact, approx)])
+        self.assertGreater(recall, 0.9)
+
+
+class IngestTests(ChatbotTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / 'handbook.md').write_text('Holiday allowance is 25 days.\n\n' * 40)
+        (self.root / 'expenses.txt').write_text('Expenses are paid monthly. ' * 60)
+        (self.root / 'image.png').write_bytes(b'not text')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        super().tearDown()
+
+    def ingest(self, *args):
+        out = StringIO()
+        call_command('ingest', str(self.root), '--chunk-size', '400', '--overlap', '50', *args, stdout=out)
+        return out.getvalue()
+
+    def test_chunks_cover_text_with_overlap(self):
+        text = ' '.join(f'word{i}' for i in range(500))
+        chunks = list(iter_chunks(iter([text[:1000], text[1000:]]), chunk_size=300, overlap=50))
+
+        self.assertTrue(all(len(chunk) <= 300 for chunk in chunks))
+        self.assertTrue(chunks[0].startswith('word0 ') and chunks[-1].endswith('word499'))
+        self.assertEqual(chunks[1][:10], chunks[0][-50:][:10])
+
+    def test_rerun_only_embeds_changed_chunks(self):
+        store = get_pipeline().vectorstore
+        preloaded = len(store)
+        output = self.ingest()
+        self.assertIn('Ingested 2 files', output)
+        total = IngestedChunk.objects.count()
+        indexed = len(store)
+
+        self.assertIn(f'{total} chunks, 0 embedded, {total} unchanged', self.ingest())
+
+        (self.root / 'expenses.txt').write_text('Expenses are paid weekly.')
+        output = self.ingest()
+        self.assertIn('1 embedded', output)
+        self.assertEqual(len(store), preloaded + IngestedChunk.objects.count())
+        self.assertLess(len(store), indexed)
+        self.assertEqual(store.similarity_search('Expenses are paid weekly.', k=1)[0].page_content,
+                         'Expenses are paid weekly.')
+
+    def test_prune_removes_deleted_files(self):
+        self.ingest()
+        (self.root / 'expenses.txt').unlink()
+        self.ingest()
+        self.assertTrue(IngestedChunk.objects.filter(source='expenses.txt').exists())
+
+        self.ingest('--prune')
+        self.assertFalse(IngestedChunk.objects.filter(source='expenses.txt').exists())
+
+    def test_missing_or_empty_path_does_not_prune(self):
+        self.ingest()
+        total = IngestedChunk.objects.count()
+        with self.assertRaisesMessage(CommandError, 'No such file or directory'):
+            call_command('ingest', str(self.root / 'missing'), '--prune', stdout=StringIO())
+        empty = self.root / 'empty'
+        empty.mkdir()
+        with self.assertRaisesMessage(CommandError, 'refusing to prune'):
+            call_command('ingest', str(empty), '--prune', stdout=StringIO())
+        self.assertEqual(IngestedChunk.objects.count(), total)
+
+    def test_local_index_keeps_chunk_texts_on_disk(self):
+        with tempfile.TemporaryDirectory() as index:
+            config = {**FAKE_CHATBOT, 'VECTORSTORE_BACKEND': 'chatbot.backends.local_vectorstore',
+                      'LOCAL_INDEX_PATH': index}
+            with self.settings(CHATBOT=config):
+                reset_pipeline()
+                self.ingest()
+                store = get_pipeline().vectorstore
+                self.assertEqual(len(store), IngestedChunk.objects.count())
+                self.assertEqual((store._texts, store._metadatas), ([], []))
+                doc = store.similarity_search('Expenses are paid monthly.', k=1)[0]
+                self.assertEqual(doc.metadata['source'], 'expenses.txt')
+                self.assertIn('Expenses are paid monthly.', doc.page_content)
+
+    def test_ingest_invalidates_answer_cache(self):
+        def ask():
+            conversation = Conversation.objects.create(user=self.user)
+            self.client.post('/ask/', {'query': 'How much holiday do I get?', 'conversation_id': conversation.id},
+                             format='json')
+
+        ask()
+        self.ingest()
+        ask()
+        self.assertEqual(get_pipeline().llm.i, 2)
+
+
+class DatabaseProfileTests(TestCase):
+
+    def test_sqlite_wal_profile_tunes_new_connections(self):
+        base_dir = Path(tempfile.mkdtemp())
+        connections = ConnectionHandler({'default': database_settings('sqlite-wal', base_dir, environ={})})
+        wrapper = connections['default']
+        with wrapper.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone(), (1,))
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone(), (5000,))
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+        self.assertEqual(wrapper.settings_dict['CONN_MAX_AGE'], 600)
+        wrapper.close()
+
+    def test_sqlite_profile_serializes_message_writes(self):
+        # A new connection's first insert into chatbot_message reads the FTS5 table's configuration.
+        # In a deferred transaction that read made writers fail with "database is locked" at once.
+        search_index = import_module('chatbot.migrations.0013_message_search_content_only')
+        connections = ConnectionHandler({'default': database_settings('sqlite', Path(tempfile.mkdtemp()), environ={})})
+        with connections['default'].cursor() as cursor:
+            cursor.execute('CREATE TABLE chatbot_message (id integer PRIMARY KEY, content text NOT NULL)')
+            for statement in search_index.SQLITE_FORWARDS:
+                cursor.execute(statement)
+        connections['default'].close()
+
+        def write(n):
+            # One connection per request, as runserver has on this profile.
+            wrapper = connections['default']
+            for i in range(25):
+                wrapper.ensure_connection()
+                wrapper._start_transaction_under_autocommit()
+                with wrapper.cursor() as cursor:
+                    cursor.execute('INSERT INTO chatbot_message (content) VALUES (%s)', [f'message {n} {i}'])
+                    time.sleep(0.001)
+                    cursor.execute('COMMIT')
+                wrapper.close()
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+        errors = []
+        with mock.patch('threading.excepthook', lambda args: errors.append(args.exc_value)):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        with connections['default'].cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM chatbot_message_fts WHERE chatbot_message_fts MATCH 'message'")
+            self.assertEqual(cursor.fetchone(), (200,))
+        connections['default'].close()
+
+    def test_postgres_profile_keeps_connections(self):
+        database = database_settings('postgres', None, environ={'POSTGRES_HOST': 'db', 'PGBOUNCER': '1'})
+        self.assertEqual(database['HOST'], 'db')
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertTrue(database['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            database_settings('oracle', None)
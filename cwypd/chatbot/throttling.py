@@ -0,0 +1,274 @@
+"""
+Admission control for the ask endpoints.
+
+Two layers keep a burst of questions from taking the service down with it:
+
+* Token-bucket rate limits, per user and for the whole site, as DRF
+  throttles. A bucket holds up to BURST tokens, refills at RATE, and every
+  question takes one. Buckets live in the Django cache, so they are shared by
+  the processes when the cache backend is.
+* A cap on concurrent generations with a bounded wait queue. Up to
+  ASK_MAX_CONCURRENT questions run at once, up to ASK_MAX_QUEUE more wait at
+  most ASK_QUEUE_TIMEOUT seconds for a slot, and anything beyond that is
+  turned away at once. With ADMISSION_SHARED the slots are leases in the
+  cache instead of a per-process semaphore: each running question holds one
+  of ASK_MAX_CONCURRENT keys, added with an ADMISSION_LEASE timeout, so the
+  slots of a worker that dies while answering come back once they expire.
+
+Both answer with 429 and a Retry-After header (rest_framework's Throttled).
+Reading and writing a bucket is not atomic across processes, so a shared
+bucket can let a few extra requests through under contention, as DRF's own
+throttles do.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+from .conf import chatbot_settings
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Turn '30/min' into tokens per second; None disables the limit.
+    """
+    if not rate:
+        return None
+    count, period = rate.split('/')
+    return int(count) / PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Base token-bucket throttle; subclasses name the settings and the bucket.
+    """
+    rate_setting = None
+    burst_setting = None
+    _lock = threading.Lock()
+
+    def get_bucket(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        config = chatbot_settings()
+        rate = parse_rate(config[self.rate_setting])
+        if rate is None:
+            return True
+        burst = config[self.burst_setting]
+        key = f'chatbot:throttle:{self.get_bucket(request, view)}'
+        now = time.time()
+        with self._lock:
+            tokens, stamp = cache.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            cache.set(key, (tokens, now), math.ceil(burst / rate) + 1)
+        self._wait = None if allowed else (1 - tokens) / rate
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class UserAskThrottle(TokenBucketThrottle):
+    rate_setting = 'ASK_USER_RATE'
+    burst_setting = 'ASK_USER_BURST'
+
+    def get_bucket(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return f'anon:{self.get_ident(request)}'
+
+
+class GlobalAskThrottle(TokenBucketThrottle):
+    rate_setting = 'ASK_GLOBAL_RATE'
+    burst_setting = 'ASK_GLOBAL_BURST'
+
+    def get_bucket(self, request, view):
+        return 'global'
+
+
+class AdmissionController:
+    """
+    Bound the number of concurrent generations, with a bounded wait queue.
+    """
+    SLOT_KEY = 'chatbot:admission:slot'
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout, shared=False, lease=300, poll_interval=0.01):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.shared = shared
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.stats = {'admitted': 0, 'queued': 0, 'shed': 0, 'timed_out': 0}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._running = 0
+        self._waiting = 0
+        # Moving average of generation time, to estimate Retry-After.
+        self._service_time = 1.0
+
+    @contextmanager
+    def admit(self):
+        """
+        Hold a generation slot for the duration of the block, or raise Throttled.
+        """
+        slot = self._try_acquire()
+        if not slot:
+            self._enqueue()
+            try:
+                deadline = time.monotonic() + self.queue_timeout
+                while not (slot := self._try_acquire(timeout=self.poll_interval)):
+                    if time.monotonic() > deadline:
+                        self._give_up()
+            finally:
+                self._dequeue()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(slot, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aadmit(self):
+        """
+        Async variant of admit(); waits on the event loop, not a thread.
+        """
+        slot = self._try_acquire()
+        if not slot:
+            self._enqueue()
+            try:
+                deadline = time.monotonic() + self.queue_timeout
+                while not (slot := self._try_acquire()):
+                    if time.monotonic() > deadline:
+                        self._give_up()
+                    await asyncio.sleep(self.poll_interval)
+            finally:
+                self._dequeue()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(slot, time.monotonic() - started)
+
+    def retry_after(self):
+        # Time for the queue ahead to drain through the available slots.
+        with self._lock:
+            backlog = self._waiting + 1
+        return max(1, math.ceil(self._service_time * backlog / self.max_concurrent))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                **self.stats,
+                'running': self._running,
+                'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+            }
+
+    def _try_acquire(self, timeout=None):
+        """
+        Take a slot and return it (a cache key and lease token when shared,
+        else True), or return None.
+        """
+        if self.shared:
+            slot = self._lease_slot()
+            if slot is None and timeout:
+                time.sleep(timeout)
+        elif timeout:
+            slot = self._slots.acquire(timeout=timeout) or None
+        else:
+            slot = self._slots.acquire(blocking=False) or None
+        if slot:
+            with self._lock:
+                self._running += 1
+                self.stats['admitted'] += 1
+        return slot
+
+    def _lease_slot(self):
+        token = uuid.uuid4().hex
+        # Start at a random slot so callers do not all contend for the first ones.
+        first = random.randrange(self.max_concurrent)
+        for n in range(self.max_concurrent):
+            key = f'{self.SLOT_KEY}:{(first + n) % self.max_concurrent}'
+            if cache.add(key, token, self.lease):
+                return key, token
+        return None
+
+    def _release(self, slot, elapsed):
+        if self.shared:
+            key, token = slot
+            # Unless the lease expired and another caller holds the slot now.
+            if cache.get(key) == token:
+                cache.delete(key)
+        else:
+            self._slots.release()
+        with self._lock:
+            self._running -= 1
+            self._service_time = 0.9 * self._service_time + 0.1 * elapsed
+
+    def _enqueue(self):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self.stats['shed'] += 1
+                full = True
+            else:
+                self._waiting += 1
+                self.stats['queued'] += 1
+                full = False
+        if full:
+            raise Throttled(wait=self.retry_after(), detail='Too many questions are being answered. Try again later.')
+
+    def _dequeue(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def _give_up(self):
+        with self._lock:
+            self.stats['timed_out'] += 1
+        raise Throttled(wait=self.retry_after(), detail='Too many questions are being answered. Try again later.')
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_admission():
+    """
+    Return this process's AdmissionController, or None when it is disabled.
+    """
+    global _admission
+    config = chatbot_settings()
+    if not config['ASK_MAX_CONCURRENT']:
+        return None
+    with _admission_lock:
+        if _admission is None:
+            _admission = AdmissionController(
+                config['ASK_MAX_CONCURRENT'],
+                config['ASK_MAX_QUEUE'],
+                config['ASK_QUEUE_TIMEOUT'],
+                shared=config['ADMISSION_SHARED'],
+                lease=config['ADMISSION_LEASE'],
+            )
+        return _admission
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    global _admission
+    if setting == 'CHATBOT':
+        _admission = None
@@ -0,0 +1,65 @@
+"""
+Conversation titles.
+
+A conversation is titled once, from its first user message, when that
+message is written. The title is set by a conditional UPDATE that only
+matches conversations still titled "Empty", so it costs one statement,
+never overwrites a title the user chose, and reading a title is a plain
+single-row read. Conversations from before this are titled by
+`manage.py backfill_titles`.
+"""
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Substr
+
+from .models import Conversation, Message
+
+EMPTY_TITLE = 'Empty'
+TITLE_LENGTH = 30
+
+
+def make_title(text):
+    return ' '.join(text.split())[:TITLE_LENGTH]
+
+
+def set_initial_title(conversation_id, text):
+    """
+    Title the conversation from `text` unless it already has a title.
+    Return whether it was updated.
+    """
+    title = make_title(text)
+    if not title:
+        return False
+    return bool(Conversation.objects.filter(pk=conversation_id, title=EMPTY_TITLE).update(title=title))
+
+
+def first_user_messages():
+    """
+    Subquery selecting the start of a conversation's first user message.
+    """
+    return Subquery(
+        Message.objects.filter(conversation=OuterRef('pk'), is_from_user=True)
+        .order_by('created_at')
+        .values(start=Substr('content', 1, TITLE_LENGTH * 8))[:1]
+    )
+
+
+def backfill_titles(batch_size=500):
+    """
+    Title every untitled conversation that has a user message, `batch_size`
+    conversations per UPDATE. Yield the number titled per batch.
+    """
+    last_pk = None
+    while True:
+        batch = Conversation.objects.filter(title=EMPTY_TITLE).order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        rows = list(batch.annotate(first_message=first_user_messages()).values_list('pk', 'first_message')[:batch_size])
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        titled = [
+            Conversation(pk=pk, title=make_title(text))
+            for pk, text in rows if text and make_title(text)
+        ]
+        Conversation.objects.bulk_update(titled, ['title'])
+        yield len(titled)
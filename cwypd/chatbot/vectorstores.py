@@ -0,0 +1,468 @@
+"""
+In-process vector index, a drop-in alternative to the hosted Pinecone index.
+
+Vectors are L2-normalized and kept in one float32 matrix, so cosine top-k is a
+single matrix-vector product. With a `path` the matrix is a memory-mapped
+file and the documents an append-only JSON-lines log, so large indexes are
+paged in by the OS rather than loaded, and survive restarts. Only the offset
+of each document in the log is kept in memory; its text is read back when a
+search returns it, so neither ingesting nor serving holds the corpus. For large
+corpora build_ivf() clusters the vectors (spherical k-means) and queries only
+scan the `nprobe` closest clusters.
+
+Rows are never rewritten: an upsert appends a new row and retires the old
+one, so a process that mapped the files (the web workers) keeps a consistent
+view while another one (`manage.py ingest`) writes. Readers pick up appended
+records at most `refresh_interval` seconds later. compact() writes the live
+rows to a new generation of files, switches meta.json to it and removes the
+old one; readers reload when they see the new generation.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.vectorstore import VectorStore
+
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Cosine-similarity vector store held in process.
+    """
+    VECTORS_FILE = 'vectors.f32'
+    DOCUMENTS_FILE = 'documents.jsonl'
+    IVF_FILE = 'ivf.npz'
+    META_FILE = 'meta.json'
+
+    def __init__(self, embedding, path=None, nprobe=8, refresh_interval=1.0):
+        self._embedding = embedding
+        self.path = Path(path) if path else None
+        self.nprobe = nprobe
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._reset()
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._load()
+
+    def _reset(self):
+        self._dim = None
+        self._count = 0
+        self._matrix = None
+        self._alive = np.zeros(0, dtype=bool)
+        self._texts = []
+        self._metadatas = []
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.int32)
+        self._log = None
+        self._rows = {}
+        self._centroids = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._inverted = None
+        self._generation = 0
+        self._log_size = 0
+        self._ivf_mtime = None
+        self._checked_at = time.monotonic()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return int(self._alive[:self._count].sum())
+
+    # Writes
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    def add_embeddings(self, texts, vectors, metadatas=None, ids=None):
+        """
+        Upsert precomputed vectors. An existing id gets a new row and its old
+        one is retired until the next compact().
+        """
+        texts = list(texts)
+        vectors = _unit_rows(vectors)
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            self._ensure_capacity(self._count + len(texts))
+            rows = np.arange(self._count, self._count + len(texts))
+            ids = [str(i) for i in ids] if ids else [str(row) for row in rows]
+            self._matrix[rows] = vectors
+            records = [
+                {'row': int(row), 'id': doc_id, 'text': text, 'metadata': metadata}
+                for row, doc_id, text, metadata in zip(rows, ids, texts, metadatas)
+            ]
+            for record, span in zip(records, self._persist(records)):
+                self._apply(record, *span)
+            if self._centroids is not None:
+                self._assignments[rows] = np.argmax(vectors @ self._centroids.T, axis=1)
+            self._inverted = None
+            return ids
+
+    def delete(self, ids=None, **kwargs):
+        with self._lock:
+            records = [{'id': str(doc_id), 'deleted': True} for doc_id in ids or [] if str(doc_id) in self._rows]
+            for record, span in zip(records, self._persist(records)):
+                self._apply(record, *span)
+            self._inverted = None
+        return True
+
+    def compact(self, threshold=0.5):
+        """
+        Drop retired rows once they make up more than `threshold` of the index
+        (0 compacts any). Returns whether it compacted.
+        """
+        with self._lock:
+            live = np.flatnonzero(self._alive[:self._count])
+            if not self._count or self._count - live.size <= threshold * self._count:
+                return False
+            if not self.path:
+                renumber = np.zeros(self._count, dtype=np.int64)
+                renumber[live] = np.arange(live.size)
+                self._matrix = self._matrix[live]
+                self._alive = np.ones(live.size, dtype=bool)
+                self._assignments = self._assignments[live]
+                self._texts = [self._texts[row] for row in live]
+                self._metadatas = [self._metadatas[row] for row in live]
+                self._rows = {doc_id: int(renumber[row]) for doc_id, row in self._rows.items()}
+                self._count = live.size
+                self._inverted = None
+                return True
+
+            old = [self._file(name) for name in (self.VECTORS_FILE, self.DOCUMENTS_FILE, self.IVF_FILE)]
+            generation = self._generation + 1
+            vectors_file = self._file(self.VECTORS_FILE, generation)
+            with open(vectors_file, 'wb') as fh:
+                fh.truncate(max(live.size, 1) * self._dim * 4)
+            matrix = np.memmap(vectors_file, dtype=np.float32, mode='r+', shape=(max(live.size, 1), self._dim))
+            for start in range(0, live.size, 65536):
+                matrix[start:start + 65536] = self._matrix[live[start:start + 65536]]
+            matrix.flush()
+            del matrix
+            ids = {row: doc_id for doc_id, row in self._rows.items()}
+            document = self._documents()
+            with open(self._file(self.DOCUMENTS_FILE, generation), 'w', encoding='utf-8') as fh:
+                for n, row in enumerate(live):
+                    text, metadata = document(row)
+                    fh.write(json.dumps({'row': n, 'id': ids[row], 'text': text, 'metadata': metadata}) + '\n')
+            if self._centroids is not None:
+                np.savez(self._file(self.IVF_FILE, generation),
+                         centroids=self._centroids, assignments=self._assignments[live])
+            self._write_meta(generation)
+            # Readers that mapped the old files keep them until they reload.
+            for path in old:
+                path.unlink(missing_ok=True)
+            self._reset()
+            self._load()
+            return True
+
+    # Search
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, nprobe=None, **kwargs):
+        rows, scores, document = self._search(embedding, k, nprobe)
+        results = []
+        for row, score in zip(rows, scores):
+            text, metadata = document(row)
+            results.append((Document(page_content=text, metadata=metadata), float(score)))
+        return results
+
+    def search(self, vector, k=4, nprobe=None):
+        """
+        Return (rows, scores) of the k most similar live vectors, best first.
+        Uses the IVF clusters when built, unless nprobe covers all of them.
+        """
+        rows, scores, _ = self._search(vector, k, nprobe)
+        return rows, scores
+
+    def _search(self, vector, k, nprobe):
+        # Also returns the documents the rows refer to, as a reload may replace them before they are read.
+        query = _unit_rows(vector)[0]
+        with self._lock:
+            self._refresh()
+            count = self._count
+            matrix = self._matrix
+            documents = self._documents()
+            nprobe = nprobe or self.nprobe
+            use_ivf = self._centroids is not None and nprobe < len(self._centroids)
+            if use_ivf:
+                probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+                inverted = self._inverted_lists()
+                candidates = np.concatenate([inverted[c] for c in probe])
+            else:
+                alive = self._alive[:count].copy()
+        # The scan itself runs outside the lock; numpy releases the GIL for it.
+        if count == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), documents
+        if use_ivf:
+            scores = matrix[candidates] @ query
+        else:
+            scores = matrix[:count] @ query
+            scores[~alive] = -np.inf
+            candidates = np.arange(count)
+        k = min(k, candidates.size)
+        if k == 0:
+            return candidates[:0], scores[:0], documents
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        return candidates[top], scores[top], documents
+
+    def _documents(self):
+        """
+        Return a function reading the (text, metadata) of a row as of now.
+        """
+        if not self.path:
+            texts, metadatas = self._texts, self._metadatas
+            return lambda row: (texts[row], metadatas[row])
+        log, offsets, lengths = self._log, self._offsets, self._lengths
+
+        def read(row):
+            with self._lock:
+                log.seek(offsets[row])
+                record = json.loads(log.read(lengths[row]))
+            return record['text'], record['metadata']
+        return read
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities in [-1, 1].
+        return lambda score: score
+
+    # Approximate search
+
+    def build_ivf(self, nlist=None, iterations=10, sample_size=100000, seed=0):
+        """
+        Cluster the live vectors into `nlist` inverted lists with spherical k-means.
+        """
+        with self._lock:
+            live = np.flatnonzero(self._alive[:self._count])
+            if live.size == 0:
+                return
+            nlist = min(nlist or max(1, int(np.sqrt(live.size))), live.size)
+            rng = np.random.default_rng(seed)
+            sample = self._matrix[rng.choice(live, min(sample_size, live.size), replace=False)]
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(nlist):
+                    members = sample[assignments == c]
+                    if len(members):
+                        centroids[c] = members.sum(axis=0)
+                centroids = _unit_rows(centroids)
+
+            self._centroids = centroids
+            self._assignments = np.zeros(len(self._alive), dtype=np.int32)
+            self._assign(0, self._count)
+            if self.path:
+                ivf = self._file(self.IVF_FILE)
+                np.savez(ivf, centroids=centroids, assignments=self._assignments[:self._count])
+                self._ivf_mtime = ivf.stat().st_mtime_ns
+
+    def _assign(self, start, stop):
+        for start in range(start, stop, 65536):
+            block = self._matrix[start:min(start + 65536, stop)]
+            self._assignments[start:start + len(block)] = np.argmax(block @ self._centroids.T, axis=1)
+        self._inverted = None
+
+    def _inverted_lists(self):
+        if self._inverted is None:
+            live = np.flatnonzero(self._alive[:self._count])
+            assignments = self._assignments[live]
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(len(self._centroids) + 1))
+            self._inverted = [live[order[bounds[c]:bounds[c + 1]]] for c in range(len(self._centroids))]
+        return self._inverted
+
+    # Storage
+
+    def _file(self, name, generation=None):
+        generation = self._generation if generation is None else generation
+        if not generation:
+            return self.path / name
+        stem, suffix = name.split('.', 1)
+        return self.path / f'{stem}.{generation}.{suffix}'
+
+    def _write_meta(self, generation):
+        meta = self.path / self.META_FILE
+        tmp = meta.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'dim': self._dim, 'generation': generation}))
+        os.replace(tmp, meta)
+
+    def _grow(self, capacity):
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - len(self._alive), dtype=bool)])
+        self._assignments = np.concatenate(
+            [self._assignments, np.zeros(capacity - len(self._assignments), dtype=np.int32)]
+        )
+        if self.path:
+            self._offsets = np.concatenate([self._offsets, np.zeros(capacity - len(self._offsets), dtype=np.int64)])
+            self._lengths = np.concatenate([self._lengths, np.zeros(capacity - len(self._lengths), dtype=np.int32)])
+
+    def _ensure_capacity(self, needed):
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        if self.path:
+            if self._matrix is None:
+                self._write_meta(self._generation)
+                self._file(self.DOCUMENTS_FILE).touch()
+                self._log = open(self._file(self.DOCUMENTS_FILE), 'rb')
+            else:
+                self._matrix.flush()
+                self._matrix = None
+            vectors_file = self._file(self.VECTORS_FILE)
+            with open(vectors_file, 'ab') as fh:
+                fh.truncate(capacity * self._dim * 4)
+            self._matrix = np.memmap(vectors_file, dtype=np.float32, mode='r+', shape=(capacity, self._dim))
+        else:
+            matrix = np.zeros((capacity, self._dim), dtype=np.float32)
+            if self._matrix is not None:
+                matrix[:self._count] = self._matrix[:self._count]
+            self._matrix = matrix
+        self._grow(capacity)
+
+    def _persist(self, records):
+        """
+        Append the records to the log; return the (offset, length) of each.
+        """
+        if not self.path:
+            return [(None, None)] * len(records)
+        if not records:
+            return []
+        self._matrix.flush()
+        lines = [(json.dumps(record) + '\n').encode() for record in records]
+        with open(self._file(self.DOCUMENTS_FILE), 'ab') as fh:
+            fh.writelines(lines)
+        spans = []
+        for line in lines:
+            spans.append((self._log_size, len(line)))
+            self._log_size += len(line)
+        return spans
+
+    def _apply(self, record, offset=None, length=None):
+        if record.get('deleted'):
+            row = self._rows.pop(record['id'], None)
+            if row is not None:
+                self._alive[row] = False
+            return
+        row = record['row']
+        old = self._rows.get(record['id'])
+        if old is not None:
+            self._alive[old] = False
+        if self.path:
+            self._offsets[row], self._lengths[row] = offset, length
+        else:
+            self._texts.append(record['text'])
+            self._metadatas.append(record['metadata'])
+        self._rows[record['id']] = row
+        self._alive[row] = True
+        self._count = max(self._count, row + 1)
+
+    def _load(self):
+        meta = self.path / self.META_FILE
+        if not meta.exists():
+            return
+        meta = json.loads(meta.read_text())
+        self._dim, self._generation = meta['dim'], meta.get('generation', 0)
+        try:
+            self._map_vectors()
+            self._log = open(self._file(self.DOCUMENTS_FILE), 'rb')
+            self._read_log()
+        except FileNotFoundError:
+            # Compacted meanwhile: start over from the new generation.
+            self._reset()
+            self._load()
+            return
+        self._load_ivf()
+
+    def _map_vectors(self):
+        vectors_file = self._file(self.VECTORS_FILE)
+        capacity = vectors_file.stat().st_size // (self._dim * 4)
+        if self._matrix is not None and capacity <= len(self._matrix):
+            return
+        self._matrix = np.memmap(vectors_file, dtype=np.float32, mode='r+', shape=(capacity, self._dim))
+        self._grow(capacity)
+
+    def _read_log(self):
+        # Reads the records appended since the last call; a line still being written is left for the next one.
+        start = self._count
+        with open(self._file(self.DOCUMENTS_FILE), 'rb') as fh:
+            fh.seek(self._log_size)
+            for line in fh:
+                if not line.endswith(b'\n'):
+                    break
+                self._apply(json.loads(line), self._log_size, len(line))
+                self._log_size += len(line)
+        self._inverted = None
+        if self._centroids is not None and self._count > start:
+            self._assign(start, self._count)
+
+    def _load_ivf(self):
+        ivf = self._file(self.IVF_FILE)
+        try:
+            mtime = ivf.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._ivf_mtime:
+            return
+        data = np.load(ivf)
+        self._centroids = data['centroids']
+        self._assignments[:len(data['assignments'])] = data['assignments']
+        self._ivf_mtime = mtime
+        # Rows added after the last build are assigned on the fly.
+        self._assign(len(data['assignments']), self._count)
+
+    def _refresh(self):
+        """
+        Catch up with another process writing the same path: re-read it all
+        after a compaction, otherwise only the newly appended records.
+        """
+        if not self.path or time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            meta = json.loads((self.path / self.META_FILE).read_text())
+        except FileNotFoundError:
+            return
+        if meta.get('generation', 0) != self._generation or self._dim is None:
+            self._reset()
+            self._load()
+            return
+        try:
+            if self._file(self.DOCUMENTS_FILE).stat().st_size > self._log_size:
+                self._map_vectors()
+                self._read_log()
+            self._load_ivf()
+        except FileNotFoundError:
+            self._reset()
+            self._load()
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path=None, **kwargs):
+        store = cls(embedding, path=path, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
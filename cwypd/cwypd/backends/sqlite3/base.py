@@ -0,0 +1,35 @@
+"""
+SQLite backend applying PRAGMAs to every new connection.
+
+Django 4.2 has no hook for per-connection SQLite settings, so this wrapper
+takes two extra OPTIONS on top of the sqlite3 ones:
+
+* `pragmas`: a dict run as `PRAGMA name = value` after connecting, e.g.
+  journal_mode=WAL so readers do not block the writer.
+* `transaction_mode`: 'IMMEDIATE' starts atomic blocks with BEGIN IMMEDIATE.
+  A deferred transaction that reads before it writes can fail with
+  "database is locked" when another connection wrote in between, instead of
+  waiting for busy_timeout.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute(f'BEGIN {self.transaction_mode}')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,67 @@
+"""
+Database profiles, selected with the CWYPD_DB_PROFILE environment variable.
+
+* `sqlite` (default): the development database, one connection per request
+  and BEGIN IMMEDIATE transactions. The first write to chatbot_message on a
+  new connection also reads the full-text index's configuration, which would
+  make every deferred write transaction one that reads before it writes.
+* `sqlite-wal`: single-node production on SQLite. WAL journal so reads do not
+  wait for the writer, synchronous=NORMAL (durable across application crashes,
+  may lose the last transactions on power loss), a busy timeout instead of
+  immediate "database is locked" errors, memory-mapped reads, BEGIN IMMEDIATE
+  transactions, and persistent connections.
+* `postgres`: PostgreSQL from the POSTGRES_* variables with persistent,
+  health-checked connections. Set PGBOUNCER=1 when connecting through
+  PgBouncer in transaction pooling mode; server-side cursors do not survive
+  that.
+"""
+import os
+
+PROFILES = ('sqlite', 'sqlite-wal', 'postgres')
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+
+
+def database_settings(profile, base_dir, environ=os.environ):
+    """
+    Return the settings.DATABASES['default'] dict of `profile`.
+    """
+    conn_max_age = int(environ.get('DB_CONN_MAX_AGE', 600))
+    if profile == 'sqlite':
+        return {
+            'ENGINE': 'cwypd.backends.sqlite3',
+            'NAME': base_dir / 'db.sqlite3',
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        }
+    if profile == 'sqlite-wal':
+        return {
+            'ENGINE': 'cwypd.backends.sqlite3',
+            'NAME': environ.get('SQLITE_PATH', base_dir / 'db.sqlite3'),
+            'CONN_MAX_AGE': conn_max_age,
+            'OPTIONS': {
+                'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+                'pragmas': SQLITE_PRAGMAS,
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    if profile == 'postgres':
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': environ.get('POSTGRES_DB', 'cwypd'),
+            'USER': environ.get('POSTGRES_USER', 'cwypd'),
+            'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': conn_max_age,
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': environ.get('PGBOUNCER') == '1',
+            'OPTIONS': {'connect_timeout': 5},
+        }
+    raise ValueError(f'Unknown CWYPD_DB_PROFILE {profile!r}; choose one of {", ".join(PROFILES)}')
@@ -1,140 +1,192 @@
-"""
-Django settings for cwypd project.
-
-Generated by 'django-admin startproject' using Django 4.2.7.
-
-For more information on this file, see
-https://docs.djangoproject.com/en/4.2/topics/settings/
-
-For the full list of settings and their values, see
-https://docs.djangoproject.com/en/4.2/ref/settings/
-"""
-
-from pathlib import Path
-from datetime import timedelta
-# Build paths inside the project like this: BASE_DIR / 'subdir'.
-BASE_DIR = Path(__file__).resolve().parent.parent
-
-
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
-
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-j-w_a$*ij1)pq&(i-xkp@p9-88l)96!j)h%b)gxc%a=tzgrva('
-
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
-
-ALLOWED_HOSTS = []
-
-
-# Application definition
-
-INSTALLED_APPS = [
-    'django.contrib.admin',
-    'django.contrib.auth',
-    'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
-    'accounts',
-    'rest_framework',
-    'rest_framework.authtoken',
-    'chatbot',
-    'corsheaders',
-]
-
-MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'corsheaders.middleware.CorsMiddleware',
-]
-CORS_ORIGIN_ALLOW_ALL = True
-ROOT_URLCONF = 'cwypd.urls'
-
-TEMPLATES = [
-    {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
-        'APP_DIRS': True,
-        'OPTIONS': {
-            'context_processors': [
-                'django.template.context_processors.debug',
-                'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
-            ],
-        },
-    },
-]
-SIMPLE_JWT = {
-    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
-    "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
-    "AUTH_HEADER_TYPES": ("Bearer",),
-}
-
-WSGI_APPLICATION = 'cwypd.wsgi.application'
-
-
-# Database
-# https://docs.djangoproject.com/en/4.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
-REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
-}
-
-
-# Password validation
-# https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
-
-AUTH_PASSWORD_VALIDATORS = [
-    {
-        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
-    },
-]
-
-
-# Internationalization
-# https://docs.djangoproject.com/en/4.2/topics/i18n/
-
-LANGUAGE_CODE = 'en-us'
-
-TIME_ZONE = 'UTC'
-
-USE_I18N = True
-
-USE_TZ = True
-
-
-# Static files (CSS, JavaScript, Images)
-# https://docs.djangoproject.com/en/4.2/howto/static-files/
-
-STATIC_URL = 'static/'
-
-# Default primary key field type
-# https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
-
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-AUTH_USER_MODEL = "accounts.User"
+"""
+Django settings for cwypd project.
+
+Generated by 'django-admin startproject' using Django 4.2.7.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/4.2/ref/settings/
+"""
+
+import os
+from pathlib import Path
+from datetime import timedelta
+
+from .databases import database_settings
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = 'django-insecure-j-w_a$*ij1)pq&(i-xkp@p9-88l)96!j)h%b)gxc%a=tzgrva('
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+ALLOWED_HOSTS = []
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'accounts',
+    'rest_framework',
+    'rest_framework.authtoken',
+    'chatbot',
+    'corsheaders',
+]
+
+MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack.
+    'chatbot.instrumentation.InstrumentationMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+]
+CORS_ORIGIN_ALLOW_ALL = True
+ROOT_URLCONF = 'cwypd.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+SIMPLE_JWT = {
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
+    "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    "AUTH_HEADER_TYPES": ("Bearer",),
+}
+
+WSGI_APPLICATION = 'cwypd.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# CWYPD_DB_PROFILE selects 'sqlite' (development), 'sqlite-wal' (single node)
+# or 'postgres'; see cwypd/databases.py.
+
+DATABASE_PROFILE = os.environ.get('CWYPD_DB_PROFILE', 'sqlite')
+
+DATABASES = {
+    'default': database_settings(DATABASE_PROFILE, BASE_DIR),
+}
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        # JWTAuthentication, with the user kept in the cache (see accounts/authentication.py).
+        'accounts.authentication.CachedJWTAuthentication',
+    )
+}
+# Seconds an authenticated user stays cached; 0 reads it on every request.
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Rate limits, shared admission slots and answer-cache invalidation only span
+# processes when the cache does: set CWYPD_REDIS_URL (e.g. redis://127.0.0.1:6379/0)
+# whenever more than one process serves requests or `manage.py ingest` runs
+# beside them. Without it each process has its own memory cache and the
+# answer cache stays off.
+
+if os.environ.get('CWYPD_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CWYPD_REDIS_URL'],
+        }
+    }
+
+# Chatbot / retrieval pipeline
+# Backends are dotted paths to factories taking this dict (see chatbot/backends.py).
+# Set CHATBOT_VECTORSTORE=chatbot.backends.local_vectorstore to use the in-process
+# index under LOCAL_INDEX_PATH instead of Pinecone.
+
+# The API keys come from the environment only; the OpenAI and Pinecone
+# backends refuse to start without them.
+
+CHATBOT = {
+    'EMBEDDINGS_BACKEND': 'chatbot.backends.openai_embeddings',
+    'VECTORSTORE_BACKEND': os.environ.get('CHATBOT_VECTORSTORE', 'chatbot.backends.pinecone_vectorstore'),
+    'LLM_BACKEND': 'chatbot.backends.openai_chat_model',
+    'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY', ''),
+    # Point at an OpenAI-compatible server, e.g. `python -m benchmarks.fake_openai`.
+    'OPENAI_API_BASE': os.environ.get('OPENAI_API_BASE', ''),
+    'OPENAI_MODEL': 'gpt-3.5-turbo',
+    'TEMPERATURE': 0.0,
+    'PINECONE_API_KEY': os.environ.get('PINECONE_API_KEY', ''),
+    'PINECONE_ENVIRONMENT': os.environ.get('PINECONE_ENVIRONMENT', 'gcp-starter'),
+    'PINECONE_INDEX_NAME': os.environ.get('PINECONE_INDEX_NAME', 'testindex'),
+    'LOCAL_INDEX_PATH': BASE_DIR / 'vector_index',
+    # Server-Timing headers and metrics/; CHATBOT_PROFILE_SLOW=0.5 also profiles slow requests.
+    'INSTRUMENTATION_ENABLED': os.environ.get('CHATBOT_INSTRUMENTATION') == '1',
+    'METRICS_TOKEN': os.environ.get('CHATBOT_METRICS_TOKEN', ''),
+    'PROFILE_SLOW_REQUESTS': float(os.environ['CHATBOT_PROFILE_SLOW']) if os.environ.get('CHATBOT_PROFILE_SLOW') else None,
+}
+
+
+# Password validation
+# https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/4.2/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/4.2/howto/static-files/
+
+STATIC_URL = 'static/'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+AUTH_USER_MODEL = "accounts.User"